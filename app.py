@@ -1,10 +1,17 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, send_file
+from flask import Flask, render_template, request, jsonify, send_from_directory, send_file, Response, stream_with_context, g
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from management.compare_texts import find_document_similarity, update_conversation_history, normalize_filename
+from management.file_index import get_filename_index, get_content_hash
+from management.chat_service import ChatService, format_sse_event
 from management.conversation_manager import ConversationManager
 from management.polly_tts import PollyTTSManager
 from management.image_extractor import ImageExtractor
+from management.page_extractor import PageExtractor, FORMATS as PAGE_FORMATS
+from management.semantic_cache import SemanticCache
+from management.llm_limiter import LLMLimiter, LLMOverloadedError
+from management.llm_providers import build_llm
+from management.turn_store import TurnStore
+from management.session_store import is_valid_session_id, new_session_id
+from management.metrics import observe_request, render_metrics
 import os
 import threading
 import time
@@ -12,12 +19,23 @@ import uuid
 import logging
 import atexit
 from werkzeug.utils import secure_filename
-import json, re
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+import json
 
 CONVERSATION_PATH = "./conversations"
 CHROMA_PATH = "./chroma_db"
 
-def create_app():
+# Length of the content-hash prefix used as the ?v= version of a PDF URL
+PDF_VERSION_LENGTH = 16
+
+def create_app(llm=None, polly_manager=None):
+    """Create the Flask application
+    
+    Args:
+        llm: optional LangChain chat model replacing the Groq client
+            (used by the benchmarks to run without network access)
+        polly_manager: optional PollyTTSManager replacing the default one
+    """
     app = Flask(__name__, static_folder='static', template_folder='templates')
     
     # Setup logging
@@ -27,16 +45,19 @@ def create_app():
     # Initialize managers and extractors
     conversation_manager = ConversationManager()
     image_extractor = ImageExtractor()
+    page_extractor = PageExtractor()
     logger.info("Starting application initialization...")
     
     # Initialize Polly TTS Manager
-    polly_manager = PollyTTSManager()
+    if polly_manager is None:
+        polly_manager = PollyTTSManager()
     if polly_manager.is_service_available():
         logger.info("Amazon Polly TTS service initialized successfully")
     else:
         logger.warning("Amazon Polly TTS service not available - check AWS credentials")
     
     # Pre-load embedding model and initialize Chroma DB
+    embeddings = None
     try:
         from management.embeddings import get_embedding_function
         from management.compare_texts import initialize_db
@@ -52,12 +73,38 @@ def create_app():
     load_dotenv()
     api_key = os.getenv('GROQ_API_KEY')
     
-    # Initialize LLM client
-    client = ChatGroq(
-        model="meta-llama/llama-4-scout-17b-16e-instruct",  # Using the larger model for better response quality
-        temperature=0.2,          # Low temperature for more consistent responses
-        api_key=api_key,
-    )
+    # Bound concurrent LLM calls and queue the excess instead of failing
+    llm_limiter = LLMLimiter()
+    
+    # Initialize LLM client (primary Groq model, hedged against a fallback model;
+    # hedges take their own limiter slots)
+    client = llm
+    if client is None:
+        client = build_llm(api_key, limiter=llm_limiter)
+    
+    # Semantic answer cache, sharing the query-embedding memo used by retrieval
+    # so a turn embeds its question only once
+    answer_cache = None
+    if embeddings is not None and os.getenv('SEMANTIC_CACHE_ENABLED', '1') == '1':
+        from management.embeddings import get_query_embeddings
+        answer_cache = SemanticCache(get_query_embeddings())
+        atexit.register(answer_cache.save)
+        logger.info("Semantic answer cache enabled")
+    
+    # Browser cache lifetime of PDFs: plain URLs are revalidated with the ETag
+    # after pdf_max_age, versioned (?v=<content hash>) URLs are immutable
+    pdf_max_age = int(os.getenv('PDF_CACHE_MAX_AGE_SECONDS', '3600'))
+    pdf_immutable_max_age = int(os.getenv('PDF_IMMUTABLE_MAX_AGE_SECONDS', '31536000'))
+    
+    # Sources and images of recent turns, for the /get_sources-style endpoints
+    turn_store = TurnStore()
+    
+    chat_service = ChatService(client, answer_cache=answer_cache, limiter=llm_limiter, turn_store=turn_store)
+    
+    # Share the long-lived services with the ASGI serving path (asgi.py)
+    app.extensions['chat_service'] = chat_service
+    app.extensions['polly_manager'] = polly_manager
+    app.extensions['llm_limiter'] = llm_limiter
     
     # Global flag for cleanup thread
     app.config['cleanup_thread_running'] = False
@@ -74,6 +121,9 @@ def create_app():
                 # Also cleanup orphaned images from the image extractor
                 image_extractor.cleanup_orphaned_images()
                 
+                # Expired chat turns (sources and images for the legacy endpoints)
+                turn_store.cleanup()
+                
                 logger.info("Cleanup completed, sleeping for 1 hour...")
                 
                 # Sleep for 1 hour, but check every minute if we should stop
@@ -103,10 +153,37 @@ def create_app():
     # Start the cleanup thread
     cleanup_thread = start_cleanup_thread()
     
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+    
+    @app.after_request
+    def record_request_metrics(response):
+        # Streaming responses are recorded when their body has been sent
+        started = g.get('request_started')
+        if started is not None and not response.is_streamed:
+            observe_request(request.endpoint or 'unmatched', response.status_code, time.perf_counter() - started)
+        return response
+    
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Expose latency histograms and counters in the Prometheus text format"""
+        body, content_type = render_metrics()
+        return Response(body, content_type=content_type)
+    
     @app.route('/', methods=['GET'])
     def chat_page():
         return render_template('chat.html')
     
+    @app.route('/session', methods=['POST'])
+    def create_session():
+        """Issue a session ID for server-side history (/chat and /chat_stream reject IDs not issued here)"""
+        try:
+            return jsonify({'session_id': new_session_id()})
+        except Exception as e:
+            logger.error(f"Error creating session: {str(e)}")
+            return jsonify({'error': 'Could not create a session'}), 500
+    
     @app.route('/chat', methods=['POST'])
     def chat():
         request_id = str(uuid.uuid4())
@@ -118,53 +195,40 @@ def create_app():
             user_identifier = data.get('user_identifier')
             conversation_history = data.get('conversation_history', [])
             language = data.get('language', None)
+            session_id = data.get('session_id')
             
             logger.debug(f"Request {request_id} - Processing message: {user_message[:50]}... in language: {language}")
             
-            # Step 1: Find relevant documents and create the prompt
-            full_prompt, updated_history = find_document_similarity(
-                user_message, 
-                conversation_history,
-                user_identifier,
-                language
-            )
-            
-            # Step 2: Call the LLM with the prompt
-            response = client.invoke(full_prompt).content
-            
-            # Step 3: Get relevant images for this response
-            relevant_images = []
-            if user_identifier:
-                filename = ''.join(c for c in user_identifier if c.isalnum())
-                images_path = os.path.join(CONVERSATION_PATH, f"{filename}_images.json")
-                
-                if os.path.exists(images_path):
-                    try:
-                        with open(images_path, 'r', encoding='utf-8') as f:
-                            image_data = json.load(f)
-                        
-                        # Add full URL paths for frontend
-                        for image in image_data:
-                            image['url'] = f"/static/extracted_images/{image['filename']}"
-                        
-                        relevant_images = image_data
-                        logger.debug(f"Found {len(relevant_images)} relevant images for response")
-                    except Exception as e:
-                        logger.error(f"Error loading images: {str(e)}")
-            
-            # Update conversation history with the new interaction
-            final_history = update_conversation_history(
-                updated_history, 
-                response,
-                user_identifier
-            )
+            if session_id is not None:
+                # Server-side history: only the new turn goes over the wire
+                if not is_valid_session_id(session_id):
+                    return jsonify({'error': 'Invalid session ID, request one from /session'}), 400
+                payload = chat_service.respond_session(
+                    user_message,
+                    session_id,
+                    language,
+                    data.get('since_turn')
+                )
+            else:
+                # Retrieve documents, call the LLM and record the new turn
+                payload = chat_service.respond(
+                    user_message,
+                    conversation_history,
+                    user_identifier,
+                    language
+                )
             
             logger.info(f"Request {request_id} - Successfully processed chat request")
-            return jsonify({
-                'response': response, 
-                'conversation_history': final_history,
-                'images': relevant_images  # Add images to response
+            return jsonify(payload)
+            
+        except LLMOverloadedError as e:
+            logger.warning(f"Request {request_id} - LLM overloaded: {str(e)}")
+            response = jsonify({
+                'error': 'The assistant is busy, please try again shortly',
+                'retry_after': e.retry_after
             })
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 503
             
         except Exception as e:
             logger.error(f"Request {request_id} - Error processing chat request: {str(e)}")
@@ -173,6 +237,86 @@ def create_app():
                 'details': str(e)
             }), 500
 
+    @app.route('/chat_stream', methods=['POST'])
+    def chat_stream():
+        """Stream the assistant response token by token as Server-Sent Events.
+        
+        Emits `token` events while the LLM generates, then a single `done`
+        event carrying the full response, sources, images and the updated
+        conversation history (or an `error` event if generation fails).
+        With a `session_id`, the history is kept on the server and `done`
+        carries only the new turn (plus `history_delta` if `since_turn` is sent).
+        """
+        request_id = str(uuid.uuid4())
+        logger.info(f"Received streaming chat request. ID: {request_id}")
+        
+        data = request.json or {}
+        user_message = data.get('msg')
+        if not user_message:
+            return jsonify({'error': 'No message provided'}), 400
+        
+        # Reject right away instead of opening a stream that would only queue
+        if llm_limiter.is_saturated():
+            retry_after = llm_limiter.retry_after()
+            response = jsonify({
+                'error': 'The assistant is busy, please try again shortly',
+                'retry_after': retry_after
+            })
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 503
+        
+        user_identifier = data.get('user_identifier')
+        conversation_history = data.get('conversation_history', [])
+        language = data.get('language', None)
+        session_id = data.get('session_id')
+        if session_id is not None and not is_valid_session_id(session_id):
+            return jsonify({'error': 'Invalid session ID, request one from /session'}), 400
+        
+        if session_id is not None:
+            events = chat_service.stream_session(user_message, session_id, language, data.get('since_turn'))
+        else:
+            events = chat_service.stream(user_message, conversation_history, user_identifier, language)
+        
+        started = time.perf_counter()
+        
+        def generate():
+            status_code = 200
+            try:
+                for event, payload in events:
+                    yield format_sse_event(event, payload)
+                
+                logger.info(f"Request {request_id} - Successfully streamed chat response")
+                
+            except LLMOverloadedError as e:
+                logger.warning(f"Request {request_id} - LLM overloaded: {str(e)}")
+                status_code = 503
+                yield format_sse_event('error', {
+                    'error': 'The assistant is busy, please try again shortly',
+                    'retry_after': e.retry_after
+                })
+                
+            except Exception as e:
+                logger.error(f"Request {request_id} - Error streaming chat response: {str(e)}")
+                status_code = 500
+                yield format_sse_event('error', {
+                    'error': 'An error occurred processing your request',
+                    'details': str(e)
+                })
+            
+            finally:
+                # Errors inside the stream are reported as events, so record the
+                # status the request would have had
+                observe_request('chat_stream', status_code, time.perf_counter() - started)
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'  # Disable proxy buffering (nginx)
+            }
+        )
+
     @app.route('/synthesize_speech', methods=['POST'])
     def synthesize_speech():
         """Endpoint to generate TTS audio using Amazon Polly"""
@@ -221,33 +365,33 @@ def create_app():
                 'error': str(e)
             })
 
+    @app.route('/llm_status', methods=['GET'])
+    def llm_status():
+        """Report LLM limiter depth, limit and wait times, and provider latencies"""
+        status = llm_limiter.stats()
+        if hasattr(client, 'stats'):
+            status['llm'] = client.stats()
+        return jsonify(status)
+
+    def find_turn(data):
+        """Resolve a turn from turn_id, or the latest turn of user_identifier (shared by all workers)"""
+        return turn_store.get(data.get('turn_id'), data.get('user_identifier'))
+
     @app.route('/get_images', methods=['POST'])
     def get_images():
-        """Get relevant images for a user session"""
+        """Get relevant images for a chat turn (also returned inline by /chat)"""
         try:
             data = request.json
             user_identifier = data.get('user_identifier')
             
-            if not user_identifier:
+            if not user_identifier and not data.get('turn_id'):
                 return jsonify({'error': 'User identifier not provided'}), 400
-                
-            # Create a safe filename
-            filename = ''.join(c for c in user_identifier if c.isalnum())
-            images_file_path = os.path.join(CONVERSATION_PATH, f"{filename}_images.json")
             
-            # Check if the images file exists
-            if not os.path.exists(images_file_path):
-                return jsonify({'images': []})
-                
-            # Load the images
-            with open(images_file_path, 'r', encoding='utf-8') as f:
-                images = json.load(f)
-                
-            # Add full URL paths for frontend
-            for image in images:
-                image['url'] = f"/static/extracted_images/{image['filename']}"
-                
-            return jsonify({'images': images})
+            turn = find_turn(data)
+            if turn is None:
+                return jsonify({'error': 'No turn found for this user'}), 404
+            
+            return jsonify({'images': turn['images'], 'turn_id': turn['turn_id']})
             
         except Exception as e:
             logger.error(f"Error in get_images: {str(e)}")
@@ -291,55 +435,15 @@ def create_app():
 
             # Define PDF directory
             pdf_directory = os.path.join(os.getcwd(), 'data')
-        
-            # List all files in the directory
-            available_files = os.listdir(pdf_directory)
             
-            # First, check for exact match
-            if filename in available_files:
-                matching_file = filename
-            else:
-                # Try to find a matching file using increasingly flexible methods
-                
-                # Method 1: Case-insensitive exact match
-                matching_file = next((f for f in available_files if f.lower() == filename.lower()), None)
-                
-                # Method 2: Normalized match (removing accents, spaces, etc.)
-                if not matching_file:
-                    normalized_request = normalize_filename(filename).lower()
-                    matching_file = next((f for f in available_files if normalize_filename(f).lower() == normalized_request), None)
-                
-                # Method 3: Partial match (filename is contained in actual file)
-                if not matching_file:
-                    matching_file = next((f for f in available_files if filename.lower() in f.lower()), None)
-                
-                # Method 4: Reversed partial match (actual file is contained in filename)
-                if not matching_file:
-                    for file in available_files:
-                        if file.lower() in filename.lower():
-                            matching_file = file
-                            break
-                
-                # Method 5: Keyword matching (for filenames with multiple words)
-                if not matching_file:
-                    # Extract words from the filename
-                    words = re.findall(r'\b\w{4,}\b', filename.lower())
-                    
-                    # Find files that contain the most matching keywords
-                    best_match = None
-                    most_matches = 0
-                    
-                    for file in available_files:
-                        matches = sum(1 for word in words if word in file.lower())
-                        if matches > most_matches:
-                            most_matches = matches
-                            best_match = file
-                    
-                    if most_matches > 0:
-                        matching_file = best_match
+            # Resolve the requested name through the cached filename index
+            # (exact, case-insensitive, normalized, partial and keyword matching)
+            pdf_index = get_filename_index(pdf_directory)
+            matching_file = pdf_index.find(filename)
             
             if not matching_file:
                 # If no match found, return the list of available files
+                available_files = pdf_index.files()
                 logger.warning(f"No matching file found for: {filename}")
                 logger.debug(f"Available files: {available_files}")
                 
@@ -390,25 +494,90 @@ def create_app():
                 logger.warning(f"Invalid file path attempted: {file_path}")
                 return jsonify({'error': 'Invalid file path'}), 403
 
+            # The ETag is the content hash, so caches are invalidated exactly when
+            # the PDF changes; a URL carrying that version (?v=) never changes
+            file_version = get_content_hash(file_path)
+            versioned = request.args.get('v') == file_version[:PDF_VERSION_LENGTH]
+            
             logger.info(f"Serving PDF file: {file_path}")
             response = send_from_directory(
                 pdf_directory,
                 matching_file,
-                as_attachment=True,
-                mimetype='application/pdf'
+                as_attachment=request.args.get('inline') != '1',
+                mimetype='application/pdf',
+                etag=file_version,
+                max_age=pdf_immutable_max_age if versioned else pdf_max_age,
+                conditional=True  # 304 for If-None-Match/If-Modified-Since, 206 for Range
             )
-        
-            # Add headers to prevent caching issues
-            response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-            response.headers["Pragma"] = "no-cache"
-            response.headers["Expires"] = "0"
+            if versioned:
+                response.cache_control.immutable = True
+            response.headers['X-Content-Version'] = file_version[:PDF_VERSION_LENGTH]
 
             return response
 
+        except RequestedRangeNotSatisfiable as e:
+            return e
+
         except Exception as e:
             logger.error(f"Error in download_pdf: {str(e)}")
             return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
     
+    @app.route('/source_page', methods=['GET'])
+    def source_page():
+        """Serve a cited page (or a small page window) as a tiny PDF or a PNG/WebP preview"""
+        try:
+            filename = request.args.get('filename')
+            page = request.args.get('page', type=int)
+            window = request.args.get('window', 0, type=int)
+            page_format = request.args.get('format', 'pdf').lower()
+            
+            if not filename or page is None:
+                return jsonify({'error': 'filename and page are required'}), 400
+            if page_format not in PAGE_FORMATS:
+                return jsonify({'error': f"format must be one of {', '.join(PAGE_FORMATS)}"}), 400
+            
+            pdf_directory = os.path.join(os.getcwd(), 'data')
+            matching_file = get_filename_index(pdf_directory).find(filename)
+            if not matching_file or not matching_file.lower().endswith('.pdf'):
+                logger.warning(f"No matching file found for: {filename}")
+                return jsonify({'error': 'Document not found'}), 404
+            
+            file_path = os.path.join(pdf_directory, matching_file)
+            if not os.path.commonpath([file_path, pdf_directory]) == pdf_directory:
+                logger.warning(f"Invalid file path attempted: {file_path}")
+                return jsonify({'error': 'Invalid file path'}), 403
+            
+            result = page_extractor.get_page(file_path, page, window=window, fmt=page_format)
+            if result is None:
+                return jsonify({'error': f'Page {page} not found in {matching_file}'}), 404
+            cache_path, mimetype = result
+            
+            # Cached renderings are content-addressed, so their name is a strong ETag
+            file_version = get_content_hash(file_path)
+            versioned = request.args.get('v') == file_version[:PDF_VERSION_LENGTH]
+            download_name = f"{os.path.splitext(matching_file)[0]} - page {page}.{PAGE_FORMATS[page_format][0]}"
+            
+            response = send_file(
+                cache_path,
+                mimetype=mimetype,
+                download_name=download_name,
+                etag=os.path.splitext(os.path.basename(cache_path))[0],
+                max_age=pdf_immutable_max_age if versioned else pdf_max_age,
+                conditional=True
+            )
+            if versioned:
+                response.cache_control.immutable = True
+            response.headers['X-Content-Version'] = file_version[:PDF_VERSION_LENGTH]
+            
+            return response
+        
+        except RequestedRangeNotSatisfiable as e:
+            return e
+        
+        except Exception as e:
+            logger.error(f"Error in source_page: {str(e)}")
+            return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+    
     @app.route('/static/<path:path>')
     def send_static(path):
         return send_from_directory('static', path)
@@ -419,22 +588,14 @@ def create_app():
             data = request.json
             user_identifier = data.get('user_identifier')
             
-            if not user_identifier:
+            if not user_identifier and not data.get('turn_id'):
                 return jsonify({'error': 'User identifier not provided'}), 400
-                
-            # Create a safe filename
-            filename = ''.join(c for c in user_identifier if c.isalnum())
-            sources_file_path = os.path.join(CONVERSATION_PATH, f"{filename}_sources.json")
             
-            # Check if the sources file exists
-            if not os.path.exists(sources_file_path):
+            turn = find_turn(data)
+            if turn is None:
                 return jsonify({'error': 'No sources found for this user'}), 404
-                
-            # Load the sources
-            with open(sources_file_path, 'r', encoding='utf-8') as f:
-                sources = json.load(f)
-                
-            return jsonify({'sources': sources})
+            
+            return jsonify({'sources': turn['sources'], 'turn_id': turn['turn_id']})
             
         except Exception as e:
             logger.error(f"Error in get_sources: {str(e)}")
@@ -448,22 +609,14 @@ def create_app():
             data = request.json
             user_identifier = data.get('user_identifier')
             
-            if not user_identifier:
+            if not user_identifier and not data.get('turn_id'):
                 return jsonify({'error': 'User identifier not provided'}), 400
-                
-            # Create a safe filename
-            filename = ''.join(c for c in user_identifier if c.isalnum())
-            sources_file_path = os.path.join(CONVERSATION_PATH, f"{filename}_sources.json")
             
-            # Check if the sources file exists
-            if not os.path.exists(sources_file_path):
+            turn = find_turn(data)
+            if turn is None:
                 return jsonify({'error': 'No sources found for this user'}), 404
-                
-            # Load the sources
-            with open(sources_file_path, 'r', encoding='utf-8') as f:
-                sources = json.load(f)
-                
-            return jsonify({'sources': sources})
+            
+            return jsonify({'sources': turn['sources'], 'turn_id': turn['turn_id']})
             
         except Exception as e:
             logger.error(f"Error in get_source_details: {str(e)}")
@@ -0,0 +1,194 @@
+"""
+Asyncio-native (ASGI) serving mode for EndoChat.
+
+The chat and TTS endpoints are served by async handlers that await the Groq
+and Polly round trips instead of pinning a worker thread per request. Every
+other route is forwarded to the regular Flask application.
+
+Run with:
+    uvicorn asgi:create_asgi_app --factory --host 0.0.0.0 --port 5000
+or under gunicorn:
+    gunicorn -k uvicorn.workers.UvicornWorker 'asgi:create_asgi_app()'
+"""
+
+import time
+import uuid
+import logging
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from app import create_app
+from management.chat_service import format_sse_event
+from management.llm_limiter import LLMOverloadedError
+from management.metrics import observe_request
+from management.session_store import is_valid_session_id
+
+logger = logging.getLogger(__name__)
+
+def create_asgi_app():
+    """Create the ASGI application wrapping the Flask app"""
+    flask_app = create_app()
+    chat_service = flask_app.extensions['chat_service']
+    polly_manager = flask_app.extensions['polly_manager']
+    llm_limiter = flask_app.extensions['llm_limiter']
+
+    def overloaded_response(retry_after):
+        return JSONResponse({
+            'error': 'The assistant is busy, please try again shortly',
+            'retry_after': retry_after
+        }, status_code=503, headers={'Retry-After': str(retry_after)})
+
+    def timed(endpoint, handler):
+        """Record request metrics for async handlers (Flask routes record their own)"""
+        async def wrapper(request):
+            started = time.perf_counter()
+            response = await handler(request)
+            if not isinstance(response, StreamingResponse):
+                observe_request(endpoint, response.status_code, time.perf_counter() - started)
+            return response
+        return wrapper
+
+    async def chat(request):
+        request_id = str(uuid.uuid4())
+        logger.info(f"Received async chat request. ID: {request_id}")
+
+        try:
+            data = await request.json()
+            session_id = data.get('session_id')
+            if session_id is not None:
+                if not is_valid_session_id(session_id):
+                    return JSONResponse({'error': 'Invalid session ID, request one from /session'}, status_code=400)
+                payload = await chat_service.arespond_session(
+                    data['msg'],
+                    session_id,
+                    data.get('language', None),
+                    data.get('since_turn')
+                )
+            else:
+                payload = await chat_service.arespond(
+                    data['msg'],
+                    data.get('conversation_history', []),
+                    data.get('user_identifier'),
+                    data.get('language', None)
+                )
+
+            logger.info(f"Request {request_id} - Successfully processed chat request")
+            return JSONResponse(payload)
+
+        except LLMOverloadedError as e:
+            logger.warning(f"Request {request_id} - LLM overloaded: {str(e)}")
+            return overloaded_response(e.retry_after)
+
+        except Exception as e:
+            logger.error(f"Request {request_id} - Error processing chat request: {str(e)}")
+            return JSONResponse({
+                'error': 'An error occurred processing your request',
+                'details': str(e)
+            }, status_code=500)
+
+    async def chat_stream(request):
+        request_id = str(uuid.uuid4())
+        logger.info(f"Received async streaming chat request. ID: {request_id}")
+
+        data = await request.json()
+        user_message = data.get('msg')
+        if not user_message:
+            return JSONResponse({'error': 'No message provided'}, status_code=400)
+
+        if llm_limiter.is_saturated():
+            return overloaded_response(llm_limiter.retry_after())
+
+        session_id = data.get('session_id')
+        if session_id is not None:
+            if not is_valid_session_id(session_id):
+                return JSONResponse({'error': 'Invalid session ID, request one from /session'}, status_code=400)
+            events = chat_service.astream_session(
+                user_message, session_id, data.get('language', None), data.get('since_turn')
+            )
+        else:
+            events = chat_service.astream(
+                user_message,
+                data.get('conversation_history', []),
+                data.get('user_identifier'),
+                data.get('language', None)
+            )
+
+        started = time.perf_counter()
+
+        async def generate():
+            status_code = 200
+            try:
+                async for event, payload in events:
+                    yield format_sse_event(event, payload)
+
+                logger.info(f"Request {request_id} - Successfully streamed chat response")
+
+            except LLMOverloadedError as e:
+                logger.warning(f"Request {request_id} - LLM overloaded: {str(e)}")
+                status_code = 503
+                yield format_sse_event('error', {
+                    'error': 'The assistant is busy, please try again shortly',
+                    'retry_after': e.retry_after
+                })
+
+            except Exception as e:
+                logger.error(f"Request {request_id} - Error streaming chat response: {str(e)}")
+                status_code = 500
+                yield format_sse_event('error', {
+                    'error': 'An error occurred processing your request',
+                    'details': str(e)
+                })
+
+            finally:
+                observe_request('chat_stream', status_code, time.perf_counter() - started)
+
+        return StreamingResponse(
+            generate(),
+            media_type='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+
+    async def synthesize_speech(request):
+        """Generate TTS audio using Amazon Polly without blocking a thread"""
+        try:
+            data = await request.json()
+            text = data.get('text', '')
+            language = data.get('language', 'en')
+
+            if not text.strip():
+                return JSONResponse({'error': 'No text provided'}, status_code=400)
+
+            if not polly_manager.is_service_available():
+                return JSONResponse({'error': 'TTS service not available'}, status_code=503)
+
+            audio_file_path = await polly_manager.asynthesize_speech(text, language)
+
+            if audio_file_path:
+                return JSONResponse({
+                    'success': True,
+                    'audio_url': f'/static/{audio_file_path}'
+                })
+            return JSONResponse({'error': 'Failed to generate audio'}, status_code=500)
+
+        except Exception as e:
+            logger.error(f"Error in synthesize_speech: {str(e)}")
+            return JSONResponse({'error': 'Internal server error'}, status_code=500)
+
+    routes = [
+        Route('/chat', timed('chat', chat), methods=['POST']),
+        Route('/chat_stream', timed('chat_stream', chat_stream), methods=['POST']),
+        Route('/synthesize_speech', timed('synthesize_speech', synthesize_speech), methods=['POST']),
+        # Everything else (pages, PDFs, sources, static files) stays on Flask
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ]
+
+    return Starlette(routes=routes)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(create_asgi_app(), host='0.0.0.0', port=5000)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Embedding backend benchmark: PyTorch (sentence-transformers) vs ONNX Runtime.
+
+Each backend runs in its own subprocess so that import time and memory are
+measured from a clean interpreter. For every backend the report contains
+model load time, resident memory (RSS) after loading and at peak, query
+latency (one question at a time, as on the chat path), ingestion throughput
+(chunk batches, as in load_data.py) and the smallest cosine similarity to
+the PyTorch embeddings of the same texts, checked against a tolerance.
+
+Run from the repository root (the model files must be downloadable or
+already in the Hugging Face cache):
+    python -m benchmarks.embeddings --backends torch,onnx,onnx-int8
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Minimum cosine similarity to the PyTorch embeddings for a backend to be
+# used against an index built with PyTorch
+TOLERANCES = {'onnx': 0.9999, 'onnx-int8': 0.98}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="PyTorch vs ONNX embedding benchmark")
+    parser.add_argument('--backends', default='torch,onnx,onnx-int8', help="Comma-separated backends to compare")
+    parser.add_argument('--queries', default=os.path.join(BENCHMARK_DIR, 'queries.json'),
+                        help="Query corpus (JSON list of {language, text})")
+    parser.add_argument('--query-rounds', type=int, default=5, help="Times the query corpus is embedded")
+    parser.add_argument('--chunks', type=int, default=512, help="Synthetic chunks embedded for ingestion")
+    parser.add_argument('--batch-size', type=int, default=32, help="Ingestion batch size")
+    parser.add_argument('--output', default=None, help="Write the JSON report to this file instead of stdout")
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--vectors', default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def memory_kb():
+    """Current and peak resident set size of this process, from /proc"""
+    usage = {}
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                name, value = line.split(':', 1)
+                usage[name] = int(value.split()[0])
+    return usage.get('VmRSS', 0), usage.get('VmHWM', 0)
+
+def load_texts(args):
+    with open(args.queries, 'r', encoding='utf-8') as f:
+        queries = [item['text'] for item in json.load(f)]
+    # Chunk-sized passages (~1000 characters, like the text splitter produces)
+    chunks = [' '.join(queries[(i + j) % len(queries)] for j in range(12))[:1000] for i in range(args.chunks)]
+    return queries, chunks
+
+def create_backend(name, batch_size):
+    if name == 'torch':
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=MODEL_NAME, encode_kwargs={'batch_size': batch_size})
+    from management.onnx_embeddings import OnnxEmbeddings
+    return OnnxEmbeddings.from_pretrained(MODEL_NAME, quantized=(name == 'onnx-int8'), batch_size=batch_size)
+
+def run_worker(args):
+    """Measure one backend in this process and print its results as JSON"""
+    queries, chunks = load_texts(args)
+    baseline_rss, _ = memory_kb()
+
+    started = time.perf_counter()
+    backend = create_backend(args.worker, args.batch_size)
+    backend.embed_query("warm up")
+    load_seconds = time.perf_counter() - started
+    loaded_rss, _ = memory_kb()
+
+    latencies = []
+    for _ in range(args.query_rounds):
+        for query in queries:
+            started = time.perf_counter()
+            backend.embed_query(query)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    chunk_vectors = backend.embed_documents(chunks)
+    ingestion_seconds = time.perf_counter() - started
+    _, peak_rss = memory_kb()
+
+    # Vectors of the same texts for the compatibility check in the parent
+    reference_texts = queries + chunks[:64]
+    np.save(args.vectors, np.asarray(backend.embed_documents(reference_texts), dtype=np.float32))
+
+    latencies_ms = np.asarray(latencies) * 1000.0
+    print(json.dumps({
+        'load_seconds': round(load_seconds, 3),
+        'rss_mb_after_load': round((loaded_rss - baseline_rss) / 1024.0, 1),
+        'rss_mb_total': round(loaded_rss / 1024.0, 1),
+        'rss_mb_peak': round(peak_rss / 1024.0, 1),
+        'query_p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+        'query_p95_ms': round(float(np.percentile(latencies_ms, 95)), 3),
+        'queries_per_second': round(len(latencies) / float(np.sum(latencies)), 1),
+        'ingestion_chunks_per_second': round(len(chunk_vectors) / ingestion_seconds, 1),
+        'dimensions': len(chunk_vectors[0])
+    }))
+
+def run_backend(args, name, vectors_path):
+    command = [
+        sys.executable, '-m', 'benchmarks.embeddings', '--worker', name, '--vectors', vectors_path,
+        '--queries', args.queries, '--query-rounds', str(args.query_rounds),
+        '--chunks', str(args.chunks), '--batch-size', str(args.batch_size)
+    ]
+    result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed'}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.worker:
+        run_worker(args)
+        return
+
+    from management.onnx_embeddings import min_cosine_similarity
+
+    workdir = tempfile.mkdtemp(prefix='endochat_embeddings_')
+    report = {'model': MODEL_NAME, 'batch_size': args.batch_size, 'backends': {}}
+    for name in [backend.strip() for backend in args.backends.split(',') if backend.strip()]:
+        report['backends'][name] = run_backend(args, name, os.path.join(workdir, f"{name}.npy"))
+
+    reference_path = os.path.join(workdir, 'torch.npy')
+    if not os.path.exists(reference_path):
+        report['note'] = "Compatibility not checked: the torch backend did not run"
+    else:
+        reference = np.load(reference_path)
+        for name, results in report['backends'].items():
+            vectors_path = os.path.join(workdir, f"{name}.npy")
+            if name == 'torch' or 'error' in results or not os.path.exists(vectors_path):
+                continue
+            similarity = min_cosine_similarity(reference, np.load(vectors_path))
+            results['min_cosine_vs_torch'] = round(similarity, 6)
+            results['compatible'] = similarity >= TOLERANCES.get(name, 0.98)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
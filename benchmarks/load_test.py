@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Offline load test for EndoChat.
+
+Boots create_app() against local stand-ins for Groq, Polly and the embedding
+model (see stubs.py), serves it on a local port and replays a multilingual query corpus at a fixed
+request rate against /chat, /synthesize_speech, /get_sources and
+/download_pdf. Latency percentiles, throughput and errors are reported as
+JSON.
+
+The load is open-loop: requests are sent on schedule whether or not earlier
+ones have finished, and latency is measured from the scheduled send time, so
+a saturated server shows up as growing latency instead of a lower request
+rate.
+
+Run from the repository root:
+    python -m benchmarks.load_test --rps 20 --duration 30 --output results.json
+
+By default the app runs in a throwaway working directory with synthetic PDFs;
+pass --workdir . to benchmark against the real data/ and chroma_db/.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from werkzeug.serving import make_server
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.stubs import FakeLLM, FakePollyClient, FakeEmbeddings
+
+DEFAULT_MIX = 'chat=5,synthesize_speech=2,get_sources=2,download_pdf=1'
+
+SYNTHETIC_PDFS = [
+    'Guide_Diabete_Type_1.pdf',
+    'Guide Diabète Type 2.pdf',
+    'Hypothyroidie_Traitement.pdf',
+    'Insulin_Therapy_Handbook.pdf',
+    'Adrenal_Insufficiency.pdf'
+]
+
+# Smallest well-formed one-page PDF
+MINIMAL_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for EndoChat")
+    parser.add_argument('--rps', type=float, default=10.0, help="Target requests per second")
+    parser.add_argument('--duration', type=float, default=30.0, help="Test duration in seconds")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Endpoint weights, e.g. chat=5,get_sources=1")
+    parser.add_argument('--users', type=int, default=20, help="Number of distinct user identifiers")
+    parser.add_argument('--queries', default=os.path.join(BENCHMARK_DIR, 'queries.json'),
+                        help="Query corpus (JSON list of {language, text})")
+    parser.add_argument('--workers', type=int, default=64, help="Maximum concurrent client requests")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed for the request sequence")
+    parser.add_argument('--workdir', default=None,
+                        help="Working directory for the app (default: temporary, with synthetic PDFs)")
+    parser.add_argument('--url', default=None,
+                        help="Benchmark an already running server instead of booting one (stubs are not used)")
+
+    # Stand-in behaviour
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="Fake LLM time to first token (s)")
+    parser.add_argument('--llm-tokens-per-sec', type=float, default=150.0, help="Fake LLM token rate")
+    parser.add_argument('--llm-tokens', type=int, default=60, help="Fake LLM answer length in tokens")
+    parser.add_argument('--polly-latency', type=float, default=0.3, help="Fake Polly latency (s)")
+    parser.add_argument('--tts-unique', type=float, default=0.5,
+                        help="Fraction of TTS requests with unique text (audio cache misses)")
+    parser.add_argument('--real-embeddings', action='store_true',
+                        help="Load the real embedding model instead of FakeEmbeddings (needs the model files)")
+
+    # Regression gates
+    parser.add_argument('--max-p95-ms', type=float, default=None, help="Fail if any endpoint p95 exceeds this")
+    parser.add_argument('--max-error-rate', type=float, default=None, help="Fail if the error rate exceeds this")
+    parser.add_argument('--output', default=None, help="Write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+def parse_mix(mix):
+    """Parse 'chat=5,get_sources=1' into a list of (endpoint, weight)"""
+    weights = []
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights.append((name.strip(), float(weight or 1)))
+    return weights
+
+def load_queries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def prepare_workdir(workdir):
+    """Create a working directory with synthetic PDFs when none is given"""
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='endochat_bench_')
+    data_dir = os.path.join(workdir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    if not any(f.lower().endswith('.pdf') for f in os.listdir(data_dir)):
+        for name in SYNTHETIC_PDFS:
+            with open(os.path.join(data_dir, name), 'wb') as f:
+                f.write(MINIMAL_PDF)
+    return workdir
+
+def boot_app(args, workdir):
+    """Create the app with fake backends and serve it on a free local port"""
+    os.chdir(workdir)
+
+    from app import create_app
+    from management import embeddings
+    from management.polly_tts import PollyTTSManager
+
+    # Installed before create_app() pre-loads the model, so nothing is downloaded
+    if not args.real_embeddings:
+        embeddings._embedding_instance = FakeEmbeddings()
+
+    llm = FakeLLM(args.llm_latency, args.llm_tokens_per_sec, args.llm_tokens)
+    polly_client = FakePollyClient(args.polly_latency)
+
+    # The stub is passed in so no boto3 client (or describe_voices call) is made
+    polly_manager = PollyTTSManager(client=polly_client)
+
+    app = create_app(llm=llm, polly_manager=polly_manager)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", llm, polly_client
+
+def pdf_names(workdir):
+    """Requested PDF names: exact, lower-cased and loosely spelled variants"""
+    data_dir = os.path.join(workdir, 'data') if workdir else 'data'
+    try:
+        files = sorted(f for f in os.listdir(data_dir) if f.lower().endswith('.pdf'))
+    except OSError:
+        files = []
+    names = []
+    for f in files or SYNTHETIC_PDFS:
+        names.extend([f, f.lower(), f.replace('_', ' ')])
+    return names
+
+def create_sessions(base_url, count, timeout):
+    """Get one server-issued session ID per simulated user"""
+    with httpx.Client(base_url=base_url, timeout=timeout) as client:
+        return [client.post('/session').json()['session_id'] for _ in range(count)]
+
+def build_plan(args, queries, pdfs, sessions):
+    """Build the request sequence: (endpoint, method, path, kwargs) per request"""
+    rng = random.Random(args.seed)
+    weights = parse_mix(args.mix)
+    endpoints = [name for name, _ in weights]
+    total = int(args.rps * args.duration)
+
+    plan = []
+    for i in range(total):
+        endpoint = rng.choices(endpoints, weights=[w for _, w in weights])[0]
+        query = rng.choice(queries)
+        user_index = rng.randrange(args.users)
+        user = f"bench{user_index}"
+
+        if endpoint == 'chat':
+            request = ('POST', '/chat', {'json': {
+                'msg': query['text'],
+                'session_id': sessions[user_index],
+                'language': query['language']
+            }})
+        elif endpoint == 'synthesize_speech':
+            text = query['text']
+            if rng.random() < args.tts_unique:
+                text = f"{text} ({i})"
+            request = ('POST', '/synthesize_speech', {'json': {'text': text, 'language': query['language']}})
+        elif endpoint == 'get_sources':
+            request = ('POST', '/get_sources', {'json': {'user_identifier': user}})
+        elif endpoint == 'download_pdf':
+            request = ('GET', '/download_pdf', {'params': {'filename': rng.choice(pdfs)}})
+        else:
+            raise ValueError(f"Unknown endpoint in --mix: {endpoint}")
+
+        plan.append((endpoint,) + request)
+    return plan
+
+def run_load(base_url, plan, rps, workers, timeout):
+    """Send the planned requests on an open-loop schedule
+
+    Returns:
+        tuple: (samples, elapsed) where samples are (endpoint, status, latency)
+        and status is None for transport errors
+    """
+    samples = []
+    samples_lock = threading.Lock()
+    client = httpx.Client(
+        base_url=base_url,
+        timeout=timeout,
+        limits=httpx.Limits(max_connections=workers, max_keepalive_connections=workers)
+    )
+
+    def send(endpoint, method, path, kwargs, scheduled):
+        try:
+            status = client.request(method, path, **kwargs).status_code
+        except httpx.HTTPError:
+            status = None
+        latency = time.perf_counter() - scheduled
+        with samples_lock:
+            samples.append((endpoint, status, latency))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, (endpoint, method, path, kwargs) in enumerate(plan):
+            scheduled = started + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, endpoint, method, path, kwargs, scheduled)
+    elapsed = time.perf_counter() - started
+    client.close()
+    return samples, elapsed
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def is_error(status):
+    return status is None or status >= 500
+
+def summarize(samples, elapsed):
+    """Aggregate samples into per-endpoint and overall statistics"""
+    def stats(group):
+        latencies = sorted(latency for _, _, latency in group)
+        status_codes = {}
+        for _, status, _ in group:
+            key = str(status) if status is not None else 'transport_error'
+            status_codes[key] = status_codes.get(key, 0) + 1
+        errors = sum(1 for _, status, _ in group if is_error(status))
+        return {
+            'requests': len(group),
+            'errors': errors,
+            'error_rate': round(errors / len(group), 4) if group else 0.0,
+            'throughput_rps': round(len(group) / elapsed, 2) if elapsed else 0.0,
+            'status_codes': status_codes,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50) * 1000, 1),
+                'p95': round(percentile(latencies, 95) * 1000, 1),
+                'p99': round(percentile(latencies, 99) * 1000, 1),
+                'mean': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+                'max': round(latencies[-1] * 1000, 1) if latencies else 0.0
+            }
+        }
+
+    endpoints = {}
+    for endpoint in sorted({s[0] for s in samples}):
+        endpoints[endpoint] = stats([s for s in samples if s[0] == endpoint])
+
+    return {'overall': stats(samples), 'endpoints': endpoints}
+
+def check_gates(report, max_p95_ms, max_error_rate):
+    """Return the list of failed regression gates"""
+    failures = []
+    if max_p95_ms is not None:
+        for endpoint, stats in report['endpoints'].items():
+            if stats['latency_ms']['p95'] > max_p95_ms:
+                failures.append(f"{endpoint} p95 {stats['latency_ms']['p95']} ms > {max_p95_ms} ms")
+    if max_error_rate is not None and report['overall']['error_rate'] > max_error_rate:
+        failures.append(f"error rate {report['overall']['error_rate']} > {max_error_rate}")
+    return failures
+
+def main(argv=None):
+    args = parse_args(argv)
+    queries = load_queries(args.queries)
+
+    cleanup_dir = None
+    llm = polly_client = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+        pdfs = pdf_names(args.workdir)
+    else:
+        workdir = prepare_workdir(args.workdir)
+        if args.workdir is None:
+            cleanup_dir = workdir
+        pdfs = pdf_names(workdir)
+        base_url, llm, polly_client = boot_app(args, workdir)
+
+    sessions = create_sessions(base_url, args.users, args.timeout)
+    plan = build_plan(args, queries, pdfs, sessions)
+    samples, elapsed = run_load(base_url, plan, args.rps, args.workers, args.timeout)
+
+    report = summarize(samples, elapsed)
+    report['config'] = {
+        'target_rps': args.rps,
+        'duration_seconds': args.duration,
+        'mix': args.mix,
+        'users': args.users,
+        'workers': args.workers,
+        'url': args.url,
+        'llm_latency': args.llm_latency,
+        'llm_tokens_per_sec': args.llm_tokens_per_sec,
+        'llm_tokens': args.llm_tokens,
+        'polly_latency': args.polly_latency,
+        'tts_unique': args.tts_unique,
+        'real_embeddings': args.real_embeddings
+    }
+    report['elapsed_seconds'] = round(elapsed, 2)
+    if llm is not None:
+        report['upstream_calls'] = {'llm': llm.calls, 'polly': polly_client.calls}
+
+    failures = check_gates(report, args.max_p95_ms, args.max_error_rate)
+    report['gate_failures'] = failures
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(os.path.join(REPO_ROOT, args.output) if not os.path.isabs(args.output) else args.output,
+                  'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if cleanup_dir:
+        shutil.rmtree(cleanup_dir, ignore_errors=True)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    exit_code = main()
+    sys.stdout.flush()
+    # The app's cleanup thread is not a daemon; exit without waiting for it
+    os._exit(exit_code)
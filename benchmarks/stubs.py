@@ -0,0 +1,119 @@
+"""
+Local stand-ins for Groq, Amazon Polly and the embedding model used by the
+benchmarks.
+
+The Groq and Polly stubs sleep to simulate upstream latency so the app under
+test behaves like it does in production (threads blocked on I/O, limiter
+queues filling up) without any network access or credentials.
+"""
+
+import io
+import time
+import asyncio
+import hashlib
+import numpy as np
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+WORDS = (
+    "insulin glucose thyroid hormone gland pancreas metabolism cortisol "
+    "pituitary adrenal treatment symptoms diagnosis levels blood patient "
+    "doctor therapy dose monitoring"
+).split()
+
+class FakeLLM:
+    """Chat model with a configurable time to first token and token rate
+
+    Implements the subset of the LangChain chat model interface used by
+    ChatService: invoke, stream, ainvoke and astream.
+    """
+
+    def __init__(self, first_token_latency=0.5, tokens_per_second=150.0, response_tokens=60):
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.calls = 0
+
+    def _tokens(self, prompt):
+        """Deterministic answer for a prompt, so identical prompts get identical answers"""
+        seed = int(hashlib.md5(str(prompt).encode('utf-8')).hexdigest(), 16)
+        return [WORDS[(seed >> (i % 64)) % len(WORDS)] + ' ' for i in range(self.response_tokens)]
+
+    def _token_delay(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        tokens = self._tokens(prompt)
+        time.sleep(self.first_token_latency + self._token_delay() * len(tokens))
+        return AIMessage(content=''.join(tokens).strip())
+
+    def stream(self, prompt):
+        self.calls += 1
+        time.sleep(self.first_token_latency)
+        for token in self._tokens(prompt):
+            time.sleep(self._token_delay())
+            yield AIMessageChunk(content=token)
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        tokens = self._tokens(prompt)
+        await asyncio.sleep(self.first_token_latency + self._token_delay() * len(tokens))
+        return AIMessage(content=''.join(tokens).strip())
+
+    async def astream(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.first_token_latency)
+        for token in self._tokens(prompt):
+            await asyncio.sleep(self._token_delay())
+            yield AIMessageChunk(content=token)
+
+class FakePollyClient:
+    """Stub of the boto3 Polly client returning silent MP3-sized payloads"""
+
+    def __init__(self, latency=0.3, bytes_per_char=200):
+        self.latency = latency
+        self.bytes_per_char = bytes_per_char
+        self.calls = 0
+
+    def synthesize_speech(self, Text, OutputFormat='mp3', VoiceId=None, Engine=None, SampleRate=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {
+            'AudioStream': io.BytesIO(b'\x00' * (len(Text) * self.bytes_per_char)),
+            'ContentType': 'audio/mpeg'
+        }
+
+    def describe_voices(self):
+        return {'Voices': [
+            {'Id': 'Joanna', 'LanguageCode': 'en-US', 'SupportedEngines': ['neural']},
+            {'Id': 'Lea', 'LanguageCode': 'fr-FR', 'SupportedEngines': ['neural']},
+            {'Id': 'Zeina', 'LanguageCode': 'arb', 'SupportedEngines': ['standard']}
+        ]}
+
+class FakeEmbeddings:
+    """Deterministic unit vectors in place of the MiniLM model
+
+    Each text maps to a pseudo-random vector seeded by its hash; texts listed
+    in `vectors` get that vector instead, so a benchmark can lay out a corpus
+    with a known geometry.
+    """
+
+    def __init__(self, dimensions=384, vectors=None):
+        self.dimensions = dimensions
+        self.vectors = vectors or {}
+        self.calls = 0
+
+    def _embed(self, text):
+        if text in self.vectors:
+            return [float(x) for x in self.vectors[text]]
+        seed = int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+        return [float(x) for x in vector / np.linalg.norm(vector)]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return self._embed(text)
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [self._embed(text) for text in texts]
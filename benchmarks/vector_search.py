@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Vector search benchmark: Chroma vs the NumPy vector index.
+
+Builds a throwaway Chroma database of synthetic chunks (384-dimensional unit
+vectors grouped around topic centroids, like MiniLM embeddings of a handful
+of guidelines), exports it with export_vector_index and runs the same
+queries through both backends. Reports per-query latency percentiles and
+how often the NumPy top-k (exact) matches Chroma's (HNSW, approximate),
+then memory, latency and recall@k of the int8 index against the exact
+float32 search.
+
+Run from the repository root:
+    python -m benchmarks.vector_search --chunks 5000 --queries 500
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.stubs import FakeEmbeddings
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chroma vs NumPy vector search benchmark")
+    parser.add_argument('--chunks', type=int, default=3000, help="Number of synthetic chunks")
+    parser.add_argument('--queries', type=int, default=300, help="Number of timed queries")
+    parser.add_argument('--topics', type=int, default=40, help="Number of topic clusters")
+    parser.add_argument('--dimensions', type=int, default=384, help="Embedding dimensions")
+    parser.add_argument('--k', type=int, default=5, help="Results per query")
+    parser.add_argument('--rescore-factor', type=int, default=4,
+                        help="Candidates rescored in float32 per result, for the compact precisions")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed")
+    parser.add_argument('--output', default=None, help="Write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+def unit_rows(matrix):
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+def synthetic_corpus(args, rng):
+    """Chunk vectors scattered around topic centroids, plus queries near random chunks"""
+    centroids = unit_rows(rng.standard_normal((args.topics, args.dimensions)))
+    topics = rng.integers(0, args.topics, args.chunks)
+    noise = 1.0 / np.sqrt(args.dimensions)  # Unit-norm noise on average
+    chunks = unit_rows(centroids[topics] + 2.0 * noise * rng.standard_normal((args.chunks, args.dimensions)))
+    targets = rng.integers(0, args.chunks, args.queries)
+    queries = unit_rows(chunks[targets] + 1.5 * noise * rng.standard_normal((args.queries, args.dimensions)))
+    return chunks.astype(np.float32), queries.astype(np.float32)
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000.0
+    return {
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3)
+    }
+
+def time_queries(search, queries, k):
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        docs = search(query.tolist(), k=k)
+        latencies.append(time.perf_counter() - started)
+        results.append(docs)
+    return latencies, results
+
+def main(argv=None):
+    args = parse_args(argv)
+    output_path = os.path.abspath(args.output) if args.output else None
+    rng = np.random.default_rng(args.seed)
+    chunk_vectors, queries = synthetic_corpus(args, rng)
+
+    workdir = tempfile.mkdtemp(prefix='endochat_vectors_')
+    os.chdir(workdir)
+    try:
+        from langchain_community.vectorstores import Chroma
+        from management.vector_index import export_vector_index, load_vector_index, NumpyVectorIndex
+
+        texts = [f"chunk {i}" for i in range(args.chunks)]
+        embeddings = FakeEmbeddings(args.dimensions, vectors=dict(zip(texts, chunk_vectors)))
+        metadatas = [
+            {'source': f"data/Guide_{i % 12}.pdf", 'page': i % 80, 'page_label': str(i % 80 + 1), 'id': f"c{i}"}
+            for i in range(args.chunks)
+        ]
+
+        started = time.perf_counter()
+        db = Chroma(persist_directory=os.path.join(workdir, 'chroma_db'), embedding_function=embeddings)
+        for start in range(0, args.chunks, 1000):
+            db.add_texts(texts[start:start + 1000], metadatas=metadatas[start:start + 1000],
+                         ids=[m['id'] for m in metadatas[start:start + 1000]])
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        export_vector_index(db)
+        export_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index = NumpyVectorIndex(embeddings, precision='float32')
+        load_seconds = time.perf_counter() - started
+
+        # Warm up both paths before timing
+        for query in queries[:10]:
+            db.similarity_search_by_vector_with_relevance_scores(query.tolist(), k=args.k)
+            index.similarity_search_by_vector_with_relevance_scores(query.tolist(), k=args.k)
+
+        chroma_latencies, chroma_results = time_queries(
+            db.similarity_search_by_vector_with_relevance_scores, queries, args.k)
+        numpy_latencies, numpy_results = time_queries(
+            index.similarity_search_by_vector_with_relevance_scores, queries, args.k)
+
+        # int8 against the exact float32 search (recall@k), with and without rescoring
+        exact_ids = [[doc.metadata['id'] for doc, _ in docs] for docs in numpy_results]
+        precisions = {'float32': {'memory_bytes': index.memory_bytes(), **percentiles(numpy_latencies)}}
+        for rescore_factor in (0, args.rescore_factor):
+            compact = NumpyVectorIndex(embeddings, precision='int8', rescore_factor=rescore_factor)
+            latencies, results = time_queries(
+                compact.similarity_search_by_vector_with_relevance_scores, queries, args.k)
+            recall = np.mean([
+                len(set(expected) & {doc.metadata['id'] for doc, _ in docs}) / args.k
+                for expected, docs in zip(exact_ids, results)
+            ])
+            name = f"int8_rescore{rescore_factor}" if rescore_factor else 'int8'
+            precisions[name] = {
+                'memory_bytes': compact.memory_bytes(),
+                f"recall_at_{args.k}": round(float(recall), 4),
+                **percentiles(latencies)
+            }
+
+        overlap = []
+        max_score_gap = 0.0
+        for chroma_docs, numpy_docs in zip(chroma_results, numpy_results):
+            chroma_ids = [doc.metadata['id'] for doc, _ in chroma_docs]
+            numpy_ids = [doc.metadata['id'] for doc, _ in numpy_docs]
+            overlap.append(len(set(chroma_ids) & set(numpy_ids)) / args.k)
+            chroma_scores = {doc.metadata['id']: score for doc, score in chroma_docs}
+            for doc, score in numpy_docs:
+                if doc.metadata['id'] in chroma_scores:
+                    max_score_gap = max(max_score_gap, abs(chroma_scores[doc.metadata['id']] - score))
+
+        report = {
+            'chunks': args.chunks,
+            'queries': args.queries,
+            'dimensions': args.dimensions,
+            'k': args.k,
+            'chroma_build_seconds': round(build_seconds, 3),
+            'export_seconds': round(export_seconds, 3),
+            'numpy_load_seconds': round(load_seconds, 3),
+            'chroma': percentiles(chroma_latencies),
+            'numpy': percentiles(numpy_latencies),
+            'speedup_p50': round(float(np.percentile(chroma_latencies, 50) / np.percentile(numpy_latencies, 50)), 1),
+            'top_k_overlap': round(float(np.mean(overlap)), 4),
+            'max_score_difference': round(max_score_gap, 6),
+            'precisions': precisions
+        }
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
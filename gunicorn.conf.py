@@ -0,0 +1,52 @@
+"""
+Gunicorn settings for EndoChat.
+
+With several workers, export PROMETHEUS_MULTIPROC_DIR (an empty, writable
+directory) before starting gunicorn so /metrics aggregates all workers.
+
+With RETRIEVAL_SERVICE_SPAWN=1 the master starts the shared retrieval
+service (management/retrieval_service.py) before forking, and every worker
+uses it instead of loading its own embedding model and vector store.
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+_retrieval_service = None
+
+def on_starting(server):
+    """Start the shared retrieval service when RETRIEVAL_SERVICE_SPAWN=1"""
+    global _retrieval_service
+    if os.getenv('RETRIEVAL_SERVICE_SPAWN', '0') != '1':
+        return
+    from management.retrieval_service import DEFAULT_SOCKET_PATH
+    socket_path = os.environ.setdefault('RETRIEVAL_SERVICE_SOCKET', DEFAULT_SOCKET_PATH)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    _retrieval_service = subprocess.Popen(
+        [sys.executable, '-m', 'management.retrieval_service', '--socket', socket_path])
+
+    # Wait for the model to load so the first requests do not fail
+    deadline = time.time() + float(os.getenv('RETRIEVAL_SERVICE_START_TIMEOUT_SECONDS', '300'))
+    while not os.path.exists(socket_path):
+        if _retrieval_service.poll() is not None or time.time() > deadline:
+            raise RuntimeError("Retrieval service failed to start")
+        time.sleep(0.2)
+    server.log.info(f"Retrieval service (pid {_retrieval_service.pid}) listening on {socket_path}")
+
+def on_exit(server):
+    """Stop the retrieval service started by on_starting"""
+    if _retrieval_service is not None and _retrieval_service.poll() is None:
+        _retrieval_service.terminate()
+        try:
+            _retrieval_service.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _retrieval_service.kill()
+
+def child_exit(server, worker):
+    """Drop the metric files of a worker that exited"""
+    from management.metrics import mark_worker_dead
+    mark_worker_dead(worker.pid)
@@ -7,7 +7,11 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from langchain_community.vectorstores import Chroma
 from management.embeddings import get_embedding_function
+from management.corpus_version import new_corpus_version
 from management.image_extractor import extract_images_from_documents
+from management.vector_index import export_vector_index, vector_index_is_current
+from management.lexical_index import export_lexical_index, lexical_index_is_current
+from management.image_index import export_image_index
 
 # Define paths
 CHROMA_PATH = "./chroma_db"
@@ -28,9 +32,10 @@ class PDFProcessor:
         return {}
     
     def save_processed_files(self):
-        """Save the record of processed files"""
-        with open(PROCESSED_FILES_PATH, 'w') as f:
+        """Save the record of processed files (atomically: workers read its corpus stamp)"""
+        with open(f"{PROCESSED_FILES_PATH}.tmp", 'w') as f:
             json.dump(self.processed_files, f, indent=2)
+        os.replace(f"{PROCESSED_FILES_PATH}.tmp", PROCESSED_FILES_PATH)
             
     def needs_processing(self, pdf_path):
         """Check if a PDF needs to be processed based on modification time"""
@@ -92,6 +97,9 @@ class PDFProcessor:
                                  if chunk.metadata['source'] == pdf_path])
                 }
             
+            # New corpus stamp: invalidates retrieval and answer caches in every worker
+            version = new_corpus_version(self.processed_files)
+            logging.info(f"Corpus version is now {version}")
             self.save_processed_files()
             return True
             
@@ -199,6 +207,27 @@ class PDFProcessor:
         except Exception as e:
             logging.exception("Exception occurred in add_documents_to_chroma")
 
+    def refresh_indexes(self):
+        """Rebuild the NumPy vector snapshot and the BM25 lexical index if they are stale"""
+        try:
+            vector_current = vector_index_is_current()
+            lexical_current = lexical_index_is_current()
+            if vector_current and lexical_current:
+                logging.debug("Vector and lexical indexes are up to date")
+                return True
+            db = Chroma(
+                persist_directory=CHROMA_PATH, 
+                embedding_function=get_embedding_function()
+            )
+            if not vector_current:
+                export_vector_index(db)
+            if not lexical_current:
+                export_lexical_index(db)
+            return True
+        except Exception as e:
+            logging.exception("Exception occurred in refresh_indexes")
+            return False
+
     def calculate_chunk_ids(self, chunks):
         """Calculate unique IDs for chunks"""
         logging.debug("Calculating IDs for document chunks")
@@ -244,6 +273,10 @@ def process_endocrinology_documents():
             logging.error("Text processing failed")
             return False
         
+        # Keep the NumPy snapshot (VECTOR_BACKEND=numpy) and the lexical index
+        # used by hybrid retrieval in sync with Chroma
+        processor.refresh_indexes()
+        
         # Step 2: Extract images from PDFs
         logging.info("Starting image extraction from PDFs...")
         image_success = extract_images_from_documents()
@@ -252,6 +285,12 @@ def process_endocrinology_documents():
             logging.warning("Image extraction failed, but continuing with text-only processing")
         else:
             logging.info("Image extraction completed successfully")
+            
+            # Step 3: Embed image descriptions and page context for image search
+            try:
+                export_image_index(get_embedding_function())
+            except Exception as e:
+                logging.exception("Exception occurred while building the image index")
         
         toc = time.time()
         logging.debug(f"Process completed in {(toc - tic):.2f} seconds")
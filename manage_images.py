@@ -156,6 +156,8 @@ def add_image_descriptions(extractor):
                     print_status("Failed to add description", "error")
         
         print_status(f"Added descriptions to {descriptions_added} images", "success")
+        if descriptions_added:
+            print("Run load_data.py to update the image search index.")
         
     except (ValueError, KeyboardInterrupt):
         print_status("Operation cancelled", "warning")
@@ -179,6 +181,8 @@ def bulk_add_descriptions(extractor):
     
     updated_count = extractor.update_image_descriptions(sample_descriptions)
     print_status(f"Updated {updated_count} image descriptions", "success")
+    if updated_count:
+        print("Run load_data.py to update the image search index.")
 
 def main():
     """Main function"""
@@ -0,0 +1,321 @@
+import json
+import time
+import asyncio
+import uuid
+import hashlib
+import logging
+from contextlib import nullcontext
+from management.compare_texts import find_document_similarity, update_conversation_history
+from management.single_flight import SingleFlight, AsyncSingleFlight
+from management.llm_limiter import LLMOverloadedError, is_rate_limit_error
+from management.text_normalization import normalize_query
+from management.session_store import SessionStore
+from management.metrics import stage_timer, observe_stage, count_cache, count_error
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+def format_sse_event(event, payload):
+    """Format a payload as a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+class ChatService:
+    """Runs the chat pipeline shared by the WSGI (Flask) and ASGI serving paths"""
+
+    def __init__(self, llm, answer_cache=None, limiter=None, turn_store=None, session_store=None):
+        """Initialize the chat service with a LangChain chat model
+        
+        Args:
+            llm: LangChain chat model used to generate answers
+            answer_cache: optional SemanticCache consulted before calling the LLM
+            limiter: optional LLMLimiter bounding concurrent LLM calls
+            turn_store: optional TurnStore keeping each turn's sources and images
+            session_store: optional SessionStore holding server-side histories
+        """
+        self.llm = llm
+        self.answer_cache = answer_cache
+        self.limiter = limiter
+        self.turn_store = turn_store
+        self.session_store = session_store or SessionStore()
+        
+        # Identical concurrent questions share one LLM call
+        self.llm_flight = SingleFlight('llm')
+        self.async_llm_flight = AsyncSingleFlight('llm')
+
+    def _slot(self):
+        return self.limiter.slot() if self.limiter is not None else nullcontext()
+
+    def _aslot(self):
+        return self.limiter.aslot() if self.limiter is not None else nullcontext()
+
+    def _overloaded(self, error):
+        """Turn an upstream 429 into LLMOverloadedError so callers can answer 503"""
+        retry_after = self.limiter.retry_after() if self.limiter is not None else 1
+        return LLMOverloadedError("LLM provider is rate limiting requests", retry_after)
+
+    def _invoke(self, prompt):
+        queued = time.perf_counter()
+        try:
+            with self._slot():
+                observe_stage('llm_queue', time.perf_counter() - queued)
+                with stage_timer('llm'):
+                    return self.llm.invoke(prompt).content
+        except Exception as e:
+            count_error('llm')
+            if is_rate_limit_error(e):
+                raise self._overloaded(e) from e
+            raise
+
+    def _stream(self, prompt):
+        queued = time.perf_counter()
+        try:
+            with self._slot():
+                started = time.perf_counter()
+                observe_stage('llm_queue', started - queued)
+                first_token = True
+                with stage_timer('llm'):
+                    for chunk in self.llm.stream(prompt):
+                        if chunk.content:
+                            if first_token:
+                                observe_stage('llm_first_token', time.perf_counter() - started)
+                                first_token = False
+                            yield chunk.content
+        except Exception as e:
+            count_error('llm')
+            if is_rate_limit_error(e):
+                raise self._overloaded(e) from e
+            raise
+
+    async def _ainvoke(self, prompt):
+        queued = time.perf_counter()
+        try:
+            async with self._aslot():
+                observe_stage('llm_queue', time.perf_counter() - queued)
+                with stage_timer('llm'):
+                    return (await self.llm.ainvoke(prompt)).content
+        except Exception as e:
+            count_error('llm')
+            if is_rate_limit_error(e):
+                raise self._overloaded(e) from e
+            raise
+
+    async def _astream(self, prompt):
+        queued = time.perf_counter()
+        try:
+            async with self._aslot():
+                started = time.perf_counter()
+                observe_stage('llm_queue', started - queued)
+                first_token = True
+                with stage_timer('llm'):
+                    async for chunk in self.llm.astream(prompt):
+                        if chunk.content:
+                            if first_token:
+                                observe_stage('llm_first_token', time.perf_counter() - started)
+                                first_token = False
+                            yield chunk.content
+        except Exception as e:
+            count_error('llm')
+            if is_rate_limit_error(e):
+                raise self._overloaded(e) from e
+            raise
+
+    def prepare(self, user_message, conversation_history, user_identifier=None, language=None):
+        """Find relevant documents, build the prompt and check the answer cache
+        
+        Returns:
+            dict: the turn state passed on to finalize()
+        """
+        full_prompt, updated_history, context = find_document_similarity(
+            user_message,
+            conversation_history,
+            user_identifier,
+            language,
+            return_context=True
+        )
+
+        # Identical questions with the same prior history produce the same prompt
+        history_digest = hashlib.sha1(
+            json.dumps(conversation_history, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+
+        # The retrieval context may be shared with concurrent requests: copy, never mutate
+        sources = [dict(source) for source in context['sources']] if context else []
+        images = []
+        for image in (context['images'] if context else []):
+            image = dict(image)
+            image['url'] = f"/static/extracted_images/{image['filename']}"
+            images.append(image)
+        
+        turn = {
+            'turn_id': uuid.uuid4().hex,
+            'message': user_message,
+            'language': language,
+            'flight_key': (normalize_query(user_message), language, history_digest),
+            'prompt': full_prompt,
+            'history': updated_history,
+            'context': context,
+            'sources': sources,
+            'images': images,
+            'query_vector': None,
+            'cached_response': None
+        }
+
+        # Only standalone questions are cached: follow-ups depend on the history
+        if self.answer_cache is not None and context is not None and not conversation_history:
+            try:
+                with stage_timer('semantic_cache'):
+                    turn['query_vector'] = self.answer_cache.embed(user_message)
+                    turn['cached_response'] = self.answer_cache.lookup(
+                        turn['query_vector'], language, context['chunk_ids']
+                    )
+                count_cache('semantic', turn['cached_response'] is not None)
+            except Exception as e:
+                logger.error(f"Error checking semantic cache: {str(e)}")
+                count_error('semantic_cache')
+
+        return turn
+
+    def finalize(self, turn, response, user_identifier=None):
+        """Record the assistant response and build the response payload"""
+        if (self.answer_cache is not None and turn['query_vector'] is not None
+                and turn['cached_response'] is None and response.strip()):
+            try:
+                self.answer_cache.store(
+                    turn['query_vector'], turn['language'], turn['context']['chunk_ids'],
+                    turn['message'], response
+                )
+            except Exception as e:
+                logger.error(f"Error updating semantic cache: {str(e)}")
+
+        with stage_timer('history_update'):
+            final_history = update_conversation_history(
+                turn['history'],
+                response,
+                user_identifier
+            )
+
+        if self.turn_store is not None:
+            self.turn_store.record(turn['turn_id'], user_identifier, turn['sources'], turn['images'])
+        
+        return {
+            'response': response,
+            'conversation_history': final_history,
+            'turn_id': turn['turn_id'],
+            'sources': turn['sources'],
+            'images': turn['images']
+        }
+
+    def respond(self, user_message, conversation_history, user_identifier=None, language=None):
+        """Run the full chat pipeline and return the response payload"""
+        turn = self.prepare(user_message, conversation_history, user_identifier, language)
+
+        response = turn['cached_response']
+        if response is None:
+            response = self.llm_flight.do(turn['flight_key'], self._invoke, turn['prompt'])
+        return self.finalize(turn, response, user_identifier)
+
+    def stream(self, user_message, conversation_history, user_identifier=None, language=None):
+        """Run the chat pipeline, yielding (event, payload) pairs as tokens arrive"""
+        turn = self.prepare(user_message, conversation_history, user_identifier, language)
+
+        if turn['cached_response'] is not None:
+            yield 'token', {'content': turn['cached_response']}
+            yield 'done', self.finalize(turn, turn['cached_response'], user_identifier)
+            return
+
+        chunks = []
+        for content in self.llm_flight.do_stream(turn['flight_key'], self._stream, turn['prompt']):
+            chunks.append(content)
+            yield 'token', {'content': content}
+
+        yield 'done', self.finalize(turn, ''.join(chunks), user_identifier)
+
+    async def arespond(self, user_message, conversation_history, user_identifier=None, language=None):
+        """Async variant of respond() for the ASGI serving path.
+
+        Retrieval and the small JSON writes are CPU/local-disk work and run
+        briefly in the default executor; the Groq round trip is awaited
+        without holding a thread.
+        """
+        turn = await asyncio.to_thread(
+            self.prepare, user_message, conversation_history, user_identifier, language
+        )
+
+        response = turn['cached_response']
+        if response is None:
+            response = await self.async_llm_flight.do(turn['flight_key'], self._ainvoke, turn['prompt'])
+        return await asyncio.to_thread(self.finalize, turn, response, user_identifier)
+
+    async def astream(self, user_message, conversation_history, user_identifier=None, language=None):
+        """Async variant of stream() for the ASGI serving path"""
+        turn = await asyncio.to_thread(
+            self.prepare, user_message, conversation_history, user_identifier, language
+        )
+
+        if turn['cached_response'] is not None:
+            yield 'token', {'content': turn['cached_response']}
+            yield 'done', await asyncio.to_thread(self.finalize, turn, turn['cached_response'], user_identifier)
+            return
+
+        chunks = []
+        async for content in self.async_llm_flight.do_stream(turn['flight_key'], self._astream, turn['prompt']):
+            chunks.append(content)
+            yield 'token', {'content': content}
+
+        payload = await asyncio.to_thread(self.finalize, turn, ''.join(chunks), user_identifier)
+        yield 'done', payload
+
+    # Server-side sessions: the client sends only the new message and its
+    # session ID, and receives only the entries added by this turn.
+
+    def session_payload(self, payload, session_id, base_length, since_turn=None):
+        """Replace the full history in a payload with the new entries
+        
+        Args:
+            payload: payload returned by finalize()
+            session_id: session the turn belongs to
+            base_length: history length before this turn
+            since_turn: optional history length the client already has; the
+                entries after it are returned as history_delta
+        """
+        history = payload.pop('conversation_history')
+        self.session_store.remember(session_id, history)
+        
+        payload['session_id'] = session_id
+        payload['history_length'] = len(history)
+        payload['turn'] = history[base_length:]
+        if since_turn is not None:
+            payload['history_delta'] = history[max(0, min(int(since_turn), len(history))):]
+        return payload
+
+    def respond_session(self, user_message, session_id, language=None, since_turn=None):
+        """respond() with the history kept on the server"""
+        with self.session_store.session_lock(session_id):
+            history = self.session_store.history(session_id)
+            payload = self.respond(user_message, history, session_id, language)
+            return self.session_payload(payload, session_id, len(history), since_turn)
+
+    def stream_session(self, user_message, session_id, language=None, since_turn=None):
+        """stream() with the history kept on the server"""
+        with self.session_store.session_lock(session_id):
+            history = self.session_store.history(session_id)
+            for event, payload in self.stream(user_message, history, session_id, language):
+                if event == 'done':
+                    payload = self.session_payload(payload, session_id, len(history), since_turn)
+                yield event, payload
+
+    async def arespond_session(self, user_message, session_id, language=None, since_turn=None):
+        """Async variant of respond_session()"""
+        async with self.session_store.async_session_lock(session_id):
+            history = await asyncio.to_thread(self.session_store.history, session_id)
+            payload = await self.arespond(user_message, history, session_id, language)
+            return self.session_payload(payload, session_id, len(history), since_turn)
+
+    async def astream_session(self, user_message, session_id, language=None, since_turn=None):
+        """Async variant of stream_session()"""
+        async with self.session_store.async_session_lock(session_id):
+            history = await asyncio.to_thread(self.session_store.history, session_id)
+            async for event, payload in self.astream(user_message, history, session_id, language):
+                if event == 'done':
+                    payload = self.session_payload(payload, session_id, len(history), since_turn)
+                yield event, payload
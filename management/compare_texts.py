@@ -2,9 +2,19 @@ import logging
 import os
 import json
 import re
-import unicodedata
+import hashlib
+import threading
 from langchain_chroma import Chroma
-from management.embeddings import get_embedding_function
+from management.embeddings import get_embedding_function, get_query_embeddings
+from management.lexical_index import get_lexical_index, hybrid_search, search_by_vector, vector_space
+from management.retrieval_cache import get_retrieval_cache
+from management.working_set import get_working_sets
+from management.corpus_version import get_corpus_version
+from langchain_core.documents import Document
+from management.file_index import normalize_filename  # Re-exported for existing imports
+from management.single_flight import SingleFlight
+from management.text_normalization import normalize_query
+from management.metrics import stage_timer, count_error
 
 # Define paths
 CHROMA_PATH = "./chroma_db"
@@ -13,21 +23,62 @@ CONVERSATION_PATH = "./conversations"
 # Define the maximum size of conversation history to retain
 MAX_HISTORY_ITEMS = 10
 
+# Number of chunks retrieved for the prompt
+RETRIEVAL_K = int(os.getenv('RETRIEVAL_K', '5'))
+
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Global variable to store the database instance
 _db_instance = None
+# What the NumPy vector index in _db_instance was loaded from (see _db_signature)
+_db_version = None
+_db_lock = threading.Lock()
+
+# Collapses identical concurrent retrievals into a single search
+_retrieval_flight = SingleFlight('retrieval')
+
+def _db_signature():
+    """Corpus version and snapshot file the NumPy vector index depends on, or None for other backends
+    
+    load_data.py records the new corpus version before it exports the
+    snapshot (chunks.json is written last), so both are part of the key.
+    """
+    if os.getenv('RETRIEVAL_SERVICE_SOCKET') or os.getenv('VECTOR_BACKEND', 'chroma') != 'numpy':
+        return None
+    from management.vector_index import VECTOR_INDEX_PATH, CHUNKS_FILE
+    try:
+        stat = os.stat(os.path.join(VECTOR_INDEX_PATH, CHUNKS_FILE))
+        snapshot = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        snapshot = None
+    return (get_corpus_version(), snapshot)
 
 def initialize_db(embedding_function=None):
     """Initialize and cache the database connection"""
-    global _db_instance
+    global _db_instance, _db_version
     try:
+        _db_version = _db_signature()
+        
+        # Shared retrieval service (see retrieval_service.py): the store lives in that process
+        if os.getenv('RETRIEVAL_SERVICE_SOCKET'):
+            from management.retrieval_service import RetrievalClient
+            _db_instance = RetrievalClient()
+            return _db_instance
+            
         if embedding_function is None:
             from management.embeddings import get_embedding_function
             embedding_function = get_embedding_function()
             
+        # Optional in-memory backend for the query path (see vector_index.py)
+        if os.getenv('VECTOR_BACKEND', 'chroma') == 'numpy':
+            from management.vector_index import load_vector_index
+            _db_instance = load_vector_index(embedding_function)
+            if _db_instance is not None:
+                return _db_instance
+            logger.warning("NumPy vector index unavailable, falling back to Chroma")
+            
         # Initialize the database connection
         from langchain_community.vectorstores import Chroma
         _db_instance = Chroma(
@@ -41,28 +92,21 @@ def initialize_db(embedding_function=None):
         return None
 
 def get_db():
-    """Get the database instance, initializing it if needed"""
-    global _db_instance
-    if _db_instance is None:
-        return initialize_db()
-    return _db_instance
-
-def normalize_filename(filename):
-    """Normalize a filename to make comparisons reliable"""
-    # Convert to lowercase
-    filename = filename.lower()
-    
-    # Remove accents
-    filename = ''.join(c for c in unicodedata.normalize('NFD', filename)
-                      if unicodedata.category(c) != 'Mn')
+    """Get the database instance, initializing it if needed
     
-    # Remove file extension
-    filename = os.path.splitext(filename)[0]
-    
-    # Remove special characters and spaces
-    filename = re.sub(r'[^a-z0-9]', '', filename)
+    The NumPy vector index is an in-memory snapshot, so it is reopened
+    when the corpus version or the exported snapshot changes.
+    """
+    version = _db_signature()
+    if _db_instance is not None and version == _db_version:
+        return _db_instance
     
-    return filename
+    with _db_lock:
+        if _db_instance is None or version != _db_version:
+            if _db_instance is not None:
+                logger.info("Document corpus changed, reopening the vector index")
+            return initialize_db()
+        return _db_instance
 
 def generate_conversation_summary(conversation_history):
     """Generate a summary of the conversation history"""
@@ -83,89 +127,41 @@ def generate_conversation_summary(conversation_history):
         logger.error(f"Error in generate_conversation_summary: {str(e)}")
         return ""
 
-def semantic_search_images(user_message, language='en'):
-    """Smart image detection based on content topics"""
+def semantic_search_images(user_message, language='en', query_vector=None, pages=None):
+    """Smart image detection based on content topics
+    
+    Images whose topic keywords (image_topics.json) occur in the message
+    come first, then the images on the pages of the retrieved chunks
+    (pages: (PDF filename, 1-based page) pairs, best chunk first, up to
+    IMAGE_PAGE_MAX_RESULTS), then the images whose description and page
+    text are closest to the question's embedding, when query_vector is given.
+    """
     try:
-        from management.image_extractor import ImageExtractor
-        extractor = ImageExtractor()
-        
-        # Load image metadata
-        all_images = extractor.get_all_images()
-        if not all_images:
-            return []
-        
-        query_lower = user_message.lower()
-        relevant_images = []
-        
-        # Define topic keywords for each of the 3 images
-        image_topics = {
-            # Image 1: Programme de formation en insulinothérapie fonctionnelle en Hospitalier
-            "1 résumé IF_page7_img1_dabc8c47.png": {
-                "keywords": [
-                    # French
-                    "insulinothérapie fonctionnelle", "programme de formation", "formation", "programme", 
-                    "insulinothérapie", "éducation thérapeutique", "apprentissage", "hospitalier",
-                    "enseignement", "formation diabète", "programme diabète",
-                    # English
-                    "functional insulin therapy", "training program", "education program", "therapeutic education",
-                    "insulin therapy training", "diabetes education", "hospital training", "learning program",
-                    # Arabic
-                    "برنامج تدريب", "العلاج بالأنسولين", "التعليم العلاجي", "برنامج تعليمي"
-                ]
-            },
-            
-            # Image 2: Gestion de l'hypoglycémie
-            "PrefinalISPADChapter11FR_page10_img1_fce5948d.png": {
-                "keywords": [
-                    # French
-                    "hypoglycmie", "gestion hypoglycémie", "traitement hypoglycémie", "sucre bas",
-                    "glycémie basse", "correction hypoglycémie", "protocole hypoglycémie",
-                    # English  
-                    "hypoglycemia", "low blood sugar", "hypoglycemia management", "low glucose",
-                    "treating hypoglycemia", "hypoglycemia treatment", "low sugar", "glucose correction",
-                    # Arabic
-                    "نقص السكر", "انخفاض السكر", "علاج نقص السكر", "سكر منخفض"
-                ]
-            },
-            
-            # Image 3: Glycemic Targets
-            "PrefinalISPADChapter8FR_page3_img1_4ffe260e.png": {
-                "keywords": [
-                    # French
-                    "objectifs glycémiques", "cibles glycémiques", "glycémie cible", "hba1c",
-                    "objectifs diabète", "contrôle glycémique", "valeurs cibles", "surveillance glycémique",
-                    # English
-                    "glycemic targets", "blood sugar targets", "glucose targets", "hba1c targets",
-                    "diabetes targets", "glycemic control", "target values", "glucose monitoring",
-                    "blood glucose goals", "sugar levels goals",
-                    # Arabic
-                    "أهداف السكر", "مستويات السكر المستهدفة", "مراقبة السكر", "أهداف الجلوكوز"
-                ]
-            }
-        }
-        
-        # Check which images are relevant to the user's message
-        for image_filename, topic_data in image_topics.items():
-            score = 0
-            
-            # Check if any keywords match
-            for keyword in topic_data["keywords"]:
-                if keyword.lower() in query_lower:
-                    score += 1
-            
-            # If we have matches, find the actual image data
-            if score > 0:
-                for image in all_images:
-                    if image["filename"] == image_filename:
-                        relevant_images.append({
-                            'score': score,
-                            'image': image
-                        })
-                        break
-        
-        # Sort by relevance score and return
-        relevant_images.sort(key=lambda x: x['score'], reverse=True)
-        final_images = [item['image'] for item in relevant_images]
+        from management.image_topics import get_image_topic_index
+        from management.image_index import get_image_vector_index
+        topic_index = get_image_topic_index()
+        final_images = topic_index.search(user_message)
+        found = {image['filename'] for image in final_images}
+        
+        # Images co-located with the retrieved chunks: one lookup per page
+        page_limit = int(os.getenv('IMAGE_PAGE_MAX_RESULTS', '3'))
+        page_images = 0
+        for source_pdf, page_number in pages or []:
+            for image in topic_index.get_page_images(source_pdf, page_number):
+                if page_images >= page_limit:
+                    break
+                if image['filename'] not in found:
+                    final_images.append(image)
+                    found.add(image['filename'])
+                    page_images += 1
+        
+        if query_vector is not None:
+            for filename, similarity in get_image_vector_index().search(query_vector):
+                image = topic_index.get_image(filename)
+                if image is not None and filename not in found:
+                    logger.debug(f"Image {filename} matched by embedding (similarity {similarity:.3f})")
+                    final_images.append(image)
+                    found.add(filename)
         
         if final_images:
             logger.info(f"Found {len(final_images)} relevant images for topic: {user_message[:50]}...")
@@ -174,89 +170,224 @@ def semantic_search_images(user_message, language='en'):
         
     except Exception as e:
         logger.error(f"Error in semantic_search_images: {str(e)}")
+        count_error('image_search')
         return []
 
-def find_document_similarity(user_message, conversation_history, user_identifier=None, language=None):
-    """Find similar documents to the user message and generate the prompt"""
+def find_relevant_documents(user_message, language=None, session_id=None):
+    """Retrieve the chunks, sources and images relevant to the user message
+    
+    Concurrent requests for the same normalized question and language share
+    a single search; the returned dict must therefore be treated as read-only.
+    With a session_id, follow-up questions are first answered from the
+    chunks recently retrieved for that session (see working_set.py).
+    
+    Returns:
+        dict: 'query_vector' (the question's embedding), 'docs' (list of
+        (Document, score) pairs kept for the prompt), 'chunk_ids', 'sources'
+        (filename/page pairs) and 'images'; with working sets enabled, a
+        full search also returns 'chunk_vectors' (chunk ID -> embedding)
+    """
+    working_sets = get_working_sets() if session_id and _working_sets_enabled() else None
+    if working_sets is not None:
+        context = _search_working_set(working_sets, session_id, user_message, language)
+        if context is not None:
+            return context
+    
+    context = _retrieval_flight.do(
+        (normalize_query(user_message), language),
+        _search_relevant_documents,
+        user_message,
+        language
+    )
+    
+    if working_sets is not None:
+        _record_working_set(working_sets, session_id, context)
+    return context
+
+def _working_sets_enabled():
+    """Per-session working sets are opt-in until their recall is measured against full search"""
+    return os.getenv('WORKING_SET_ENABLED', '0') == '1'
+
+def _search_working_set(working_sets, session_id, user_message, language):
+    """Build the context from the session's working set, or None to search the full index"""
     try:
-        # Generate conversation summary
-        history_text = generate_conversation_summary(conversation_history)
-        
-        # Get the database instance
         db = get_db()
         if db is None:
-            raise Exception("Failed to initialize database connection")
-        
-        # Retrieve relevant documents
-        docs = db.similarity_search_with_score(user_message, k=5)
-        
-        # Format documents and track sources
-        formatted_docs = []
-        actual_sources = []
+            return None
+        with stage_timer('retrieval'):
+            query_vector = get_query_embeddings().embed_query(user_message)
+            docs = working_sets.search(session_id, query_vector, vector_space(db), RETRIEVAL_K)
+        if docs is None:
+            return None
+        logger.debug(f"Answered retrieval from the working set of session {session_id}")
+        return _build_context(user_message, language, query_vector, docs)
+    except Exception as e:
+        logger.error(f"Error searching the session working set: {str(e)}")
+        count_error('working_set')
+        return None
+
+def _record_working_set(working_sets, session_id, context):
+    """Add the chunks of a full search to the session's working set
+    
+    The chunk embeddings come with the search results (chunk_vectors), so
+    recording costs no extra store call.
+    """
+    try:
+        known = working_sets.known_chunks(session_id)
+        vectors = context.get('chunk_vectors') or {}
+        chunks = []
+        for doc, _ in context['docs']:
+            chunk_id = doc.metadata.get('id') or getattr(doc, 'id', None)
+            if chunk_id not in known and chunk_id in vectors:
+                chunks.append((doc, vectors[chunk_id]))
+        working_sets.record(session_id, context['query_vector'], chunks)
+    except Exception as e:
+        logger.error(f"Error recording the session working set: {str(e)}")
+        count_error('working_set')
+
+def _load_chunks(db, results, vectors=None):
+    """Fetch cached (chunk ID, score) results from the store as (Document, score) pairs, or None"""
+    if not results:
+        return []  # Chroma rejects a get() with no IDs
+    include = ['documents', 'metadatas'] if vectors is None else ['documents', 'metadatas', 'embeddings']
+    data = db.get(ids=[chunk_id for chunk_id, _ in results], include=include)
+    if vectors is not None:
+        vectors.update(zip(data['ids'], data['embeddings']))
+    chunks = {
+        chunk_id: Document(page_content=text or '', metadata=metadata or {}, id=chunk_id)
+        for chunk_id, text, metadata in zip(data['ids'], data['documents'], data['metadatas'])
+    }
+    if len(chunks) != len(results):
+        return None
+    return [(chunks[chunk_id], score) for chunk_id, score in results]
+
+def _retrieve(db, user_message, query_vector, vectors=None):
+    """Search the chunks for a question, memoized until the corpus version changes
+    
+    With a vectors dict, the embeddings of the chunks found are added to it.
+    """
+    lexical_index = get_lexical_index() if os.getenv('RETRIEVAL_MODE', 'hybrid') == 'hybrid' else None
+    cache = get_retrieval_cache() if os.getenv('RETRIEVAL_CACHE_ENABLED', '1') == '1' else None
+    key = (normalize_query(user_message), RETRIEVAL_K, 'hybrid' if lexical_index is not None else 'vector')
+    version = get_corpus_version()
+    
+    if cache is not None:
+        results = cache.get(key)
+        if results is not None:
+            docs = _load_chunks(db, results, vectors)
+            if docs is not None:
+                return docs
+    
+    if lexical_index is not None:
+        docs = hybrid_search(db, lexical_index, user_message, query_vector, k=RETRIEVAL_K, vectors=vectors)
+    else:
+        docs = search_by_vector(db, query_vector, RETRIEVAL_K, vectors)
+    
+    if cache is not None:
+        results = [(doc.metadata.get('id') or getattr(doc, 'id', None), float(score)) for doc, score in docs]
+        if all(chunk_id for chunk_id, _ in results):
+            cache.put(key, results, version)
+    return docs
+
+def _search_relevant_documents(user_message, language=None):
+    """Run the vector search and image detection behind find_relevant_documents"""
+    # Get the database instance
+    db = get_db()
+    if db is None:
+        raise Exception("Failed to initialize database connection")
+    
+    # Embed the question once (memoized), then search by vector, fused with
+    # BM25 over the lexical index when it is available
+    # (keeping the chunk embeddings for the session working sets)
+    vectors = {} if _working_sets_enabled() else None
+    with stage_timer('retrieval'):
+        query_vector = get_query_embeddings().embed_query(user_message)
+        docs = _retrieve(db, user_message, query_vector, vectors)
+    
+    context = _build_context(user_message, language, query_vector, docs)
+    if vectors is not None:
+        context['chunk_vectors'] = vectors
+    return context
+
+def _build_context(user_message, language, query_vector, docs):
+    """Filter the retrieved chunks, collect their sources and find the images to show"""
+    # Keep relevant documents and track sources
+    relevant_docs = []
+    chunk_ids = []
+    actual_sources = []
+    chunk_pages = []  # (PDF filename, 1-based physical page) of each chunk, for co-located images
+    
+    for doc, score in docs:
+        logger.debug(f"Document similarity score: {score} for content from {doc.metadata.get('source', 'unknown')}")
         
-        for doc, score in docs:
-            logger.debug(f"Document similarity score: {score} for content from {doc.metadata.get('source', 'unknown')}")
-            
-            if score < 1.5:  # Include relevant documents
-                formatted_docs.append(doc.page_content)
-                
-                # Track sources WITH page numbers
-                source_path = doc.metadata.get('source', '')
-                page_num = None
-                if 'page_label' in doc.metadata:
-                    page_label = doc.metadata['page_label']
-                    if isinstance(page_label, str) and page_label.isdigit():
-                        page_num = int(page_label)
-                    else:
-                        page_num = page_label
-                elif 'page' in doc.metadata:
-                    page_num = doc.metadata['page']
-                
-                if source_path:
-                    source_filename = os.path.basename(source_path)
-                    if source_filename.lower().endswith('.pdf'):
-                        source_info = {
-                            "filename": source_filename,
-                            "page": page_num
-                        }
-                        
-                        # Avoid duplicates
-                        existing = False
-                        for s in actual_sources:
-                            if s['filename'] == source_filename and s['page'] == page_num:
-                                existing = True
-                                break
-                        
-                        if not existing and page_num is not None:
-                            actual_sources.append(source_info)
-        
-        # Perform smart image detection based on content topics
-        relevant_images = semantic_search_images(user_message, language)
-        
-        # Save sources and images for this user
-        if user_identifier:
-            filename = ''.join(c for c in user_identifier if c.isalnum())
-            sources_path = os.path.join(CONVERSATION_PATH, f"{filename}_sources.json")
-            images_path = os.path.join(CONVERSATION_PATH, f"{filename}_images.json")
+        if score < 1.5:  # Include relevant documents
+            relevant_docs.append((doc, score))
+            chunk_ids.append(doc.metadata.get('id') or getattr(doc, 'id', None))
             
-            if not os.path.exists(CONVERSATION_PATH):
-                os.makedirs(CONVERSATION_PATH)
+            # load_data.py stores the 1-based physical page as page_label (the
+            # chunk's 'page' is overwritten with the first page of its PDF)
+            page_label = doc.metadata.get('page_label')
+            if isinstance(page_label, str) and page_label.isdigit():
+                page_key = (os.path.basename(doc.metadata.get('source', '')), int(page_label))
+                if page_key not in chunk_pages:
+                    chunk_pages.append(page_key)
             
-            # Save sources
-            if actual_sources:
-                with open(sources_path, 'w', encoding='utf-8') as f:
-                    json.dump(actual_sources, f, ensure_ascii=False, indent=2)
-                logger.debug(f"Saved sources for user {user_identifier}: {actual_sources}")
+            # Track sources WITH page numbers
+            source_path = doc.metadata.get('source', '')
+            page_num = None
+            if 'page_label' in doc.metadata:
+                page_label = doc.metadata['page_label']
+                if isinstance(page_label, str) and page_label.isdigit():
+                    page_num = int(page_label)
+                else:
+                    page_num = page_label
+            elif 'page' in doc.metadata:
+                page_num = doc.metadata['page']
             
-            # Save images (only if there are any)
-            if relevant_images:
-                with open(images_path, 'w', encoding='utf-8') as f:
-                    json.dump(relevant_images, f, ensure_ascii=False, indent=2)
-                logger.debug(f"Saved relevant images for user {user_identifier}: {len(relevant_images)} images")
-            else:
-                # Remove images file if no images are relevant
-                if os.path.exists(images_path):
-                    os.remove(images_path)
+            if source_path:
+                source_filename = os.path.basename(source_path)
+                if source_filename.lower().endswith('.pdf'):
+                    source_info = {
+                        "filename": source_filename,
+                        "page": page_num
+                    }
+                    
+                    # Avoid duplicates
+                    existing = False
+                    for s in actual_sources:
+                        if s['filename'] == source_filename and s['page'] == page_num:
+                            existing = True
+                            break
+                    
+                    if not existing and page_num is not None:
+                        actual_sources.append(source_info)
+    
+    # Perform smart image detection based on content topics and the retrieved pages
+    with stage_timer('image_search'):
+        relevant_images = semantic_search_images(user_message, language, query_vector, chunk_pages)
+    
+    return {
+        'query_vector': query_vector,
+        'docs': relevant_docs,
+        'chunk_ids': chunk_ids,
+        'sources': actual_sources,
+        'images': relevant_images
+    }
+
+def find_document_similarity(user_message, conversation_history, user_identifier=None, language=None, return_context=False):
+    """Find similar documents to the user message and generate the prompt
+    
+    With return_context=True, the retrieval result from find_relevant_documents
+    is returned as a third element (None if retrieval failed).
+    """
+    try:
+        # Generate conversation summary
+        history_text = generate_conversation_summary(conversation_history)
+        
+        # Retrieve relevant documents and sources (images travel in the context)
+        context = find_relevant_documents(user_message, language, user_identifier)
+        formatted_docs = [doc.page_content for doc, score in context['docs']]
+        actual_sources = context['sources']
         
         # Join documents text
         documents_text = "\n\n".join(formatted_docs)
@@ -372,10 +503,13 @@ Direct answer:"""
         if user_identifier:
             save_conversation(updated_history, user_identifier)
         
+        if return_context:
+            return prompt, updated_history, context
         return prompt, updated_history
         
     except Exception as e:
         logger.error(f"Error in find_document_similarity: {str(e)}")
+        count_error('retrieval')
         # Fallback prompt
         updated_history = []
         if isinstance(conversation_history, list):
@@ -404,6 +538,8 @@ Direct answer:"""
 Patient asks: {user_message}
 
 Give a short, simple answer in 1-5 sentences only. Go straight to the answer, no greetings."""
+        if return_context:
+            return fallback_prompt, updated_history, None
         return fallback_prompt, updated_history
     
 
@@ -446,6 +582,7 @@ def update_conversation_history(conversation_history, assistant_response, user_i
         
     except Exception as e:
         logger.error(f"Error in update_conversation_history: {str(e)}")
+        count_error('history_update')
         # Return the original history with response appended
         if isinstance(conversation_history, list):
             return conversation_history + [{
@@ -458,6 +595,15 @@ def update_conversation_history(conversation_history, assistant_response, user_i
                 {'role': 'assistant', 'content': assistant_response}
             ]
 
+def get_conversation_file(user_identifier):
+    """Path of the stored conversation for a user identifier / session ID
+    
+    The name is a hash of the whole identifier, so distinct identifiers
+    never share a file.
+    """
+    filename = hashlib.sha256(user_identifier.encode('utf-8')).hexdigest()
+    return os.path.join(CONVERSATION_PATH, f"{filename}.json")
+
 def save_conversation(conversation_history, user_identifier):
     """Save the conversation history to disk"""
     try:
@@ -466,8 +612,7 @@ def save_conversation(conversation_history, user_identifier):
             os.makedirs(CONVERSATION_PATH)
         
         # Create a safe filename from the user identifier
-        filename = ''.join(c for c in user_identifier if c.isalnum())
-        file_path = os.path.join(CONVERSATION_PATH, f"{filename}.json")
+        file_path = get_conversation_file(user_identifier)
         
         # Save the conversation history
         with open(file_path, 'w', encoding='utf-8') as f:
@@ -482,8 +627,7 @@ def load_conversation(user_identifier):
     """Load a conversation history from disk"""
     try:
         # Create a safe filename from the user identifier
-        filename = ''.join(c for c in user_identifier if c.isalnum())
-        file_path = os.path.join(CONVERSATION_PATH, f"{filename}.json")
+        file_path = get_conversation_file(user_identifier)
         
         # Check if the file exists
         if not os.path.exists(file_path):
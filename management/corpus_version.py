@@ -0,0 +1,58 @@
+import os
+import json
+import uuid
+import logging
+import threading
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Define paths
+PROCESSED_FILES_PATH = "./processed_files.json"
+
+# Key of processed_files.json holding the stamp written by load_data.py
+CORPUS_VERSION_KEY = "_corpus_version"
+
+# Last stamp read, valid while the file's (mtime, size) is unchanged
+_cached = (None, None)
+_cached_lock = threading.Lock()
+
+def new_corpus_version(processed_files):
+    """Record a new corpus stamp in the processed_files record (before it is saved)"""
+    processed_files[CORPUS_VERSION_KEY] = uuid.uuid4().hex
+    return processed_files[CORPUS_VERSION_KEY]
+
+def get_corpus_version():
+    """Return a stamp that changes whenever the document corpus changes.
+
+    load_data.py records a new stamp in processed_files.json after every
+    ingestion and reset_database.py deletes the file. The file is only
+    re-read when its modification time or size changes, so every worker
+    sees a new stamp on its next call for the cost of one stat. Records
+    written before stamps existed fall back to the (mtime, size) pair.
+    """
+    global _cached
+    try:
+        stat = os.stat(PROCESSED_FILES_PATH)
+    except FileNotFoundError:
+        return "empty"
+    except Exception as e:
+        logger.error(f"Error reading corpus version: {str(e)}")
+        return "unknown"
+
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached_signature, version = _cached
+    if cached_signature == signature:
+        return version
+
+    version = f"{stat.st_mtime_ns}-{stat.st_size}"
+    try:
+        with open(PROCESSED_FILES_PATH, 'r') as f:
+            version = json.load(f).get(CORPUS_VERSION_KEY) or version
+    except Exception as e:
+        # Being rewritten: keep the (mtime, size) stamp until the next call
+        logger.debug(f"Error reading corpus version stamp: {str(e)}")
+        return version
+    with _cached_lock:
+        _cached = (signature, version)
+    return version
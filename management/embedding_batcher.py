@@ -0,0 +1,99 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from management.metrics import observe_stage, observe_embedding_batch
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Default settings (overridable through environment variables)
+DEFAULT_MAX_BATCH = 32
+DEFAULT_MAX_WAIT_MS = 2.0   # How long the first query of a batch waits for company
+
+class EmbeddingBatcher:
+    """Embeds concurrent queries together in a single model call.
+
+    Request threads enqueue their query and wait on a future; one worker
+    thread takes the first waiting query, gathers whatever else arrives
+    within max_wait_ms (up to max_batch queries), runs one embed_documents
+    call and resolves every future. A lone request pays at most max_wait_ms;
+    under load the model runs full batches instead of competing batch-of-one
+    calls. Batch sizes and queue waits are exported as Prometheus histograms.
+    """
+
+    def __init__(self, embedding_function, max_batch=None, max_wait_ms=None):
+        """Initialize the batcher and start its worker thread"""
+        self.embedding_function = embedding_function
+        self.max_batch = max_batch or int(os.getenv('EMBEDDING_BATCH_MAX_SIZE', DEFAULT_MAX_BATCH))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else float(
+            os.getenv('EMBEDDING_BATCH_MAX_WAIT_MS', DEFAULT_MAX_WAIT_MS))) / 1000.0
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.largest_batch = 0
+
+        self.worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self.worker.start()
+
+    def embed_query(self, text):
+        """Embed one query, batched with any concurrent ones"""
+        future = Future()
+        self.queue.put((text, future, time.perf_counter()))
+        return future.result()
+
+    def embed_documents(self, texts):
+        """Documents are embedded directly, they already come in batches"""
+        return self.embedding_function.embed_documents(texts)
+
+    def _collect(self):
+        """Block for the first query, then gather more until the window closes"""
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            texts = [text for text, _, _ in batch]
+            try:
+                vectors = self.embedding_function.embed_documents(texts)
+            except Exception as e:
+                logger.error(f"Error embedding batch of {len(batch)} queries: {str(e)}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+            observe_stage('embedding', time.perf_counter() - started)
+            observe_embedding_batch(len(batch), [started - enqueued for _, _, enqueued in batch])
+            with self.lock:
+                self.batches += 1
+                self.queries += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self):
+        """Return queue depth and batch size statistics"""
+        with self.lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'max_batch': self.max_batch,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches': self.batches,
+                'queries': self.queries,
+                'average_batch': self.queries / self.batches if self.batches else 0.0,
+                'largest_batch': self.largest_batch
+            }
@@ -1,24 +1,133 @@
 # from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
+import os
 import logging
+import threading
+from collections import OrderedDict
+from management.text_normalization import normalize_query
+from management.metrics import count_cache
+from management.embedding_batcher import EmbeddingBatcher
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Global variable to store the embedding model instance (loaded once per process)
+_embedding_instance = None
+
+# Global variable to store the query-embedding memo (one per process)
+_query_embeddings = None
+
+# Default settings (overridable through environment variables)
+DEFAULT_QUERY_CACHE_SIZE = 2048
+
 def get_embedding_function():
     """Returns the embedding function using sentence-transformers model.
     
     This function provides the embeddings specifically tuned for endocrinology documents.
     It uses HuggingFace sentence-transformers to transform texts into vectors suitable 
-    for semantic search.
+    for semantic search. The model is loaded once and shared by every caller.
     """
+    global _embedding_instance
+    if _embedding_instance is not None:
+        return _embedding_instance
+    
+    # Shared retrieval service (see retrieval_service.py): no model in this process
+    if os.getenv('RETRIEVAL_SERVICE_SOCKET'):
+        from management.retrieval_service import RetrievalClient
+        _embedding_instance = RetrievalClient()
+        return _embedding_instance
+    
+    # ONNX Runtime backend (same model, no PyTorch): EMBEDDING_BACKEND=onnx or onnx-int8
+    backend = os.getenv('EMBEDDING_BACKEND', 'torch')
+    if backend in ('onnx', 'onnx-int8'):
+        try:
+            from management.onnx_embeddings import OnnxEmbeddings
+            _embedding_instance = OnnxEmbeddings.from_pretrained(quantized=(backend == 'onnx-int8'))
+            return _embedding_instance
+        except Exception as e:
+            logging.error(f"Error initializing ONNX embeddings, falling back to PyTorch: {e}")
+    
     try:
-        return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+        _embedding_instance = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+        return _embedding_instance
     except Exception as e:
         logging.error(f"Error initializing embeddings: {e}")
         # Fallback to a different model if needed
         try:
             logging.info("Attempting fallback to multi-qa-MiniLM-L6-cos-v1 model")
-            return HuggingFaceEmbeddings(model_name="sentence-transformers/multi-qa-MiniLM-L6-cos-v1")
+            _embedding_instance = HuggingFaceEmbeddings(model_name="sentence-transformers/multi-qa-MiniLM-L6-cos-v1")
+            return _embedding_instance
         except Exception as fallback_error:
             logging.error(f"Fallback embedding also failed: {fallback_error}")
-            raise Exception("Unable to initialize any embedding model")
\ No newline at end of file
+            raise Exception("Unable to initialize any embedding model")
+
+class QueryEmbeddingCache:
+    """Memoizes query embeddings so each question runs the model at most once.
+
+    Questions are keyed (and embedded) by their normalized text, so
+    "What is Hypoglycemia ?" and "what is hypoglycemia" share one vector.
+    Exposes embed_query() like the LangChain embedding it wraps and can be
+    handed to anything that only embeds queries (retrieval, the semantic
+    answer cache, rerankers). Bounded by max_entries, evicted LRU first.
+    """
+
+    def __init__(self, embedding_function, max_entries=None):
+        """Initialize the memo around an embedding function"""
+        self.embedding_function = embedding_function
+        self.max_entries = max_entries or int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', DEFAULT_QUERY_CACHE_SIZE))
+        self.lock = threading.Lock()
+        self.vectors = OrderedDict()  # normalized query -> vector, in LRU order
+        self.hits = 0
+        self.misses = 0
+
+    def embed_query(self, text):
+        """Return the embedding of a query (a list of floats, shared: do not modify)"""
+        key = normalize_query(text)
+        with self.lock:
+            vector = self.vectors.get(key)
+            if vector is not None:
+                self.vectors.move_to_end(key)
+                self.hits += 1
+        if vector is not None:
+            count_cache('query_embedding', True)
+            return vector
+
+        vector = self.embedding_function.embed_query(key or text)
+        with self.lock:
+            self.misses += 1
+            self.vectors[key] = vector
+            while len(self.vectors) > self.max_entries:
+                self.vectors.popitem(last=False)
+        count_cache('query_embedding', False)
+        return vector
+
+    def embed_documents(self, texts):
+        """Documents are not memoized"""
+        return self.embedding_function.embed_documents(texts)
+
+    def stats(self):
+        """Return memo size and hit rate"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.vectors),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+def get_query_embeddings():
+    """Returns the process-wide query-embedding memo around get_embedding_function()
+
+    Cache misses go through an EmbeddingBatcher (unless EMBEDDING_BATCH_ENABLED=0)
+    so concurrent requests share model calls. With RETRIEVAL_SERVICE_SOCKET
+    set, each query is sent to the retrieval service as is: its batcher
+    groups the queries of every worker.
+    """
+    global _query_embeddings
+    if _query_embeddings is None:
+        embedding_function = get_embedding_function()
+        if os.getenv('EMBEDDING_BATCH_ENABLED', '1') == '1' and not os.getenv('RETRIEVAL_SERVICE_SOCKET'):
+            embedding_function = EmbeddingBatcher(embedding_function)
+        _query_embeddings = QueryEmbeddingCache(embedding_function)
+    return _query_embeddings
@@ -0,0 +1,197 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+import unicodedata
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Global registry of filename indexes, one per directory
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# Content hashes keyed by path, valid while (mtime, size) is unchanged
+_content_hashes = {}
+_content_hashes_lock = threading.Lock()
+
+def normalize_filename(filename):
+    """Normalize a filename to make comparisons reliable"""
+    # Convert to lowercase
+    filename = filename.lower()
+
+    # Remove accents
+    filename = ''.join(c for c in unicodedata.normalize('NFD', filename)
+                      if unicodedata.category(c) != 'Mn')
+
+    # Remove file extension
+    filename = os.path.splitext(filename)[0]
+
+    # Remove special characters and spaces
+    filename = re.sub(r'[^a-z0-9]', '', filename)
+
+    return filename
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class _Snapshot:
+    """Lookup tables for one listing of the directory (never modified once built)"""
+
+    def __init__(self, files):
+        self.files = files
+        self.exact = set(files)
+        self.lower = {}        # lowercase name -> first file
+        self.normalized = {}   # normalize_filename(name) -> first file
+        self.by_length = {}    # length of lowercase name -> {lowercase name: first position}
+        self.trigrams = {}     # trigram of lowercase name -> positions
+        self.lowered = []
+
+        for position, name in enumerate(files):
+            lowered = name.lower()
+            self.lowered.append(lowered)
+            self.lower.setdefault(lowered, name)
+            self.normalized.setdefault(normalize_filename(name), name)
+            self.by_length.setdefault(len(lowered), {}).setdefault(lowered, position)
+            for trigram in _trigrams(lowered):
+                self.trigrams.setdefault(trigram, []).append(position)
+
+    def containing(self, text):
+        """Positions of files whose lowercase name contains text, in listing order"""
+        if len(text) < 3:
+            return [p for p, lowered in enumerate(self.lowered) if text in lowered]
+
+        candidates = None
+        for trigram in _trigrams(text):
+            postings = self.trigrams.get(trigram)
+            if not postings:
+                return []
+            candidates = set(postings) if candidates is None else candidates.intersection(postings)
+            if not candidates:
+                return []
+        return sorted(p for p in candidates if text in self.lowered[p])
+
+    def contained_in(self, text):
+        """Position of the first file whose lowercase name occurs in text, or None"""
+        best = None
+        for length, names in self.by_length.items():
+            for start in range(len(text) - length + 1):
+                position = names.get(text[start:start + length])
+                if position is not None and (best is None or position < best):
+                    best = position
+        return best
+
+class FilenameIndex:
+    """In-memory index of the files in a directory for fuzzy filename lookups.
+
+    Built once and rebuilt only when the directory's modification time
+    changes (files added, removed or renamed), so a lookup costs one stat
+    plus hash lookups instead of a directory listing and several linear
+    passes. find() keeps the matching order of the original download_pdf
+    code: exact, case-insensitive, normalized, partial, reversed partial and
+    keyword matching.
+    """
+
+    def __init__(self, directory):
+        """Initialize the index for a directory"""
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.mtime = None
+
+    def _current(self):
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        snapshot = self.snapshot
+        if snapshot is not None and mtime == self.mtime:
+            return snapshot
+
+        with self.lock:
+            if self.snapshot is None or mtime != self.mtime:
+                try:
+                    files = os.listdir(self.directory)
+                except OSError as e:
+                    logger.error(f"Error listing {self.directory}: {str(e)}")
+                    files = []
+                self.snapshot = _Snapshot(files)
+                self.mtime = mtime
+                logger.debug(f"Indexed {len(files)} files in {self.directory}")
+            return self.snapshot
+
+    def files(self):
+        """Return the names of the files in the directory"""
+        return list(self._current().files)
+
+    def find(self, filename):
+        """Resolve a requested filename to an existing file, or None"""
+        snapshot = self._current()
+        requested = filename.lower()
+
+        # Exact match
+        if filename in snapshot.exact:
+            return filename
+
+        # Method 1: Case-insensitive exact match
+        match = snapshot.lower.get(requested)
+        if match:
+            return match
+
+        # Method 2: Normalized match (removing accents, spaces, etc.)
+        match = snapshot.normalized.get(normalize_filename(filename))
+        if match:
+            return match
+
+        # Method 3: Partial match (filename is contained in actual file)
+        positions = snapshot.containing(requested)
+        if positions:
+            return snapshot.files[positions[0]]
+
+        # Method 4: Reversed partial match (actual file is contained in filename)
+        position = snapshot.contained_in(requested)
+        if position is not None:
+            return snapshot.files[position]
+
+        # Method 5: Keyword matching, the file containing the most words wins
+        words = re.findall(r'\b\w{4,}\b', requested)
+        counts = {}
+        for word in words:
+            for position in snapshot.containing(word):
+                counts[position] = counts.get(position, 0) + 1
+        if counts:
+            best = max(counts.values())
+            return snapshot.files[min(p for p, count in counts.items() if count == best)]
+
+        return None
+
+def get_filename_index(directory):
+    """Return the shared FilenameIndex for a directory"""
+    directory = os.path.abspath(directory)
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            index = FilenameIndex(directory)
+            _indexes[directory] = index
+        return index
+
+def get_content_hash(path):
+    """Return the SHA-256 of a file's content, recomputed only when it changes"""
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _content_hashes_lock:
+        cached = _content_hashes.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    content_hash = digest.hexdigest()
+
+    with _content_hashes_lock:
+        _content_hashes[path] = (signature, content_hash)
+    return content_hash
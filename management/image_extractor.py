@@ -9,6 +9,9 @@ import io
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# Characters of page text kept around each image for image search
+PAGE_CONTEXT_CHARS = 1000
+
 class ImageExtractor:
     def __init__(self):
         """Initialize the Image Extractor"""
@@ -107,7 +110,8 @@ class ImageExtractor:
                                 "height": pix.height,
                                 "hash": img_hash,
                                 "file_path": img_path,
-                                "description": ""  # Empty description by default - to be filled manually
+                                "description": "",  # Empty description by default - to be filled manually
+                                "page_context": self.extract_page_context(page, xref)
                             }
                             
                             extracted_images.append(image_info)
@@ -135,6 +139,58 @@ class ImageExtractor:
             logger.error(f"Error processing PDF {pdf_path}: {str(e)}")
             return []
     
+    def extract_page_context(self, page, xref):
+        """Collect the page text closest to an image (title, caption, legend)"""
+        try:
+            blocks = [block for block in page.get_text('blocks') if block[6] == 0 and block[4].strip()]
+            rects = page.get_image_rects(xref)
+            if rects:
+                rect = rects[0]
+                
+                # Vertical gap between a text block and the image (0 when they overlap)
+                def gap(block):
+                    return max(block[1] - rect.y1, rect.y0 - block[3], 0)
+                
+                blocks.sort(key=gap)
+            
+            context = ""
+            for block in blocks:
+                text = ' '.join(block[4].split())
+                if len(context) + len(text) + 1 > PAGE_CONTEXT_CHARS:
+                    break
+                context = f"{context} {text}".strip()
+            return context
+            
+        except Exception as e:
+            logger.error(f"Error extracting page context: {str(e)}")
+            return ""
+    
+    def fill_page_contexts(self, data_path="./data"):
+        """Add the page context to images extracted before it was recorded"""
+        updated = 0
+        for pdf_name, pdf_data in self.processed_files.items():
+            missing = [image for image in pdf_data.get('images', []) if 'page_context' not in image]
+            pdf_path = os.path.join(data_path, pdf_name)
+            if not missing or not os.path.exists(pdf_path):
+                continue
+            try:
+                doc = fitz.open(pdf_path)
+                for image in missing:
+                    page = doc.load_page(image['page_number'] - 1)
+                    xrefs = page.get_images()
+                    index = image.get('image_index', 1) - 1
+                    xref = xrefs[index][0] if 0 <= index < len(xrefs) else None
+                    image['page_context'] = self.extract_page_context(page, xref) if xref else ""
+                    updated += 1
+                doc.close()
+            except Exception as e:
+                logger.error(f"Error reading page context from {pdf_name}: {str(e)}")
+        
+        if updated:
+            self.save_processed_files()
+            logger.info(f"Added page context to {updated} images")
+        return updated
+    
     def process_pdfs_for_images(self, data_path="./data"):
         """Process all PDFs in the data directory for image extraction"""
         if not os.path.exists(data_path):
@@ -273,6 +329,9 @@ def extract_images_from_documents():
         success = extractor.process_pdfs_for_images()
         
         if success:
+            # Page context of images extracted by older versions
+            extractor.fill_page_contexts()
+            
             # Cleanup orphaned images
             extractor.cleanup_orphaned_images()
             logger.info("Image extraction completed successfully")
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+from management.image_topics import IMAGES_METADATA_PATH
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Define paths
+IMAGE_INDEX_PATH = "./image_index"
+EMBEDDINGS_FILE = "embeddings.npy"
+IMAGES_FILE = "images.json"
+
+# Default settings (overridable through environment variables)
+DEFAULT_MIN_SIMILARITY = 0.5          # Cosine similarity between question and image text
+DEFAULT_MAX_RESULTS = 3
+DEFAULT_RELOAD_CHECK_SECONDS = 2.0    # How often the index files are checked for changes
+
+def image_text(image):
+    """Text embedded for an image: its description, then the page text around it"""
+    parts = [image.get('description') or '', image.get('page_context') or '']
+    return '\n'.join(part.strip() for part in parts if part.strip())
+
+def _save_array(path, array):
+    """Write a .npy file atomically"""
+    with open(f"{path}.tmp", 'wb') as f:
+        np.save(f, array)
+    os.replace(f"{path}.tmp", path)
+
+def _load_index(path):
+    """Return (filenames, texts, normalized matrix) of the index at path, or None"""
+    try:
+        with open(os.path.join(path, IMAGES_FILE), 'r', encoding='utf-8') as f:
+            images = json.load(f)
+        embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE))
+        if len(embeddings) != len(images['filenames']):
+            raise ValueError(f"{len(embeddings)} vectors for {len(images['filenames'])} images")
+        return images['filenames'], images['texts'], embeddings
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Error loading image index at {path}: {str(e)}")
+        return None
+
+def export_image_index(embedding_function, metadata_path=IMAGES_METADATA_PATH, path=IMAGE_INDEX_PATH):
+    """Embed the description and page context of every extracted image
+
+    Vectors of images whose text did not change are reused from the
+    previous index, so only new or re-described images hit the model.
+    Images without any text are left out. Rows are L2-normalized so a
+    search is a single matrix-vector product.
+
+    Returns:
+        int: number of images indexed
+    """
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+
+    filenames = []
+    texts = []
+    seen = set()
+    for pdf_data in metadata.values():
+        for image in pdf_data.get('images', []):
+            text = image_text(image)
+            if text and image.get('filename') not in seen:
+                seen.add(image['filename'])
+                filenames.append(image['filename'])
+                texts.append(text)
+
+    previous = {}
+    loaded = _load_index(path)
+    if loaded is not None:
+        for filename, text, vector in zip(*loaded):
+            previous[(filename, text)] = vector
+
+    missing = [position for position, key in enumerate(zip(filenames, texts)) if key not in previous]
+    new_vectors = embedding_function.embed_documents([texts[position] for position in missing]) if missing else []
+    fresh = dict(zip(missing, new_vectors))
+
+    rows = [fresh[position] if position in fresh else previous[(filenames[position], texts[position])]
+            for position in range(len(filenames))]
+    embeddings = np.asarray(rows, dtype=np.float32).reshape(len(rows), -1)
+    if len(embeddings):
+        embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    _save_array(os.path.join(path, EMBEDDINGS_FILE), embeddings)
+    images_path = os.path.join(path, IMAGES_FILE)
+    with open(f"{images_path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump({'filenames': filenames, 'texts': texts}, f, ensure_ascii=False)
+    os.replace(f"{images_path}.tmp", images_path)
+
+    logger.info(f"Indexed {len(filenames)} images ({len(missing)} embedded, {len(filenames) - len(missing)} reused) in {path}")
+    return len(filenames)
+
+class ImageVectorIndex:
+    """Cosine search of the question embedding over the image index.
+
+    Holds the normalized image matrix written by export_image_index; a
+    search is one matrix-vector product with the query vector already
+    computed for chunk retrieval. The index files are checked for changes
+    at most every few seconds and reloaded when load_data.py rewrites them.
+    """
+
+    def __init__(self, path=IMAGE_INDEX_PATH, reload_check_seconds=None):
+        """Initialize the index (loaded on first use)"""
+        self.path = path
+        self.reload_check_seconds = reload_check_seconds if reload_check_seconds is not None else float(
+            os.getenv('IMAGE_INDEX_RELOAD_CHECK_SECONDS', DEFAULT_RELOAD_CHECK_SECONDS))
+        self.lock = threading.Lock()
+        self.data = None
+        self.signature = None
+        self.checked_at = None
+
+    def _current(self):
+        if self.checked_at is not None and time.monotonic() - self.checked_at < self.reload_check_seconds:
+            return self.data
+
+        with self.lock:
+            if self.checked_at is not None and time.monotonic() - self.checked_at < self.reload_check_seconds:
+                return self.data
+            try:
+                stat = os.stat(os.path.join(self.path, IMAGES_FILE))
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signature = None
+            if signature != self.signature:
+                loaded = _load_index(self.path) if signature else None
+                self.data = (loaded[0], loaded[2]) if loaded is not None else None
+                self.signature = signature
+                if loaded is not None:
+                    logger.info(f"Loaded image index with {len(loaded[0])} images")
+            self.checked_at = time.monotonic()
+            return self.data
+
+    def search(self, query_vector, min_similarity=None, k=None):
+        """Return up to k (image filename, cosine similarity) pairs above min_similarity, best first"""
+        min_similarity = min_similarity if min_similarity is not None else float(
+            os.getenv('IMAGE_SEARCH_MIN_SIMILARITY', DEFAULT_MIN_SIMILARITY))
+        k = k or int(os.getenv('IMAGE_SEARCH_MAX_RESULTS', DEFAULT_MAX_RESULTS))
+        data = self._current()
+        if data is None or query_vector is None or not len(data[0]):
+            return []
+        filenames, embeddings = data
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        if query.shape[0] != embeddings.shape[1]:
+            logger.warning("Image index was built with a different embedding model; run load_data.py")
+            return []
+        similarities = embeddings @ (query / (np.linalg.norm(query) or 1.0))
+
+        matched = np.flatnonzero(similarities >= min_similarity)
+        best = matched[np.argsort(-similarities[matched], kind='stable')][:k]
+        return [(filenames[i], float(similarities[i])) for i in best]
+
+# Global image vector index
+_image_vector_index = None
+_image_vector_lock = threading.Lock()
+
+def get_image_vector_index():
+    """Return the shared ImageVectorIndex"""
+    global _image_vector_index
+    if _image_vector_index is None:
+        with _image_vector_lock:
+            if _image_vector_index is None:
+                _image_vector_index = ImageVectorIndex()
+    return _image_vector_index
@@ -0,0 +1,197 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+import unicodedata
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Define paths
+IMAGE_TOPICS_PATH = "./image_topics.json"
+IMAGES_METADATA_PATH = "./extracted_images_metadata.json"   # Written by ImageExtractor
+
+# Default settings (overridable through environment variables)
+DEFAULT_RELOAD_CHECK_SECONDS = 2.0   # How often the two files are checked for changes
+
+# Arabic letter variants folded to one form (same folding as the lexical index)
+ARABIC_FOLDING = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ى': 'ي', 'ة': 'ه'})
+
+def fold_text(text):
+    """Lowercase, remove accents and Arabic diacritics, fold Arabic letter variants and collapse spaces"""
+    text = unicodedata.normalize('NFD', (text or '').lower())
+    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn').translate(ARABIC_FOLDING)
+    return re.sub(r'\s+', ' ', text)
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton finding every keyword of a list in one pass over a text"""
+
+    def __init__(self, keywords):
+        """Build the trie, failure links and outputs for a list of keywords"""
+        self.transitions = [{}]   # state -> {character: next state}
+        self.outputs = [()]       # state -> positions in keywords ending here
+        for position, keyword in enumerate(keywords):
+            state = 0
+            for character in keyword:
+                next_state = self.transitions[state].get(character)
+                if next_state is None:
+                    next_state = len(self.transitions)
+                    self.transitions[state][character] = next_state
+                    self.transitions.append({})
+                    self.outputs.append(())
+                state = next_state
+            self.outputs[state] += (position,)
+
+        # Breadth-first failure links; outputs inherit those of the failure state
+        self.failures = [0] * len(self.transitions)
+        queue = list(self.transitions[0].values())
+        for state in queue:
+            for character, next_state in self.transitions[state].items():
+                failure = self.failures[state]
+                while failure and character not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                self.failures[next_state] = self.transitions[failure].get(character, 0)
+                self.outputs[next_state] += self.outputs[self.failures[next_state]]
+                queue.append(next_state)
+
+    def find(self, text):
+        """Return the set of positions of the keywords occurring in text"""
+        found = set()
+        state = 0
+        transitions = self.transitions
+        failures = self.failures
+        for character in text:
+            while state and character not in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(character, 0)
+            if self.outputs[state]:
+                found.update(self.outputs[state])
+        return found
+
+class _Snapshot:
+    """Compiled topics and image lookup for one version of the two files (never modified once built)"""
+
+    def __init__(self, topics, metadata):
+        self.images = {}   # image filename -> image metadata
+        self.pages = {}    # (source PDF, 1-based page number) -> images on that page
+        for pdf_name, pdf_data in metadata.items():
+            for image in pdf_data.get('images', []):
+                self.images.setdefault(image.get('filename'), image)
+                key = (image.get('source_pdf') or pdf_name, image.get('page_number'))
+                self.pages.setdefault(key, []).append(image)
+
+        # One pattern per distinct (folded keyword, topic); a topic's score
+        # is the number of its keywords found in the question
+        keywords = []
+        self.keyword_topics = []
+        seen = set()
+        self.topics = [topic['image'] for topic in topics]
+        for position, topic in enumerate(topics):
+            topic_keywords = topic.get('keywords', [])
+            if isinstance(topic_keywords, dict):
+                topic_keywords = [keyword for language in topic_keywords.values() for keyword in language]
+            for keyword in topic_keywords:
+                folded = fold_text(keyword).strip()
+                if folded and (folded, position) not in seen:
+                    seen.add((folded, position))
+                    keywords.append(folded)
+                    self.keyword_topics.append(position)
+        self.automaton = KeywordAutomaton(keywords)
+
+    def search(self, text):
+        scores = {}
+        for keyword in self.automaton.find(fold_text(text)):
+            topic = self.keyword_topics[keyword]
+            scores[topic] = scores.get(topic, 0) + 1
+
+        # Best score first, topic file order among equals
+        matches = []
+        for topic in sorted(scores, key=lambda topic: (-scores[topic], topic)):
+            image = self.images.get(self.topics[topic])
+            if image is not None:
+                matches.append(image)
+        return matches
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def _load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"Error loading {path}: {str(e)}")
+        return default
+
+class ImageTopicIndex:
+    """Topic keywords of the illustrated images, compiled once for the chat path.
+
+    Keywords (French, English, Arabic) come from image_topics.json and are
+    matched accent- and case-insensitively with an Aho-Corasick automaton,
+    so a question is scanned once whatever the number of keywords. Image
+    metadata is indexed by filename and by (PDF, page). Both files are checked for changes at
+    most every few seconds and recompiled when they change, so a search
+    normally does no disk I/O.
+    """
+
+    def __init__(self, topics_path=IMAGE_TOPICS_PATH, metadata_path=IMAGES_METADATA_PATH, reload_check_seconds=None):
+        """Initialize the index (compiled on first use)"""
+        self.topics_path = topics_path
+        self.metadata_path = metadata_path
+        self.reload_check_seconds = reload_check_seconds if reload_check_seconds is not None else float(
+            os.getenv('IMAGE_TOPICS_RELOAD_CHECK_SECONDS', DEFAULT_RELOAD_CHECK_SECONDS))
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.signature = None
+        self.checked_at = 0.0
+
+    def _current(self):
+        snapshot = self.snapshot
+        if snapshot is not None and time.monotonic() - self.checked_at < self.reload_check_seconds:
+            return snapshot
+
+        with self.lock:
+            if self.snapshot is not None and time.monotonic() - self.checked_at < self.reload_check_seconds:
+                return self.snapshot
+            signature = (_signature(self.topics_path), _signature(self.metadata_path))
+            if self.snapshot is None or signature != self.signature:
+                topics = _load_json(self.topics_path, {}).get('topics', [])
+                metadata = _load_json(self.metadata_path, {})
+                self.snapshot = _Snapshot(topics, metadata)
+                self.signature = signature
+                logger.info(f"Compiled {len(self.snapshot.keyword_topics)} keywords for {len(topics)} image topics")
+            self.checked_at = time.monotonic()
+            return self.snapshot
+
+    def get_image(self, filename):
+        """Return the metadata of an extracted image, or None"""
+        return self._current().images.get(filename)
+
+    def get_page_images(self, source_pdf, page_number):
+        """Return the images extracted from a page (1-based) of a PDF"""
+        return self._current().pages.get((source_pdf, page_number), [])
+
+    def search(self, text):
+        """Return the images whose topic keywords occur in text, most matched keywords first"""
+        return self._current().search(text)
+
+# Global image topic index
+_image_topic_index = None
+_image_topic_lock = threading.Lock()
+
+def get_image_topic_index():
+    """Return the shared ImageTopicIndex"""
+    global _image_topic_index
+    if _image_topic_index is None:
+        with _image_topic_lock:
+            if _image_topic_index is None:
+                _image_topic_index = ImageTopicIndex()
+    return _image_topic_index
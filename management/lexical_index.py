@@ -0,0 +1,278 @@
+import os
+import re
+import json
+import math
+import logging
+import threading
+import unicodedata
+import numpy as np
+from langchain_core.documents import Document
+from management.corpus_version import get_corpus_version
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Define paths
+LEXICAL_INDEX_PATH = "./lexical_index.json"
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Reciprocal rank fusion constant (the usual 60 from the RRF paper)
+RRF_K = 60
+
+# Default settings (overridable through environment variables)
+DEFAULT_CANDIDATE_FACTOR = 4   # Each retriever proposes k * factor candidates to the fusion
+
+# Very frequent words of the three supported languages, after accent folding
+STOPWORDS = set("""
+    a an and are as at be by can do does for from has have how i if in is it its me my of on or our so
+    that the their there these this to was what when where which who why will with you your
+    au aux avec ce ces comment dans de des du elle en est et etre il ils je la le les leur mais me mon
+    ne nous on ou par pas pour quand que quel quelle quels qui sa se ses son sont sur ta te tu un une
+    vos votre vous
+    في من على الى عن مع هل ما ماذا كيف هو هي هذا هذه ذلك التي الذي او ثم لا ان كان
+""".split())
+
+# Arabic letter variants folded to one form (alef with hamza/madda, alef maqsura, ta marbuta)
+ARABIC_FOLDING = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ى': 'ي', 'ة': 'ه'})
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+def tokenize(text):
+    """Split text into index terms (French, English and Arabic)
+
+    Lowercases, removes accents and Arabic diacritics (as normalize_filename
+    does for file names), folds Arabic letter variants, strips the Arabic
+    article and drops stopwords. Terms like "HbA1c" or "T4" are kept whole.
+    """
+    text = unicodedata.normalize('NFD', (text or '').lower())
+    text = ''.join(c for c in text if unicodedata.category(c) != 'Mn').translate(ARABIC_FOLDING)
+
+    terms = []
+    for token in TOKEN_PATTERN.findall(text):
+        if token.startswith('ال') and len(token) > 4:
+            token = token[2:]
+        if len(token) < 2 or token in STOPWORDS:
+            continue
+        terms.append(token)
+    return terms
+
+def build_lexical_index(ids, documents):
+    """Compute BM25 statistics for a list of chunks
+
+    Returns:
+        dict: chunk 'ids', token 'lengths' and 'postings' mapping each term
+        to [chunk positions, term frequencies]
+    """
+    lengths = []
+    postings = {}
+    for position, text in enumerate(documents):
+        terms = tokenize(text)
+        lengths.append(len(terms))
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            entry = postings.setdefault(term, [[], []])
+            entry[0].append(position)
+            entry[1].append(frequency)
+    return {'ids': list(ids), 'lengths': lengths, 'postings': postings}
+
+def export_lexical_index(db, path=LEXICAL_INDEX_PATH):
+    """Build the inverted index of every chunk in a Chroma database and write it to path
+
+    Returns:
+        int: number of chunks indexed
+    """
+    data = db.get(include=['documents'])
+    index = build_lexical_index(data['ids'], data['documents'])
+    index['corpus_version'] = get_corpus_version()
+
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(f"{path}.tmp", path)
+
+    logger.info(f"Indexed {len(index['ids'])} chunks and {len(index['postings'])} terms in {path}")
+    return len(index['ids'])
+
+def lexical_index_is_current(path=LEXICAL_INDEX_PATH):
+    """Check whether the inverted index at path was built at the current corpus version"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('corpus_version') == get_corpus_version()
+    except (OSError, ValueError):
+        return False
+
+class LexicalIndex:
+    """BM25 search over the inverted index written by export_lexical_index.
+
+    The BM25 weight of every posting is precomputed at load time, so a query
+    costs one array scatter-add per query term plus an argpartition.
+    """
+
+    def __init__(self, index):
+        """Prepare the postings of a loaded index for scoring"""
+        self.ids = index['ids']
+        self.corpus_version = index.get('corpus_version')
+
+        lengths = np.asarray(index['lengths'], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+        norms = BM25_K1 * (1.0 - BM25_B + BM25_B * lengths / average_length)
+        total = len(self.ids)
+
+        self.postings = {}  # term -> (chunk positions, BM25 weights including IDF)
+        for term, (positions, frequencies) in index['postings'].items():
+            positions = np.asarray(positions, dtype=np.int32)
+            frequencies = np.asarray(frequencies, dtype=np.float32)
+            idf = math.log(1.0 + (total - len(positions) + 0.5) / (len(positions) + 0.5))
+            weights = idf * frequencies * (BM25_K1 + 1.0) / (frequencies + norms[positions])
+            self.postings[term] = (positions, weights.astype(np.float32))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k=20):
+        """Return up to k (chunk ID, BM25 score) pairs, best first"""
+        terms = [term for term in set(tokenize(query)) if term in self.postings]
+        if not terms:
+            return []
+
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in terms:
+            positions, weights = self.postings[term]
+            scores[positions] += weights
+
+        matched = np.flatnonzero(scores)
+        k = min(k, len(matched))
+        top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+# Global lexical index, reloaded when the corpus version changes
+_lexical_index = None
+_lexical_version = None
+_lexical_lock = threading.Lock()
+
+def get_lexical_index(path=LEXICAL_INDEX_PATH):
+    """Return the lexical index for the current corpus, or None if it is missing or stale"""
+    global _lexical_index, _lexical_version
+    version = get_corpus_version()
+    if version == _lexical_version:
+        return _lexical_index
+
+    with _lexical_lock:
+        if version != _lexical_version:
+            index = None
+            try:
+                if os.path.exists(path):
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    if data.get('corpus_version') == version:
+                        index = LexicalIndex(data)
+                        logger.info(f"Loaded lexical index with {len(index)} chunks")
+                    else:
+                        logger.warning("Lexical index is older than the document corpus; run load_data.py to refresh it")
+                else:
+                    logger.warning(f"No lexical index at {path}; retrieval is vector-only")
+            except Exception as e:
+                logger.error(f"Error loading lexical index: {str(e)}")
+            _lexical_index = index
+            _lexical_version = version
+        return _lexical_index
+
+def _chunk_id(doc):
+    return doc.metadata.get('id') or getattr(doc, 'id', None)
+
+def vector_space(db):
+    """Distance space of a vector store (NumpyVectorIndex or Chroma)"""
+    space = getattr(db, 'space', None)
+    if space is None:
+        collection = getattr(db, '_collection', None)
+        space = (getattr(collection, 'metadata', None) or {}).get('hnsw:space', 'l2')
+    return space
+
+def _distance(space, vector, query):
+    vector = np.asarray(vector, dtype=np.float32)
+    if space == 'cosine':
+        denominator = float(np.linalg.norm(vector) * np.linalg.norm(query)) or 1.0
+        return 1.0 - float(vector @ query) / denominator
+    if space == 'ip':
+        return 1.0 - float(vector @ query)
+    difference = vector - query
+    return float(difference @ difference)
+
+def search_by_vector(db, query_vector, k, vectors=None):
+    """Return the k chunks closest to a query vector as (Document, distance) pairs
+
+    With a vectors dict, the embedding of each chunk found is added to it
+    (chunk ID -> vector) as returned by the search itself: Chroma is queried
+    with embeddings included, NumpyVectorIndex and RetrievalClient provide
+    similarity_search_with_vectors. Other stores add nothing.
+    """
+    if vectors is None:
+        return db.similarity_search_by_vector_with_relevance_scores(query_vector, k=k)
+
+    search_with_vectors = getattr(db, 'similarity_search_with_vectors', None)
+    if search_with_vectors is not None:
+        hits, found = search_with_vectors(query_vector, k=k)
+        vectors.update(found)
+        return hits
+
+    collection = getattr(db, '_collection', None)
+    if collection is None:
+        return db.similarity_search_by_vector_with_relevance_scores(query_vector, k=k)
+    results = collection.query(
+        query_embeddings=[[float(x) for x in query_vector]],
+        n_results=k,
+        include=['documents', 'metadatas', 'distances', 'embeddings']
+    )
+    hits = []
+    for chunk_id, text, metadata, distance, vector in zip(results['ids'][0], results['documents'][0],
+                                                          results['metadatas'][0], results['distances'][0],
+                                                          results['embeddings'][0]):
+        hits.append((Document(page_content=text or '', metadata=metadata or {}, id=chunk_id), float(distance)))
+        vectors[chunk_id] = vector
+    return hits
+
+def hybrid_search(db, lexical_index, query, query_vector, k=5, candidate_factor=None, vectors=None):
+    """Fuse vector and BM25 rankings with reciprocal rank fusion
+
+    Both retrievers propose k * candidate_factor chunks; the k chunks with
+    the best fused rank are returned as (Document, vector distance) pairs,
+    like similarity_search_by_vector_with_relevance_scores, so callers can
+    keep their distance threshold. Chunks found only by BM25 are fetched
+    from the store with their embeddings to compute that distance. With a
+    vectors dict, the embeddings seen along the way are added to it (see
+    search_by_vector).
+    """
+    candidate_factor = candidate_factor or int(os.getenv('HYBRID_CANDIDATE_FACTOR', DEFAULT_CANDIDATE_FACTOR))
+    candidates = k * candidate_factor
+
+    vector_hits = search_by_vector(db, query_vector, candidates, vectors)
+    lexical_hits = lexical_index.search(query, k=candidates)
+
+    fused = {}
+    found = {}
+    for rank, (doc, distance) in enumerate(vector_hits):
+        chunk_id = _chunk_id(doc)
+        fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        found[chunk_id] = (doc, distance)
+    for rank, (chunk_id, _) in enumerate(lexical_hits):
+        fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+
+    best = sorted(fused, key=lambda chunk_id: fused[chunk_id], reverse=True)[:k]
+
+    missing = [chunk_id for chunk_id in best if chunk_id not in found]
+    if missing:
+        data = db.get(ids=missing, include=['documents', 'metadatas', 'embeddings'])
+        query = np.asarray(query_vector, dtype=np.float32)
+        space = vector_space(db)
+        for chunk_id, text, metadata, vector in zip(data['ids'], data['documents'], data['metadatas'], data['embeddings']):
+            doc = Document(page_content=text or '', metadata=metadata or {}, id=chunk_id)
+            found[chunk_id] = (doc, _distance(space, vector, query))
+            if vectors is not None:
+                vectors[chunk_id] = vector
+
+    return [found[chunk_id] for chunk_id in best if chunk_id in found]
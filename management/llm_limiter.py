@@ -0,0 +1,283 @@
+import os
+import time
+import math
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Default settings (overridable through environment variables)
+DEFAULT_MAX_IN_FLIGHT = 8        # Upper bound for concurrent LLM calls per worker
+DEFAULT_MAX_QUEUE = 32           # Requests allowed to wait for a slot
+DEFAULT_QUEUE_TIMEOUT = 20.0     # Seconds a request may wait before giving up
+RATE_LIMIT_COOLDOWN = 2.0        # Minimum seconds between two multiplicative decreases
+WAIT_SAMPLES = 1000              # Number of recent wait times kept for percentiles
+
+class LLMOverloadedError(Exception):
+    """Raised when an LLM request cannot be admitted or upstream is rate limiting"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def is_rate_limit_error(error):
+    """Check whether an exception is an upstream HTTP 429 (rate limit)"""
+    if getattr(error, 'status_code', None) == 429:
+        return True
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429:
+        return True
+    return type(error).__name__ == 'RateLimitError'
+
+class _Waiter:
+    """A queued request; `granted` is only changed under the limiter lock"""
+
+    def __init__(self, loop=None):
+        self.granted = False
+        self.abandoned = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+class LLMLimiter:
+    """Bounds concurrent LLM calls and queues the excess with deadlines.
+
+    The concurrency limit adapts to upstream behaviour (AIMD): it grows by
+    roughly one slot per round of successful calls and is halved when the
+    provider answers with HTTP 429. When the wait queue is full, requests are
+    rejected immediately with LLMOverloadedError so the caller can return a
+    fast 503 with Retry-After. Works for both threads and asyncio tasks.
+    """
+
+    def __init__(self, max_in_flight=None, max_queue=None, queue_timeout=None, min_in_flight=1):
+        """Initialize the limiter"""
+        self.max_in_flight = max_in_flight or int(os.getenv('LLM_MAX_IN_FLIGHT', DEFAULT_MAX_IN_FLIGHT))
+        self.max_queue = max_queue if max_queue is not None else int(
+            os.getenv('LLM_MAX_QUEUE', DEFAULT_MAX_QUEUE))
+        self.queue_timeout = queue_timeout or float(os.getenv('LLM_QUEUE_TIMEOUT_SECONDS', DEFAULT_QUEUE_TIMEOUT))
+        self.min_in_flight = min_in_flight
+
+        self.lock = threading.Lock()
+        self.limit = float(self.max_in_flight)
+        self.in_flight = 0
+        self.waiters = deque()
+        self.last_decrease = 0.0
+
+        # Statistics
+        self.wait_times = deque(maxlen=WAIT_SAMPLES)
+        self.service_time = None  # Exponentially weighted average call duration
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.rate_limited = 0
+
+    # Slot management
+
+    def _grant_next_locked(self):
+        """Hand free slots to queued requests, oldest first"""
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if waiter.abandoned:
+                continue
+            waiter.granted = True
+            self.in_flight += 1
+            waiter.wake()
+
+    def _enqueue_locked(self, loop=None):
+        """Take a free slot or join the queue; returns None when a slot was taken"""
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            self.wait_times.append(0.0)
+            return None
+
+        if len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            raise LLMOverloadedError("LLM queue is full", self.retry_after_locked())
+
+        waiter = _Waiter(loop)
+        self.waiters.append(waiter)
+        return waiter
+
+    def _resolve_wait_locked(self, waiter, started):
+        """Settle a waiter after it was woken, timed out or cancelled"""
+        if waiter.granted:
+            self.admitted += 1
+            self.wait_times.append(time.monotonic() - started)
+            return True
+        waiter.abandoned = True
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+        return False
+
+    def _rate_limited_locked(self):
+        """Multiplicative decrease after an upstream 429"""
+        self.rate_limited += 1
+        now = time.monotonic()
+        if now - self.last_decrease > RATE_LIMIT_COOLDOWN:
+            self.limit = max(float(self.min_in_flight), self.limit / 2)
+            self.last_decrease = now
+            logger.warning(f"LLM rate limited, concurrency limit lowered to {int(self.limit)}")
+
+    def _release(self, duration, error=None):
+        with self.lock:
+            self.in_flight -= 1
+
+            if error is not None and is_rate_limit_error(error):
+                self._rate_limited_locked()
+            elif error is None:
+                # Additive increase: about one extra slot per full round of calls
+                self.limit = min(float(self.max_in_flight), self.limit + 1.0 / max(self.limit, 1.0))
+                if self.service_time is None:
+                    self.service_time = duration
+                else:
+                    self.service_time = 0.8 * self.service_time + 0.2 * duration
+
+            self._grant_next_locked()
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """Hold one LLM slot for the duration of the block (threads)"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        started = time.monotonic()
+
+        with self.lock:
+            waiter = self._enqueue_locked()
+
+        if waiter is not None:
+            waiter.event.wait(timeout)
+            with self.lock:
+                if not self._resolve_wait_locked(waiter, started):
+                    self.timed_out += 1
+                    raise LLMOverloadedError("Timed out waiting for an LLM slot", self.retry_after_locked())
+
+        call_started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._release(time.monotonic() - call_started, error=e)
+            raise
+        self._release(time.monotonic() - call_started)
+
+    @asynccontextmanager
+    async def aslot(self, timeout=None):
+        """Hold one LLM slot for the duration of the block (asyncio)"""
+        timeout = self.queue_timeout if timeout is None else timeout
+        started = time.monotonic()
+
+        with self.lock:
+            waiter = self._enqueue_locked(asyncio.get_running_loop())
+
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # Client went away: give back a slot granted in the meantime
+                with self.lock:
+                    if not self._resolve_wait_locked(waiter, started):
+                        raise
+                self._release(0.0, error=asyncio.CancelledError())
+                raise
+
+            with self.lock:
+                if not self._resolve_wait_locked(waiter, started):
+                    self.timed_out += 1
+                    raise LLMOverloadedError("Timed out waiting for an LLM slot", self.retry_after_locked())
+
+        call_started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self._release(time.monotonic() - call_started, error=e)
+            raise
+        self._release(time.monotonic() - call_started)
+
+    def try_acquire(self):
+        """Take a free slot without queueing; returns False when none is free
+
+        For extra calls made on behalf of a request that already holds a
+        slot (LLM hedges); a taken slot must be given back with release().
+        """
+        with self.lock:
+            if self.in_flight < int(self.limit) and not self.waiters:
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+            return False
+
+    def release(self, duration, error=None):
+        """Give back a slot taken with try_acquire()"""
+        self._release(duration, error=error)
+
+    def report_rate_limit(self):
+        """Count a 429 returned to a call whose slot stays in use (a hedged request going on)"""
+        with self.lock:
+            self._rate_limited_locked()
+
+    # Introspection
+
+    def is_saturated(self):
+        """True when a new request would be rejected right away"""
+        with self.lock:
+            return self.in_flight >= int(self.limit) and len(self.waiters) >= self.max_queue
+
+    def retry_after_locked(self):
+        """Estimate (in whole seconds) when a rejected client should retry"""
+        service_time = self.service_time or 1.0
+        queued = len(self.waiters)
+        estimate = service_time * (queued + 1) / max(int(self.limit), 1)
+        return max(1, min(60, int(math.ceil(estimate))))
+
+    def retry_after(self):
+        with self.lock:
+            return self.retry_after_locked()
+
+    def stats(self):
+        """Return current depth, limit and wait-time statistics"""
+        with self.lock:
+            waits = sorted(self.wait_times)
+            queued = len(self.waiters)
+
+            def percentile(p):
+                if not waits:
+                    return 0.0
+                return waits[min(len(waits) - 1, int(p * len(waits)))]
+
+            return {
+                'in_flight': self.in_flight,
+                'limit': int(self.limit),
+                'max_in_flight': self.max_in_flight,
+                'queue_depth': queued,
+                'max_queue': self.max_queue,
+                'queue_timeout_seconds': self.queue_timeout,
+                'wait_seconds': {
+                    'p50': round(percentile(0.50), 4),
+                    'p95': round(percentile(0.95), 4),
+                    'max': round(waits[-1], 4) if waits else 0.0
+                },
+                'avg_service_seconds': round(self.service_time or 0.0, 4),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'rate_limited': self.rate_limited
+            }
@@ -0,0 +1,602 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from management.llm_limiter import is_rate_limit_error
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Default settings (overridable through environment variables)
+DEFAULT_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+DEFAULT_FALLBACK_MODEL = "llama-3.3-70b-versatile"
+DEFAULT_HEDGE_MIN_DELAY = 0.3      # Never hedge sooner than this (seconds)
+DEFAULT_HEDGE_MAX_DELAY = 8.0      # Always hedge after this long without output
+DEFAULT_HEDGE_DELAY = 2.0          # Used until enough latency samples exist
+MIN_SAMPLES_FOR_P95 = 20
+LATENCY_SAMPLES = 200
+
+# Sync attempts run here so the caller can wait on whichever answers first
+_attempt_pool = ThreadPoolExecutor(max_workers=int(os.getenv('LLM_ATTEMPT_THREADS', '32')),
+                                   thread_name_prefix='llm-attempt')
+
+def _has_output(chunk):
+    return bool(getattr(chunk, 'content', None))
+
+class LLMProvider:
+    """A chat model plus the latency and outcome statistics used for hedging"""
+
+    def __init__(self, name, llm):
+        self.name = name
+        self.llm = llm
+        self.lock = threading.Lock()
+        # Time to the full answer (invoke) or to the first token (stream)
+        self.latencies = {'invoke': deque(maxlen=LATENCY_SAMPLES), 'stream': deque(maxlen=LATENCY_SAMPLES)}
+        self.calls = 0
+        self.wins = 0
+        self.errors = 0
+        self.hedges = 0
+
+    def record(self, mode, latency=None, won=False, error=False, hedge=False):
+        with self.lock:
+            if latency is not None:
+                self.latencies[mode].append(latency)
+            if won:
+                self.wins += 1
+            if error:
+                self.errors += 1
+            if hedge:
+                self.hedges += 1
+
+    def count_call(self):
+        with self.lock:
+            self.calls += 1
+
+    def percentile(self, mode, p):
+        """Latency percentile for the mode, or None without enough samples"""
+        with self.lock:
+            samples = sorted(self.latencies[mode])
+        if len(samples) < MIN_SAMPLES_FOR_P95:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    def stats(self):
+        def summary(mode):
+            with self.lock:
+                samples = sorted(self.latencies[mode])
+            if not samples:
+                return {'samples': 0}
+            return {
+                'samples': len(samples),
+                'p50': round(samples[len(samples) // 2], 4),
+                'p95': round(samples[min(len(samples) - 1, int(0.95 * len(samples)))], 4)
+            }
+
+        with self.lock:
+            counts = {'calls': self.calls, 'wins': self.wins, 'errors': self.errors, 'hedges': self.hedges}
+        return {'name': self.name, **counts, 'invoke': summary('invoke'), 'stream': summary('stream')}
+
+class _Attempt:
+    """One provider call inside a race"""
+
+    def __init__(self, provider, hedge):
+        self.provider = provider
+        self.hedge = hedge
+        self.started = time.monotonic()
+        self.finished = False
+        self.cancelled = False
+        self.task = None  # asyncio task on the async path
+        self.slot = False           # Holds its own LLMLimiter slot (until the call ends)
+        self.own_slot = False       # Was given its own slot rather than the caller's
+        self.hedge_skipped = False  # A hedge after this attempt found no free slot
+
+class HedgedLLM:
+    """Chat model facade racing a primary model against alternates.
+
+    The primary provider is called first. If it has produced no output once
+    its p95 latency (clamped to [min_delay, max_delay]) has elapsed, the next
+    provider is started as a hedge and whichever answers first wins; the
+    other attempt is cancelled (async tasks are cancelled, sync streams are
+    closed, a sync invoke finishes in the background and is discarded). A
+    provider that fails before producing output is replaced by the next one
+    straight away, except on HTTP 429: rate limiting is left to the
+    LLMLimiter, which must see it to back off. Exposes invoke/stream/ainvoke/astream like a LangChain
+    chat model, so ChatService does not need to know about it.
+
+    The caller's LLMLimiter slot covers one running attempt. An attempt
+    started while another is still running takes a slot of its own from
+    the limiter and is skipped when none is free, so hedging never pushes
+    the number of calls in flight above the limit.
+    """
+
+    def __init__(self, providers, hedge_enabled=False, min_delay=None, max_delay=None, default_delay=None,
+                 limiter=None):
+        """Initialize with providers in order of preference"""
+        self.providers = providers
+        self.hedge_enabled = hedge_enabled
+        self.limiter = limiter
+        self.min_delay = min_delay if min_delay is not None else float(
+            os.getenv('LLM_HEDGE_MIN_DELAY_SECONDS', DEFAULT_HEDGE_MIN_DELAY))
+        self.max_delay = max_delay if max_delay is not None else float(
+            os.getenv('LLM_HEDGE_MAX_DELAY_SECONDS', DEFAULT_HEDGE_MAX_DELAY))
+        self.default_delay = default_delay if default_delay is not None else float(
+            os.getenv('LLM_HEDGE_DEFAULT_DELAY_SECONDS', DEFAULT_HEDGE_DELAY))
+
+    def hedge_delay(self, provider, mode):
+        """Seconds to wait for output from provider before starting a hedge"""
+        p95 = provider.percentile(mode, 0.95)
+        delay = self.default_delay if p95 is None else p95
+        return max(self.min_delay, min(self.max_delay, delay))
+
+    def _next_deadline(self, attempts, pending, mode):
+        """Deadline for launching the next hedge, or None if no hedge is due"""
+        if not self.hedge_enabled or not pending or not attempts or attempts[-1].hedge_skipped:
+            return None
+        latest = attempts[-1]
+        return latest.started + self.hedge_delay(latest.provider, mode)
+
+    def _cancel_others(self, attempts, winner, mode=None):
+        """Cancel every unfinished attempt but the winner
+        
+        With a mode, the time the losers had already spent is recorded as a
+        lower bound of their latency, so slow answers still count towards p95.
+        """
+        now = time.monotonic()
+        for attempt in attempts:
+            if attempt is winner or attempt.finished or attempt.cancelled:
+                continue
+            attempt.cancelled = True
+            if mode is not None:
+                attempt.provider.record(mode, now - attempt.started)
+            if attempt.task is not None:
+                attempt.task.cancel()
+
+    def _take_slot(self, attempt, attempts, reason):
+        """Give an attempt that runs alongside others its own limiter slot; False if none is free"""
+        if self.limiter is None or self.limiter.try_acquire():
+            attempt.slot = attempt.own_slot = self.limiter is not None
+            return True
+        # No more hedges for this request; a fallback waits for the running attempts to fail
+        attempts[-1].hedge_skipped = True
+        logger.info(f"LLM {reason} skipped: no free LLM slot for {attempt.provider.name}")
+        return False
+
+    def _failed(self, attempt, mode, error, running):
+        """Record a failed attempt; returns whether the next provider may be tried
+        
+        A 429 is not retried on the fallback model. The caller's limiter
+        slot reports it when the error is raised; while other attempts are
+        still running that slot stays in use, so it is reported here.
+        """
+        attempt.provider.record(mode, error=True)
+        logger.warning(f"LLM provider {attempt.provider.name} failed: {str(error)}")
+        if not is_rate_limit_error(error):
+            return True
+        if running and not attempt.own_slot and self.limiter is not None:
+            self.limiter.report_rate_limit()
+        return False
+
+    def _release_slot(self, attempt, error=None):
+        if attempt.slot:
+            attempt.slot = False
+            self.limiter.release(time.monotonic() - attempt.started, error=error)
+
+    def _log_start(self, attempt, reason):
+        if reason is not None:
+            logger.info(f"LLM {reason}: starting {attempt.provider.name}")
+
+    # Sync path
+
+    def _run_invoke(self, attempt, prompt, results):
+        error = None
+        try:
+            result = attempt.provider.llm.invoke(prompt)
+            results.put((attempt, result, None))
+        except Exception as e:
+            error = e
+            results.put((attempt, None, e))
+        finally:
+            # A cancelled sync invoke still runs to the end, so it keeps its slot until then
+            self._release_slot(attempt, error)
+
+    def invoke(self, prompt):
+        """Return the first successful answer among the providers"""
+        if len(self.providers) == 1:
+            return self._invoke_single(self.providers[0], prompt)
+        if not self.hedge_enabled:
+            return self._invoke_sequential(prompt)
+
+        results = queue.Queue()
+        pending = list(self.providers)
+        attempts = []
+        last_error = None
+
+        def launch(reason=None):
+            attempt = _Attempt(pending[0], reason is not None)
+            if running and not self._take_slot(attempt, attempts, reason):
+                return False
+            pending.pop(0)
+            attempt.provider.count_call()
+            attempt.provider.record('invoke', hedge=reason == 'hedge')
+            attempts.append(attempt)
+            self._log_start(attempt, reason)
+            _attempt_pool.submit(self._run_invoke, attempt, prompt, results)
+            return True
+
+        running = 0
+        launch()
+        running = 1
+        while running:
+            deadline = self._next_deadline(attempts, pending, 'invoke')
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                attempt, result, error = results.get(timeout=timeout)
+            except queue.Empty:
+                if launch('hedge'):
+                    running += 1
+                continue
+
+            running -= 1
+            attempt.finished = True
+            if error is None:
+                attempt.provider.record('invoke', time.monotonic() - attempt.started, won=True)
+                self._cancel_others(attempts, attempt, 'invoke')
+                return result
+
+            last_error = error
+            if self._failed(attempt, 'invoke', error, running):
+                if pending and launch('fallback'):
+                    running += 1
+            elif not running:
+                break
+
+        raise last_error
+
+    def _invoke_single(self, provider, prompt):
+        provider.count_call()
+        started = time.monotonic()
+        try:
+            result = provider.llm.invoke(prompt)
+        except Exception:
+            provider.record('invoke', error=True)
+            raise
+        provider.record('invoke', time.monotonic() - started, won=True)
+        return result
+
+    def _may_fall_back(self, provider, position, error):
+        """Without hedging: whether a failed provider is replaced by the next one (never on a 429)"""
+        logger.warning(f"LLM provider {provider.name} failed: {str(error)}")
+        if position == len(self.providers) - 1 or is_rate_limit_error(error):
+            return False
+        logger.info(f"LLM fallback: starting {self.providers[position + 1].name}")
+        return True
+
+    def _invoke_sequential(self, prompt):
+        """Call the providers in order in the calling thread until one answers"""
+        for position, provider in enumerate(self.providers):
+            try:
+                return self._invoke_single(provider, prompt)
+            except Exception as e:
+                if not self._may_fall_back(provider, position, e):
+                    raise
+
+    def _stream_sequential(self, prompt):
+        """Stream from the providers in order in the calling thread; a provider failing before any output is replaced"""
+        for position, provider in enumerate(self.providers):
+            has_output = False
+            try:
+                for chunk in self._stream_single(provider, prompt):
+                    has_output = has_output or _has_output(chunk)
+                    yield chunk
+                return
+            except Exception as e:
+                if has_output or not self._may_fall_back(provider, position, e):
+                    raise
+
+    def _stream_single(self, provider, prompt):
+        provider.count_call()
+        started = time.monotonic()
+        first_output = True
+        try:
+            for chunk in provider.llm.stream(prompt):
+                if first_output and _has_output(chunk):
+                    provider.record('stream', time.monotonic() - started, won=True)
+                    first_output = False
+                yield chunk
+        except Exception:
+            provider.record('stream', error=True)
+            raise
+
+    def _run_stream(self, attempt, prompt, events):
+        iterator = None
+        error = None
+        try:
+            iterator = iter(attempt.provider.llm.stream(prompt))
+            for chunk in iterator:
+                if attempt.cancelled:
+                    break
+                events.put((attempt, 'chunk', chunk))
+            events.put((attempt, 'end', None))
+        except Exception as e:
+            error = e
+            events.put((attempt, 'error', e))
+        finally:
+            self._release_slot(attempt, error)
+            # Closing the generator releases the HTTP response of a losing attempt
+            close = getattr(iterator, 'close', None)
+            if attempt.cancelled and close is not None:
+                try:
+                    close()
+                except Exception:
+                    pass
+
+    def stream(self, prompt):
+        """Yield the chunks of the first provider that produces output"""
+        if len(self.providers) == 1:
+            yield from self._stream_single(self.providers[0], prompt)
+            return
+        if not self.hedge_enabled:
+            yield from self._stream_sequential(prompt)
+            return
+
+        events = queue.Queue()
+        pending = list(self.providers)
+        attempts = []
+        winner = None
+        last_error = None
+
+        def launch(reason=None):
+            attempt = _Attempt(pending[0], reason is not None)
+            if running and not self._take_slot(attempt, attempts, reason):
+                return False
+            pending.pop(0)
+            attempt.provider.count_call()
+            attempt.provider.record('stream', hedge=reason == 'hedge')
+            attempts.append(attempt)
+            self._log_start(attempt, reason)
+            _attempt_pool.submit(self._run_stream, attempt, prompt, events)
+            return True
+
+        running = 0
+        launch()
+        running = 1
+        try:
+            while running:
+                deadline = None if winner is not None else self._next_deadline(attempts, pending, 'stream')
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    attempt, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    if launch('hedge'):
+                        running += 1
+                    continue
+
+                if winner is not None and attempt is not winner:
+                    continue
+
+                if kind == 'chunk':
+                    if winner is None:
+                        if not _has_output(value):
+                            continue
+                        winner = attempt
+                        attempt.provider.record('stream', time.monotonic() - attempt.started, won=True)
+                        self._cancel_others(attempts, winner, 'stream')
+                    yield value
+                    continue
+
+                running -= 1
+                attempt.finished = True
+                if kind == 'end':
+                    if winner is None:
+                        # Finished without any content: an empty answer still wins
+                        attempt.provider.record('stream', time.monotonic() - attempt.started, won=True)
+                        self._cancel_others(attempts, attempt, 'stream')
+                    return
+
+                may_fall_back = self._failed(attempt, 'stream', value, running)
+                if winner is not None:
+                    # Output was already sent to the client; nothing to fall back to
+                    raise value
+                last_error = value
+                if may_fall_back:
+                    if pending and launch('fallback'):
+                        running += 1
+                elif not running:
+                    break
+
+            raise last_error
+        finally:
+            # Also stops the pumps when the reader goes away early
+            for attempt in attempts:
+                attempt.cancelled = True
+
+    # Async path
+
+    async def _run_ainvoke(self, attempt, prompt, results):
+        error = None
+        try:
+            result = await attempt.provider.llm.ainvoke(prompt)
+            await results.put((attempt, result, None))
+        except asyncio.CancelledError as e:
+            error = e
+            raise
+        except Exception as e:
+            error = e
+            await results.put((attempt, None, e))
+        finally:
+            self._release_slot(attempt, error)
+
+    async def ainvoke(self, prompt):
+        """Async variant of invoke(); losing attempts are cancelled"""
+        results = asyncio.Queue()
+        pending = list(self.providers)
+        attempts = []
+        last_error = None
+
+        def launch(reason=None):
+            attempt = _Attempt(pending[0], reason is not None)
+            if running and not self._take_slot(attempt, attempts, reason):
+                return False
+            pending.pop(0)
+            attempt.provider.count_call()
+            attempt.provider.record('invoke', hedge=reason == 'hedge')
+            attempts.append(attempt)
+            self._log_start(attempt, reason)
+            attempt.task = asyncio.get_running_loop().create_task(self._run_ainvoke(attempt, prompt, results))
+            return True
+
+        running = 0
+        launch()
+        running = 1
+        try:
+            while running:
+                deadline = self._next_deadline(attempts, pending, 'invoke')
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    attempt, result, error = await asyncio.wait_for(results.get(), timeout)
+                except asyncio.TimeoutError:
+                    if launch('hedge'):
+                        running += 1
+                    continue
+
+                running -= 1
+                attempt.finished = True
+                if error is None:
+                    attempt.provider.record('invoke', time.monotonic() - attempt.started, won=True)
+                    self._cancel_others(attempts, attempt, 'invoke')
+                    return result
+
+                last_error = error
+                if self._failed(attempt, 'invoke', error, running):
+                    if pending and launch('fallback'):
+                        running += 1
+                elif not running:
+                    break
+
+            raise last_error
+        finally:
+            self._cancel_others(attempts, None)
+
+    async def _run_astream(self, attempt, prompt, events):
+        error = None
+        try:
+            async for chunk in attempt.provider.llm.astream(prompt):
+                await events.put((attempt, 'chunk', chunk))
+            await events.put((attempt, 'end', None))
+        except asyncio.CancelledError as e:
+            error = e
+            raise
+        except Exception as e:
+            error = e
+            await events.put((attempt, 'error', e))
+        finally:
+            self._release_slot(attempt, error)
+
+    async def astream(self, prompt):
+        """Async variant of stream(); losing attempts are cancelled"""
+        events = asyncio.Queue()
+        pending = list(self.providers)
+        attempts = []
+        winner = None
+        last_error = None
+
+        def launch(reason=None):
+            attempt = _Attempt(pending[0], reason is not None)
+            if running and not self._take_slot(attempt, attempts, reason):
+                return False
+            pending.pop(0)
+            attempt.provider.count_call()
+            attempt.provider.record('stream', hedge=reason == 'hedge')
+            attempts.append(attempt)
+            self._log_start(attempt, reason)
+            attempt.task = asyncio.get_running_loop().create_task(self._run_astream(attempt, prompt, events))
+            return True
+
+        running = 0
+        launch()
+        running = 1
+        try:
+            while running:
+                deadline = None if winner is not None else self._next_deadline(attempts, pending, 'stream')
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    attempt, kind, value = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    if launch('hedge'):
+                        running += 1
+                    continue
+
+                if winner is not None and attempt is not winner:
+                    continue
+
+                if kind == 'chunk':
+                    if winner is None:
+                        if not _has_output(value):
+                            continue
+                        winner = attempt
+                        attempt.provider.record('stream', time.monotonic() - attempt.started, won=True)
+                        self._cancel_others(attempts, winner, 'stream')
+                    yield value
+                    continue
+
+                running -= 1
+                attempt.finished = True
+                if kind == 'end':
+                    if winner is None:
+                        attempt.provider.record('stream', time.monotonic() - attempt.started, won=True)
+                    return
+
+                may_fall_back = self._failed(attempt, 'stream', value, running)
+                if winner is not None:
+                    raise value
+                last_error = value
+                if may_fall_back:
+                    if pending and launch('fallback'):
+                        running += 1
+                elif not running:
+                    break
+
+            raise last_error
+        finally:
+            self._cancel_others(attempts, None)
+
+    def stats(self):
+        """Return per-provider call, win, error and latency statistics"""
+        return {
+            'hedge_enabled': self.hedge_enabled,
+            'hedge_delay_seconds': {
+                'invoke': round(self.hedge_delay(self.providers[0], 'invoke'), 3),
+                'stream': round(self.hedge_delay(self.providers[0], 'stream'), 3)
+            },
+            'providers': [provider.stats() for provider in self.providers]
+        }
+
+def build_llm(api_key, limiter=None):
+    """Build the chat model from GROQ_MODEL / GROQ_FALLBACK_MODEL
+
+    An empty GROQ_FALLBACK_MODEL disables the fallback (and hedging).
+    Hedging is opt-in (LLM_HEDGE_ENABLED=1); otherwise the fallback is used
+    for errors only. Hedges take their slots from limiter.
+    """
+    from langchain_groq import ChatGroq
+
+    models = [os.getenv('GROQ_MODEL', DEFAULT_MODEL)]
+    fallback_model = os.getenv('GROQ_FALLBACK_MODEL', DEFAULT_FALLBACK_MODEL)
+    if fallback_model and fallback_model not in models:
+        models.append(fallback_model)
+
+    providers = []
+    for model in models:
+        llm = ChatGroq(
+            model=model,
+            temperature=0.2,          # Low temperature for more consistent responses
+            api_key=api_key,
+        )
+        providers.append(LLMProvider(f"groq:{model}", llm))
+
+    logger.info(f"LLM providers: {', '.join(p.name for p in providers)}")
+    return HedgedLLM(providers, hedge_enabled=os.getenv('LLM_HEDGE_ENABLED', '0') == '1', limiter=limiter)
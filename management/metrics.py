@@ -0,0 +1,121 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+)
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Multi-worker mode: every gunicorn worker writes its samples to files in
+# PROMETHEUS_MULTIPROC_DIR and /metrics aggregates them. The variable must be
+# set (to an empty directory) before the workers start.
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Buckets from 5 ms to 30 s: cache hits sit at the bottom, Groq/Polly calls at the top
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REQUEST_SECONDS = Histogram(
+    'endochat_request_seconds',
+    'HTTP request latency by endpoint and status class',
+    ['endpoint', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+
+CHAT_STAGE_SECONDS = Histogram(
+    'endochat_chat_stage_seconds',
+    'Latency of each stage of the chat pipeline',
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+
+TTS_SECONDS = Histogram(
+    'endochat_tts_seconds',
+    'Speech synthesis latency by outcome (cache_hit, polly, failed)',
+    ['outcome'],
+    buckets=LATENCY_BUCKETS
+)
+
+EMBEDDING_BATCH_SIZE = Histogram(
+    'endochat_embedding_batch_size',
+    'Number of queries embedded together by the embedding batcher',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+
+EMBEDDING_QUEUE_SECONDS = Histogram(
+    'endochat_embedding_queue_seconds',
+    'Time a query waited in the embedding batcher before its batch ran',
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+
+CACHE_EVENTS = Counter(
+    'endochat_cache_events_total',
+    'Cache lookups by cache and result',
+    ['cache', 'result']
+)
+
+ERRORS = Counter(
+    'endochat_errors_total',
+    'Errors by endpoint or pipeline stage',
+    ['where']
+)
+
+def observe_stage(stage, seconds):
+    """Record the duration of a chat pipeline stage"""
+    CHAT_STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+@contextmanager
+def stage_timer(stage):
+    """Time the enclosed block as a chat pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+def observe_request(endpoint, status_code, seconds):
+    """Record an HTTP request and count server errors"""
+    status = f"{int(status_code) // 100}xx"
+    REQUEST_SECONDS.labels(endpoint=endpoint, status=status).observe(seconds)
+    if int(status_code) >= 500:
+        ERRORS.labels(where=endpoint).inc()
+
+def observe_tts(outcome, seconds):
+    """Record a speech synthesis request"""
+    TTS_SECONDS.labels(outcome=outcome).observe(seconds)
+
+def observe_embedding_batch(size, queue_waits):
+    """Record the size of an embedding batch and how long its queries queued"""
+    EMBEDDING_BATCH_SIZE.observe(size)
+    for seconds in queue_waits:
+        EMBEDDING_QUEUE_SECONDS.observe(seconds)
+
+def count_cache(cache, hit):
+    """Count a cache hit or miss"""
+    CACHE_EVENTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+def count_error(where):
+    """Count an error that did not surface as an HTTP 5xx"""
+    ERRORS.labels(where=where).inc()
+
+def render_metrics():
+    """Render all metrics in the Prometheus text format
+
+    Returns:
+        tuple: (body, content_type)
+    """
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def mark_worker_dead(pid):
+    """Drop live-gauge files of a gunicorn worker that exited"""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
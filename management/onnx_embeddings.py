@@ -0,0 +1,107 @@
+import os
+import logging
+import platform
+import numpy as np
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Default settings (overridable through environment variables)
+DEFAULT_MODEL_REPO = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_MAX_LENGTH = 256   # Same truncation as the sentence-transformers model
+DEFAULT_BATCH_SIZE = 32
+
+# ONNX exports published in the model repository (identical weights to the
+# PyTorch model); the int8 files are dynamically quantized per CPU family
+FLOAT_MODEL_FILE = "onnx/model.onnx"
+INT8_MODEL_FILES = {
+    'x86_64': "onnx/model_quint8_avx2.onnx",
+    'AMD64': "onnx/model_quint8_avx2.onnx",
+    'arm64': "onnx/model_qint8_arm64.onnx",
+    'aarch64': "onnx/model_qint8_arm64.onnx"
+}
+
+class OnnxEmbeddings:
+    """MiniLM sentence embeddings computed with ONNX Runtime instead of PyTorch.
+
+    Runs the ONNX export of the same checkpoint, then applies the pipeline
+    of the sentence-transformers model: mean pooling over the attention mask
+    followed by L2 normalization. Vectors therefore match the PyTorch ones
+    (and the existing Chroma index) up to float rounding, or to quantization
+    error with the int8 model. Only onnxruntime, tokenizers and numpy are
+    needed at runtime.
+    """
+
+    def __init__(self, model_path, tokenizer_path, max_length=None, batch_size=None, threads=None):
+        """Load the ONNX model and its tokenizer"""
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.model_path = model_path
+        self.max_length = max_length or int(os.getenv('EMBEDDING_ONNX_MAX_LENGTH', DEFAULT_MAX_LENGTH))
+        self.batch_size = batch_size or int(os.getenv('EMBEDDING_ONNX_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=self.max_length)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id('[PAD]') or 0, pad_token='[PAD]')
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = threads if threads is not None else int(os.getenv('EMBEDDING_ONNX_THREADS', '0'))
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        logger.info(f"Loaded ONNX embedding model {model_path}")
+
+    @classmethod
+    def from_pretrained(cls, repo_id=None, quantized=False, **kwargs):
+        """Fetch (or reuse from the Hugging Face cache) the ONNX export of a model"""
+        from huggingface_hub import hf_hub_download
+
+        repo_id = repo_id or DEFAULT_MODEL_REPO
+        model_file = FLOAT_MODEL_FILE
+        if quantized:
+            model_file = INT8_MODEL_FILES.get(platform.machine(), INT8_MODEL_FILES['x86_64'])
+        model_file = os.getenv('EMBEDDING_ONNX_FILE', model_file)
+
+        model_path = hf_hub_download(repo_id, model_file)
+        tokenizer_path = hf_hub_download(repo_id, "tokenizer.json")
+        return cls(model_path, tokenizer_path, **kwargs)
+
+    def _embed_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+
+        inputs = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self.input_names:
+            inputs['token_type_ids'] = np.zeros_like(input_ids)
+        token_embeddings = self.session.run(None, inputs)[0]
+
+        # Mean pooling over real tokens, then L2 normalization
+        mask = attention_mask[:, :, None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        pooled = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts):
+        """Embed a list of texts, batch_size at a time"""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text):
+        """Embed a single query"""
+        return self._embed_batch([text])[0].tolist()
+
+def min_cosine_similarity(reference, candidate):
+    """Smallest cosine similarity between matching rows of two embedding lists"""
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    dots = np.einsum('ij,ij->i', reference, candidate)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    return float((dots / np.clip(norms, 1e-12, None)).min())
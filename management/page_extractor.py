@@ -0,0 +1,225 @@
+import fitz  # PyMuPDF
+import io
+import os
+import hashlib
+import time
+import logging
+import threading
+from PIL import Image
+from management.file_index import get_content_hash
+from management.single_flight import SingleFlight
+from management.metrics import count_cache
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Define paths
+PAGE_CACHE_PATH = "./page_cache"
+
+# Default settings (overridable through environment variables)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # Disk cap for all cached pages and previews
+DEFAULT_PREVIEW_DPI = 110              # Readable on a phone, a few dozen KB per page
+DEFAULT_EVICTION_GRACE = 60.0          # Seconds a just-used file is safe from eviction
+MAX_WINDOW = 2                         # At most 2 pages on each side of the cited page
+WEBP_QUALITY = 80
+
+# Output formats -> (file extension, mimetype)
+FORMATS = {
+    'pdf': ('pdf', 'application/pdf'),
+    'png': ('png', 'image/png'),
+    'webp': ('webp', 'image/webp')
+}
+
+class PageExtractor:
+    """Cuts single pages (or a small page window) out of the source PDFs.
+
+    A page is served either as a tiny PDF or as a PNG/WebP preview. Results
+    are content-addressed: the cache key includes the SHA-256 of the source
+    PDF, so a replaced document never serves stale pages and identical
+    requests across workers share the same file. The cache directory is
+    bounded by `max_bytes` and evicted least recently used first; the size
+    and the LRU order are read from the directory itself (modification
+    times), so all workers share one budget. Files used within the last
+    `eviction_grace` seconds are never evicted, so a path just returned by
+    get_page() stays valid until send_file opens it.
+    """
+
+    def __init__(self, cache_dir=PAGE_CACHE_PATH, max_bytes=None, preview_dpi=None, eviction_grace=None):
+        """Initialize the extractor"""
+        self.cache_dir = os.path.abspath(cache_dir)  # send_file resolves relative paths against the app root
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.getenv('PAGE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        self.preview_dpi = preview_dpi or int(os.getenv('PAGE_PREVIEW_DPI', DEFAULT_PREVIEW_DPI))
+        self.eviction_grace = eviction_grace if eviction_grace is not None else float(
+            os.getenv('PAGE_CACHE_EVICTION_GRACE_SECONDS', DEFAULT_EVICTION_GRACE))
+
+        self.lock = threading.Lock()
+        self.page_counts = {}         # content hash -> number of pages
+        self.hits = 0
+        self.misses = 0
+        self.single_flight = SingleFlight('page_extractor')
+
+        # Create cache directory if it doesn't exist
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+            logger.info(f"Created page cache directory: {self.cache_dir}")
+
+    def _cache_name(self, content_hash, first, last, fmt):
+        dpi = self.preview_dpi if fmt != 'pdf' else 0
+        key = hashlib.sha256(f"{content_hash}:{first}:{last}:{fmt}:{dpi}".encode('utf-8')).hexdigest()
+        return f"{key}.{FORMATS[fmt][0]}"
+
+    def _touch(self, name):
+        """Mark a cached file as recently used; False if it is gone"""
+        try:
+            os.utime(os.path.join(self.cache_dir, name))  # The LRU order lives in the mtimes
+            return True
+        except OSError:
+            return False
+
+    def _scan(self):
+        """Return [(mtime, name, size)] of the cached files, shared by all workers"""
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue  # Evicted by another worker in the meantime
+            found.append((stat.st_mtime, name, stat.st_size))
+        return found
+
+    def _evict(self):
+        """Remove least recently used files until the directory fits in max_bytes"""
+        try:
+            found = self._scan()
+        except Exception as e:
+            logger.error(f"Error scanning page cache: {str(e)}")
+            return
+
+        total_bytes = sum(size for _, _, size in found)
+        recent = time.time() - self.eviction_grace
+        evicted = 0
+        for mtime, name, size in sorted(found):
+            if total_bytes <= self.max_bytes or mtime >= recent:
+                break  # Sorted by mtime: everything after this one was used recently too
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass  # Another worker evicted it first
+            except OSError:
+                continue
+            total_bytes -= size
+            evicted += 1
+        if evicted:
+            logger.debug(f"Evicted {evicted} cached pages")
+
+    def _render(self, pdf_path, first, last, fmt):
+        """Produce the bytes of a page window (pdf) or of a page preview (png/webp)"""
+        doc = fitz.open(pdf_path)
+        try:
+            if fmt == 'pdf':
+                out = fitz.open()
+                try:
+                    out.insert_pdf(doc, from_page=first, to_page=last)
+                    return out.tobytes(garbage=3, deflate=True)
+                finally:
+                    out.close()
+
+            pix = doc.load_page(first).get_pixmap(dpi=self.preview_dpi, alpha=False)
+            if fmt == 'png':
+                return pix.tobytes('png')
+
+            image = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+            buffer = io.BytesIO()
+            image.save(buffer, 'WEBP', quality=WEBP_QUALITY)
+            return buffer.getvalue()
+        finally:
+            doc.close()
+
+    def _build(self, pdf_path, name, first, last, fmt):
+        path = os.path.join(self.cache_dir, name)
+        if self._touch(name):
+            return path
+
+        data = self._render(pdf_path, first, last, fmt)
+
+        # Write atomically so other workers never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        self._evict()
+        logger.info(f"Cached {fmt} of {os.path.basename(pdf_path)} pages {first + 1}-{last + 1} ({len(data)} bytes)")
+        return path
+
+    def page_count(self, pdf_path, content_hash=None):
+        """Return the number of pages of a PDF (remembered per content hash)"""
+        content_hash = content_hash or get_content_hash(pdf_path)
+        with self.lock:
+            count = self.page_counts.get(content_hash)
+        if count is None:
+            doc = fitz.open(pdf_path)
+            try:
+                count = len(doc)
+            finally:
+                doc.close()
+            with self.lock:
+                self.page_counts[content_hash] = count
+        return count
+
+    def get_page(self, pdf_path, page, window=0, fmt='pdf'):
+        """
+        Return (path, mimetype) of a cached rendering of a page.
+
+        Args:
+            pdf_path (str): Source PDF
+            page (int): 1-based page number, as shown in the sources
+            window (int): Pages to include on each side of the page (pdf only)
+            fmt (str): 'pdf', 'png' or 'webp'
+
+        Returns:
+            tuple: (path, mimetype), or None if the page does not exist
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported page format: {fmt}")
+
+        content_hash = get_content_hash(pdf_path)
+        page_total = self.page_count(pdf_path, content_hash)
+        if page < 1 or page > page_total:
+            return None
+
+        window = max(0, min(window, MAX_WINDOW)) if fmt == 'pdf' else 0
+        first = max(0, page - 1 - window)
+        last = min(page_total - 1, page - 1 + window)
+
+        name = self._cache_name(content_hash, first, last, fmt)
+        if self._touch(name):
+            with self.lock:
+                self.hits += 1
+            count_cache('page', True)
+            return os.path.join(self.cache_dir, name), FORMATS[fmt][1]
+
+        with self.lock:
+            self.misses += 1
+        count_cache('page', False)
+        path = self.single_flight.do(name, self._build, pdf_path, name, first, last, fmt)
+        return path, FORMATS[fmt][1]
+
+    def stats(self):
+        """Return cache statistics"""
+        try:
+            found = self._scan()
+        except Exception as e:
+            logger.error(f"Error scanning page cache: {str(e)}")
+            found = []
+        with self.lock:
+            return {
+                'entries': len(found),
+                'total_bytes': sum(size for _, _, size in found),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
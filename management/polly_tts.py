@@ -3,16 +3,38 @@ import os
 import logging
 import hashlib
 import json
+import threading
+import time
+import asyncio
+import httpx
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
 from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
 from datetime import datetime, timedelta
+from management.single_flight import SingleFlight, AsyncSingleFlight, file_lock, async_file_lock
+from management.metrics import observe_tts, count_cache
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# Number of lock files used to serialize cache writers across workers
+LOCK_STRIPES = 64
+
 class PollyTTSManager:
-    def __init__(self):
-        """Initialize the Amazon Polly TTS Manager"""
-        self.client = None
+    def __init__(self, client=None):
+        """Initialize the Amazon Polly TTS Manager
+        
+        Args:
+            client: optional Polly client used instead of one built from the
+                AWS credentials (the benchmarks pass a stub to run offline)
+        """
+        self.client = client
+        self.credentials = None
+        self.region = None
+        self.async_http = None  # Lazily created httpx.AsyncClient for the ASGI path
+        self.synthesis_flight = SingleFlight('tts')
+        self.async_synthesis_flight = AsyncSingleFlight('tts')
         self.audio_cache_dir = "./static/audio_cache"
         self.cache_duration_hours = 24  # Cache audio files for 24 hours
         
@@ -22,7 +44,8 @@ class PollyTTSManager:
             logger.info(f"Created audio cache directory: {self.audio_cache_dir}")
         
         # Initialize AWS Polly client
-        self._initialize_polly_client()
+        if self.client is None:
+            self._initialize_polly_client()
     
     def _initialize_polly_client(self):
         """Initialize the AWS Polly client with credentials"""
@@ -30,20 +53,27 @@ class PollyTTSManager:
             # Get AWS credentials from environment variables
             aws_access_key = os.getenv('AWS_ACCESS_KEY_ID')
             aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
+            aws_session_token = os.getenv('AWS_SESSION_TOKEN')  # Set for temporary (STS) credentials
             aws_region = os.getenv('AWS_REGION', 'us-east-1')
             
             if not aws_access_key or not aws_secret_key:
                 logger.error("AWS credentials not found in environment variables")
                 return False
             
-            # Create Polly client
-            self.client = boto3.client(
-                'polly',
+            session = boto3.Session(
                 aws_access_key_id=aws_access_key,
                 aws_secret_access_key=aws_secret_key,
+                aws_session_token=aws_session_token,
                 region_name=aws_region
             )
             
+            # Keep botocore's resolved credentials for signing requests on the async path
+            self.credentials = session.get_credentials()
+            self.region = aws_region
+            
+            # Create Polly client
+            self.client = session.client('polly')
+            
             # Test the connection by listing voices (without MaxItems parameter)
             test_response = self.client.describe_voices()
             logger.info("Successfully connected to Amazon Polly")
@@ -127,41 +157,53 @@ class PollyTTSManager:
             logger.error("Polly client not initialized")
             return None
         
-        # Clean text for TTS (remove markdown, etc.)
-        clean_text = self._clean_text_for_tts(text)
-        
-        if not clean_text.strip():
-            logger.warning("Empty text provided for TTS")
+        started = time.perf_counter()
+        clean_text, cache_key, cache_file_path = self._prepare_synthesis(text, language)
+        if not clean_text:
             return None
         
-        # Generate cache key and file path
-        cache_key = self._generate_cache_key(clean_text, language)
-        cache_file_path = os.path.join(self.audio_cache_dir, f"{cache_key}.mp3")
-        
         # Check if we have a valid cached version
         if self._is_cache_valid(cache_file_path):
             logger.debug(f"Using cached audio file: {cache_key}")
+            count_cache('tts', True)
+            observe_tts('cache_hit', time.perf_counter() - started)
             return f"audio_cache/{cache_key}.mp3"
         
+        # Identical concurrent requests share a single Polly call
+        count_cache('tts', False)
+        audio_path = self.synthesis_flight.do(
+            cache_key, self._synthesize_uncached, clean_text, language, cache_key, cache_file_path
+        )
+        observe_tts('polly' if audio_path else 'failed', time.perf_counter() - started)
+        return audio_path
+    
+    def _synthesize_uncached(self, clean_text, language, cache_key, cache_file_path):
+        """Call Polly for text that is not in the audio cache yet"""
         # Get voice configuration for language
         voice_config = self.get_voice_for_language(language)
         
         try:
-            # Clean up old cache files periodically
-            self._cleanup_old_cache_files()
-            
-            # Make the Polly request
-            response = self.client.synthesize_speech(
-                Text=clean_text,
-                OutputFormat='mp3',
-                VoiceId=voice_config['voice_id'],
-                Engine=voice_config['engine'],
-                SampleRate='22050'  # Good quality for web playback
-            )
-            
-            # Save the audio stream to file
-            with open(cache_file_path, 'wb') as audio_file:
-                audio_file.write(response['AudioStream'].read())
+            # Serialize writers of this cache entry across worker processes
+            with file_lock(self._lock_path(cache_key)):
+                # Another worker may have produced the file while we waited
+                if self._is_cache_valid(cache_file_path):
+                    logger.debug(f"Using cached audio file: {cache_key}")
+                    return f"audio_cache/{cache_key}.mp3"
+                
+                # Clean up old cache files periodically
+                self._cleanup_old_cache_files()
+                
+                # Make the Polly request
+                response = self.client.synthesize_speech(
+                    Text=clean_text,
+                    OutputFormat='mp3',
+                    VoiceId=voice_config['voice_id'],
+                    Engine=voice_config['engine'],
+                    SampleRate='22050'  # Good quality for web playback
+                )
+                
+                # Save the audio stream to file
+                self._write_audio_file(cache_file_path, response['AudioStream'].read())
             
             logger.info(f"Generated TTS audio for language '{language}' using voice '{voice_config['voice_id']}'")
             
@@ -172,8 +214,10 @@ class PollyTTSManager:
             error_code = e.response['Error']['Code']
             if error_code == 'TextLengthExceededException':
                 logger.error("Text too long for Polly synthesis")
-                # Try to truncate and retry
+                # Try to truncate and retry (the lock has been released by now)
                 truncated_text = clean_text[:3000]  # Polly limit is around 3000 characters
+                if truncated_text == clean_text:
+                    return None
                 logger.info("Retrying with truncated text")
                 return self.synthesize_speech(truncated_text, language)
             else:
@@ -188,6 +232,147 @@ class PollyTTSManager:
             logger.error(f"Unexpected error in speech synthesis: {str(e)}")
             return None
     
+    def _prepare_synthesis(self, text, language='en'):
+        """Clean the text and resolve its cache key and cache file path
+        
+        Returns:
+            tuple: (clean_text, cache_key, cache_file_path); clean_text is
+            None when there is nothing to synthesize
+        """
+        # Clean text for TTS (remove markdown, etc.)
+        clean_text = self._clean_text_for_tts(text)
+        
+        if not clean_text.strip():
+            logger.warning("Empty text provided for TTS")
+            return None, None, None
+        
+        # Generate cache key and file path
+        cache_key = self._generate_cache_key(clean_text, language)
+        cache_file_path = os.path.join(self.audio_cache_dir, f"{cache_key}.mp3")
+        return clean_text, cache_key, cache_file_path
+    
+    def _lock_path(self, cache_key):
+        """Lock file guarding a cache entry (striped to keep the number of files bounded)"""
+        stripe = int(cache_key[:4], 16) % LOCK_STRIPES
+        return os.path.join(self.audio_cache_dir, '.locks', f"tts_{stripe}.lock")
+    
+    def _write_audio_file(self, cache_file_path, audio_data):
+        """Write an audio file atomically so readers never see a partial file"""
+        tmp_path = f"{cache_file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as audio_file:
+            audio_file.write(audio_data)
+        os.replace(tmp_path, cache_file_path)
+    
+    async def asynthesize_speech(self, text, language='en'):
+        """
+        Async variant of synthesize_speech for the ASGI serving path.
+        
+        Calls the Polly REST API directly with a SigV4-signed httpx request,
+        so waiting on AWS does not hold an OS thread.
+        
+        Args:
+            text (str): Text to convert to speech
+            language (str): Language code ('en', 'fr', 'ar')
+            
+        Returns:
+            str: Path to the generated audio file, or None if failed
+        """
+        if not self.client:
+            logger.error("Polly client not initialized")
+            return None
+        
+        if not self.credentials:
+            # No credentials to sign with (e.g. an injected client): use the client in a thread
+            return await asyncio.to_thread(self.synthesize_speech, text, language)
+        
+        started = time.perf_counter()
+        clean_text, cache_key, cache_file_path = self._prepare_synthesis(text, language)
+        if not clean_text:
+            return None
+        
+        # Check if we have a valid cached version (file I/O stays off the event loop)
+        if await asyncio.to_thread(self._is_cache_valid, cache_file_path):
+            logger.debug(f"Using cached audio file: {cache_key}")
+            count_cache('tts', True)
+            observe_tts('cache_hit', time.perf_counter() - started)
+            return f"audio_cache/{cache_key}.mp3"
+        
+        # Identical concurrent requests share a single Polly call
+        count_cache('tts', False)
+        audio_path = await self.async_synthesis_flight.do(
+            cache_key, self._asynthesize_uncached, clean_text, language, cache_key, cache_file_path
+        )
+        observe_tts('polly' if audio_path else 'failed', time.perf_counter() - started)
+        return audio_path
+    
+    async def _asynthesize_uncached(self, clean_text, language, cache_key, cache_file_path):
+        """Async counterpart of _synthesize_uncached"""
+        voice_config = self.get_voice_for_language(language)
+        text_too_long = False
+        
+        try:
+            async with async_file_lock(self._lock_path(cache_key)):
+                # Another worker may have produced the file while we waited
+                if await asyncio.to_thread(self._is_cache_valid, cache_file_path):
+                    logger.debug(f"Using cached audio file: {cache_key}")
+                    return f"audio_cache/{cache_key}.mp3"
+                
+                # Clean up old cache files periodically
+                await asyncio.to_thread(self._cleanup_old_cache_files)
+                
+                url = f"https://polly.{self.region}.amazonaws.com/v1/speech"
+                body = json.dumps({
+                    'Text': clean_text,
+                    'OutputFormat': 'mp3',
+                    'VoiceId': voice_config['voice_id'],
+                    'Engine': voice_config['engine'],
+                    'SampleRate': '22050'
+                })
+                
+                aws_request = AWSRequest(method='POST', url=url, data=body,
+                                         headers={'Content-Type': 'application/json'})
+                # Sign the request the same way boto3 would (frozen: refreshed temporary
+                # credentials must not change between the key and the session token)
+                frozen = await asyncio.to_thread(self.credentials.get_frozen_credentials)
+                credentials = Credentials(frozen.access_key, frozen.secret_key, frozen.token)
+                SigV4Auth(credentials, 'polly', self.region).add_auth(aws_request)
+                
+                if self.async_http is None:
+                    self.async_http = httpx.AsyncClient(timeout=30.0)
+                
+                response = await self.async_http.post(url, content=body, headers=dict(aws_request.headers))
+                
+                if response.status_code == 200:
+                    # Save the audio stream to file
+                    await asyncio.to_thread(self._write_audio_file, cache_file_path, response.content)
+                else:
+                    error_type = response.headers.get('x-amzn-ErrorType', '').split(':')[0]
+                    text_too_long = error_type == 'TextLengthExceededException'
+                    if not text_too_long:
+                        logger.error(f"AWS Polly error: {response.status_code} {error_type} - {response.text[:200]}")
+                        return None
+            
+            if text_too_long:
+                logger.error("Text too long for Polly synthesis")
+                # Retry outside the lock with truncated text
+                truncated_text = clean_text[:3000]
+                if truncated_text == clean_text:
+                    return None
+                logger.info("Retrying with truncated text")
+                return await self.asynthesize_speech(truncated_text, language)
+            
+            logger.info(f"Generated TTS audio for language '{language}' using voice '{voice_config['voice_id']}'")
+            
+            return f"audio_cache/{cache_key}.mp3"
+            
+        except httpx.HTTPError as e:
+            logger.error(f"AWS Polly HTTP error: {str(e)}")
+            return None
+            
+        except Exception as e:
+            logger.error(f"Unexpected error in speech synthesis: {str(e)}")
+            return None
+    
     def _clean_text_for_tts(self, text):
         """Clean text for better TTS output"""
         import re
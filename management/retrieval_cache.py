@@ -0,0 +1,91 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from management.corpus_version import get_corpus_version
+from management.metrics import count_cache
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Default settings (overridable through environment variables)
+DEFAULT_MAX_ENTRIES = 1024
+
+class RetrievalCache:
+    """Memoizes retrieval results (chunk IDs and scores) per query.
+
+    Results for a (normalized query, k, mode) key do not change until the
+    corpus does, so entries are stored with the corpus version stamp and
+    the whole cache is dropped when load_data.py records a new one. Every
+    worker notices the new stamp on its next lookup. Only IDs and scores
+    are kept; callers fetch the chunks themselves. Bounded by max_entries,
+    evicted LRU first.
+    """
+
+    def __init__(self, max_entries=None):
+        """Initialize an empty cache"""
+        self.max_entries = max_entries or int(os.getenv('RETRIEVAL_CACHE_SIZE', DEFAULT_MAX_ENTRIES))
+        self.lock = threading.Lock()
+        self.results = OrderedDict()  # key -> tuple of (chunk ID, score), in LRU order
+        self.corpus_version = get_corpus_version()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_corpus_version(self, version):
+        """Drop every entry if the document corpus has changed (lock held)"""
+        if version != self.corpus_version:
+            if self.results:
+                logger.info("Document corpus changed, clearing retrieval cache")
+            self.results.clear()
+            self.corpus_version = version
+
+    def get(self, key):
+        """Return the cached (chunk ID, score) pairs for key, or None"""
+        version = get_corpus_version()
+        with self.lock:
+            self._check_corpus_version(version)
+            results = self.results.get(key)
+            if results is not None:
+                self.results.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        count_cache('retrieval', results is not None)
+        return results
+
+    def put(self, key, results, version):
+        """Store (chunk ID, score) pairs computed at corpus version"""
+        with self.lock:
+            self._check_corpus_version(get_corpus_version())
+            if version != self.corpus_version:
+                return
+            self.results[key] = tuple(results)
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+
+    def stats(self):
+        """Return cache size and hit rate"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.results),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'corpus_version': self.corpus_version
+            }
+
+# Global retrieval cache
+_retrieval_cache = None
+_retrieval_cache_lock = threading.Lock()
+
+def get_retrieval_cache():
+    """Return the process-wide RetrievalCache"""
+    global _retrieval_cache
+    if _retrieval_cache is None:
+        with _retrieval_cache_lock:
+            if _retrieval_cache is None:
+                _retrieval_cache = RetrievalCache()
+    return _retrieval_cache
@@ -0,0 +1,263 @@
+"""
+Shared embedding and retrieval service for multi-worker deployments.
+
+One process loads the embedding model and the vector store and answers
+embed/search requests over a Unix domain socket; gunicorn workers started
+with RETRIEVAL_SERVICE_SOCKET set use RetrievalClient instead of loading
+their own copies, so model memory no longer grows with the worker count.
+Workers send each query embedding on its own (embed_query, or a search by
+query text), and the service batches the concurrent ones from all workers
+into single model calls. Document embeddings (embed_documents) already come
+in batches and go to the model directly.
+
+Run it next to gunicorn (or let gunicorn.conf.py spawn it):
+    python -m management.retrieval_service --socket /tmp/endochat_retrieval.sock
+"""
+
+import os
+import sys
+import json
+import socket
+import signal
+import struct
+import logging
+import argparse
+import threading
+import socketserver
+from langchain_core.documents import Document
+from management.corpus_version import get_corpus_version
+from management.lexical_index import vector_space, search_by_vector
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Default settings (overridable through environment variables)
+DEFAULT_SOCKET_PATH = "/tmp/endochat_retrieval.sock"
+DEFAULT_TIMEOUT_SECONDS = 30.0
+
+# Messages are a 4-byte big-endian length followed by a UTF-8 JSON body
+HEADER = struct.Struct('>I')
+
+class RetrievalServiceError(Exception):
+    """Raised by the client when the service reports an error"""
+
+def send_message(sock, message):
+    body = json.dumps(message, ensure_ascii=False).encode('utf-8')
+    sock.sendall(HEADER.pack(len(body)) + body)
+
+def _receive_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Retrieval service connection closed")
+        data.extend(chunk)
+    return bytes(data)
+
+def receive_message(sock):
+    (size,) = HEADER.unpack(_receive_exactly(sock, HEADER.size))
+    return json.loads(_receive_exactly(sock, size).decode('utf-8'))
+
+def _serialize_hits(hits):
+    return [
+        {'id': doc.metadata.get('id') or getattr(doc, 'id', None), 'page_content': doc.page_content,
+         'metadata': doc.metadata, 'score': float(score)}
+        for doc, score in hits
+    ]
+
+class RetrievalService:
+    """The model and vector store shared by every worker"""
+
+    def __init__(self):
+        """Load the embedding model (behind a batcher) and the vector store"""
+        from management.embeddings import get_embedding_function
+        from management.embedding_batcher import EmbeddingBatcher
+
+        self.embedding_function = get_embedding_function()
+        self.batcher = EmbeddingBatcher(self.embedding_function)
+        self.lock = threading.Lock()
+        self.db = None
+        self.corpus_version = None
+        self._current_db()
+
+    def _current_db(self):
+        """Return the vector store, reopening it after a new ingestion"""
+        version = get_corpus_version()
+        if self.db is None or version != self.corpus_version:
+            with self.lock:
+                if self.db is None or version != self.corpus_version:
+                    from management.compare_texts import initialize_db
+                    self.db = initialize_db(self.embedding_function)
+                    self.corpus_version = version
+                    logger.info(f"Retrieval service opened {type(self.db).__name__} (corpus {version})")
+        if self.db is None:
+            raise Exception("Failed to initialize database connection")
+        return self.db
+
+    def handle(self, request):
+        """Answer one request"""
+        op = request.get('op')
+        if op == 'embed_query':
+            return {'vector': self.batcher.embed_query(request['text'])}
+        if op == 'embed_documents':
+            return {'vectors': self.embedding_function.embed_documents(request['texts'])}
+        if op == 'search':
+            db = self._current_db()
+            embedding = request.get('embedding')
+            if embedding is None:
+                embedding = self.batcher.embed_query(request['query'])
+            if not request.get('with_vectors'):
+                hits = db.similarity_search_by_vector_with_relevance_scores(embedding, k=request.get('k', 4))
+                return {'hits': _serialize_hits(hits)}
+            vectors = {}
+            hits = search_by_vector(db, embedding, request.get('k', 4), vectors)
+            return {'hits': _serialize_hits(hits),
+                    'vectors': {chunk_id: list(map(float, vector)) for chunk_id, vector in vectors.items()}}
+        if op == 'get':
+            data = self._current_db().get(ids=request.get('ids'), include=request.get('include'))
+            embeddings = data.get('embeddings')
+            if embeddings is not None:
+                data['embeddings'] = [list(map(float, vector)) for vector in embeddings]
+            return {key: value for key, value in data.items() if key in ('ids', 'documents', 'metadatas', 'embeddings')}
+        if op == 'info':
+            return {'space': vector_space(self._current_db()), 'corpus_version': self.corpus_version,
+                    'backend': type(self._current_db()).__name__, 'batcher': self.batcher.stats()}
+        raise ValueError(f"Unknown operation: {op}")
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = receive_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                response = {'ok': True, **self.server.service.handle(request)}
+            except Exception as e:
+                logger.error(f"Retrieval service error in {request.get('op')}: {str(e)}")
+                response = {'ok': False, 'error': str(e)}
+            try:
+                send_message(self.request, response)
+            except OSError:
+                return
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128   # Every worker thread holds one connection
+
+def serve(socket_path=None):
+    """Run the retrieval service until interrupted"""
+    socket_path = socket_path or os.getenv('RETRIEVAL_SERVICE_SOCKET', DEFAULT_SOCKET_PATH)
+    # The service itself must load the model, not connect to itself
+    os.environ.pop('RETRIEVAL_SERVICE_SOCKET', None)
+
+    service = RetrievalService()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = _Server(socket_path, _Handler)
+    server.service = service
+    # Exit through the finally block (removing the socket) on SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logger.info(f"Retrieval service listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+class RetrievalClient:
+    """Thin client of the retrieval service, used by the workers.
+
+    Implements the embedding interface (embed_query, embed_documents) and
+    the vector store calls made on the query path
+    (similarity_search_by_vector_with_relevance_scores,
+    similarity_search_with_score, similarity_search_with_vectors, get), so
+    it can stand in for both. Each
+    thread keeps its own connection and reconnects once if it breaks.
+    """
+
+    def __init__(self, socket_path=None, timeout=None):
+        """Initialize the client (connections are opened lazily)"""
+        self.socket_path = socket_path or os.getenv('RETRIEVAL_SERVICE_SOCKET', DEFAULT_SOCKET_PATH)
+        self.timeout = timeout or float(os.getenv('RETRIEVAL_SERVICE_TIMEOUT_SECONDS', DEFAULT_TIMEOUT_SECONDS))
+        self.local = threading.local()
+        self._space = None
+
+    def _connection(self):
+        sock = getattr(self.local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self.local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self.local, 'sock', None)
+        self.local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def call(self, op, **params):
+        """Send a request and return the response, reconnecting once on a broken connection"""
+        for attempt in (1, 2):
+            try:
+                sock = self._connection()
+                send_message(sock, {'op': op, **params})
+                response = receive_message(sock)
+                break
+            except (ConnectionError, OSError) as e:
+                self._close()
+                if attempt == 2:
+                    raise ConnectionError(f"Retrieval service unavailable at {self.socket_path}: {str(e)}") from e
+        if not response.get('ok'):
+            raise RetrievalServiceError(response.get('error', 'unknown error'))
+        return response
+
+    @property
+    def space(self):
+        """Distance space of the service's vector store"""
+        if self._space is None:
+            self._space = self.call('info')['space']
+        return self._space
+
+    def info(self):
+        """Backend, corpus version and batching statistics of the service"""
+        return self.call('info')
+
+    def embed_query(self, text):
+        return self.call('embed_query', text=text)['vector']
+
+    def embed_documents(self, texts):
+        return self.call('embed_documents', texts=list(texts))['vectors']
+
+    def _hits(self, response):
+        return [
+            (Document(page_content=hit['page_content'], metadata=hit['metadata'], id=hit['id']), hit['score'])
+            for hit in response['hits']
+        ]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, **kwargs):
+        return self._hits(self.call('search', embedding=list(map(float, embedding)), k=k))
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self._hits(self.call('search', query=query, k=k))
+
+    def similarity_search_with_vectors(self, embedding, k=4):
+        response = self.call('search', embedding=list(map(float, embedding)), k=k, with_vectors=True)
+        return self._hits(response), response['vectors']
+
+    def get(self, ids=None, include=None, **kwargs):
+        return self.call('get', ids=ids, include=include)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="EndoChat shared embedding and retrieval service")
+    parser.add_argument('--socket', default=None, help=f"Unix socket path (default: {DEFAULT_SOCKET_PATH})")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    serve(args.socket)
@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from management.corpus_version import get_corpus_version
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Define paths
+SEMANTIC_CACHE_PATH = "./semantic_cache.json"
+
+# Default settings (overridable through environment variables)
+DEFAULT_MAX_DISTANCE = 0.08          # Cosine distance under which two questions are "the same"
+DEFAULT_TTL_SECONDS = 24 * 60 * 60   # Cached answers expire after 24 hours
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024 # Approximate memory cap for all entries
+SAVE_INTERVAL_SECONDS = 30           # Minimum delay between two disk writes
+
+class SemanticCache:
+    """Caches LLM answers for semantically equivalent questions.
+
+    Entries are grouped by (language, set of retrieved chunk IDs); inside a
+    group, a new question hits when its embedding is within `max_distance`
+    (cosine) of a cached question. Entries are evicted by LRU order, TTL and
+    a total byte cap, persisted to disk, and dropped when the corpus changes.
+    """
+
+    def __init__(self, embedding_function, max_distance=None, ttl_seconds=None,
+                 max_bytes=None, persist_path=SEMANTIC_CACHE_PATH):
+        """Initialize the cache and load any persisted entries"""
+        self.embedding_function = embedding_function
+        self.max_distance = max_distance if max_distance is not None else float(
+            os.getenv('SEMANTIC_CACHE_MAX_DISTANCE', DEFAULT_MAX_DISTANCE))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(
+            os.getenv('SEMANTIC_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.getenv('SEMANTIC_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        self.persist_path = persist_path
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # entry_id -> entry, in LRU order
+        self.groups = {}              # (language, chunk_key) -> set of entry_ids
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.corpus_version = get_corpus_version()
+        self.last_saved = time.time()
+        self.dirty = False
+
+        self.load()
+
+    def embed(self, text):
+        """Embed a question as a unit-length float32 vector"""
+        vector = np.asarray(self.embedding_function.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _chunk_key(self, chunk_ids):
+        """Order-independent key for the set of retrieved chunks"""
+        return '|'.join(sorted(str(chunk_id) for chunk_id in chunk_ids if chunk_id))
+
+    def _entry_size(self, entry):
+        """Approximate memory footprint of an entry in bytes"""
+        return (entry['vector'].nbytes
+                + len(entry['question'].encode('utf-8'))
+                + len(entry['answer'].encode('utf-8'))
+                + len(entry['chunk_key'])
+                + 256)
+
+    def _check_corpus_version(self):
+        """Drop every entry if the document corpus has changed"""
+        current_version = get_corpus_version()
+        if current_version != self.corpus_version:
+            logger.info("Document corpus changed, clearing semantic cache")
+            self._clear()
+            self.corpus_version = current_version
+            self.dirty = True
+
+    def _clear(self):
+        self.entries.clear()
+        self.groups.clear()
+        self.total_bytes = 0
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        group_key = (entry['language'], entry['chunk_key'])
+        group = self.groups.get(group_key)
+        if group is not None:
+            group.discard(entry_id)
+            if not group:
+                del self.groups[group_key]
+        self.total_bytes -= entry['size']
+
+    def _add(self, entry_id, entry):
+        entry['size'] = self._entry_size(entry)
+        self.entries[entry_id] = entry
+        self.groups.setdefault((entry['language'], entry['chunk_key']), set()).add(entry_id)
+        self.total_bytes += entry['size']
+
+        # Enforce the byte cap, evicting least recently used entries first
+        while self.total_bytes > self.max_bytes and self.entries:
+            oldest_id = next(iter(self.entries))
+            self._remove(oldest_id)
+
+    def lookup(self, query_vector, language, chunk_ids):
+        """Return a cached answer for an equivalent question, or None"""
+        with self.lock:
+            self._check_corpus_version()
+
+            group = self.groups.get((language, self._chunk_key(chunk_ids)))
+            if not group:
+                self.misses += 1
+                return None
+
+            now = time.time()
+            best_id = None
+            best_distance = None
+            for entry_id in list(group):
+                entry = self.entries[entry_id]
+                if now - entry['created'] > self.ttl_seconds:
+                    self._remove(entry_id)
+                    self.dirty = True
+                    continue
+
+                distance = 1.0 - float(np.dot(query_vector, entry['vector']))
+                if best_distance is None or distance < best_distance:
+                    best_id, best_distance = entry_id, distance
+
+            if best_id is None or best_distance > self.max_distance:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(best_id)
+            self.hits += 1
+            logger.debug(f"Semantic cache hit (distance {best_distance:.4f})")
+            return self.entries[best_id]['answer']
+
+    def store(self, query_vector, language, chunk_ids, question, answer):
+        """Cache the answer given for a question"""
+        with self.lock:
+            self._check_corpus_version()
+
+            self._add(uuid.uuid4().hex, {
+                'vector': np.asarray(query_vector, dtype=np.float32),
+                'language': language,
+                'chunk_key': self._chunk_key(chunk_ids),
+                'question': question,
+                'answer': answer,
+                'created': time.time()
+            })
+            self.dirty = True
+
+        if time.time() - self.last_saved > SAVE_INTERVAL_SECONDS:
+            self.save()
+
+    def invalidate(self):
+        """Remove every cached answer"""
+        with self.lock:
+            self._clear()
+            self.dirty = True
+        self.save()
+
+    def stats(self):
+        """Return cache statistics"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def save(self):
+        """Persist the cache to disk (atomically)"""
+        if not self.persist_path:
+            return
+
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {
+                'corpus_version': self.corpus_version,
+                'entries': [
+                    {
+                        'vector': entry['vector'].tolist(),
+                        'language': entry['language'],
+                        'chunk_key': entry['chunk_key'],
+                        'question': entry['question'],
+                        'answer': entry['answer'],
+                        'created': entry['created']
+                    }
+                    for entry in self.entries.values()
+                ]
+            }
+            self.dirty = False
+            self.last_saved = time.time()
+
+        try:
+            tmp_path = f"{self.persist_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+            logger.debug(f"Saved {len(data['entries'])} semantic cache entries")
+        except Exception as e:
+            logger.error(f"Error saving semantic cache: {str(e)}")
+
+    def load(self):
+        """Load persisted entries that are still valid for the current corpus"""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            if data.get('corpus_version') != self.corpus_version:
+                logger.info("Persisted semantic cache is for an older corpus, ignoring it")
+                return
+
+            now = time.time()
+            with self.lock:
+                for item in data.get('entries', []):
+                    if now - item['created'] > self.ttl_seconds:
+                        continue
+                    item['vector'] = np.asarray(item['vector'], dtype=np.float32)
+                    self._add(uuid.uuid4().hex, item)
+
+            logger.info(f"Loaded {len(self.entries)} semantic cache entries")
+        except Exception as e:
+            logger.error(f"Error loading semantic cache: {str(e)}")
@@ -0,0 +1,138 @@
+import os
+import hmac
+import asyncio
+import hashlib
+import logging
+import secrets
+import threading
+from collections import OrderedDict
+from management.compare_texts import get_conversation_file, load_conversation
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Define paths
+SESSION_KEY_PATH = "./conversations/.session_key"
+
+# Default settings (overridable through environment variables)
+DEFAULT_MAX_SESSIONS = 1000
+SIGNATURE_LENGTH = 32   # Hex characters of the HMAC kept in a session ID
+
+# Key signing the session IDs issued by this server
+_session_key = None
+_session_key_lock = threading.Lock()
+
+def _get_session_key():
+    """Return SESSION_SECRET_KEY, or a random key generated once and shared by every worker through a file"""
+    global _session_key
+    if _session_key is not None:
+        return _session_key
+    with _session_key_lock:
+        if _session_key is None:
+            secret = os.getenv('SESSION_SECRET_KEY')
+            if secret:
+                _session_key = secret.encode('utf-8')
+            else:
+                os.makedirs(os.path.dirname(SESSION_KEY_PATH), exist_ok=True)
+                try:
+                    # The first worker creates the file; the others read it
+                    fd = os.open(SESSION_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                    with os.fdopen(fd, 'w') as f:
+                        f.write(secrets.token_hex(32))
+                    logger.info(f"Generated session key at {SESSION_KEY_PATH}")
+                except FileExistsError:
+                    pass
+                with open(SESSION_KEY_PATH, 'r') as f:
+                    _session_key = f.read().strip().encode('utf-8')
+    return _session_key
+
+def _sign(token):
+    return hmac.new(_get_session_key(), token.encode('utf-8'), hashlib.sha256).hexdigest()[:SIGNATURE_LENGTH]
+
+def new_session_id():
+    """Issue a new unguessable session ID, signed so any worker can check it was issued here"""
+    token = secrets.token_urlsafe(24)
+    return f"{token}.{_sign(token)}"
+
+def is_valid_session_id(session_id):
+    """Check that a session ID was issued by new_session_id() (the stored history is only returned to its holder)"""
+    if not isinstance(session_id, str) or len(session_id) > 128:
+        return False
+    token, _, signature = session_id.rpartition('.')
+    if not token or not signature:
+        return False
+    try:
+        return hmac.compare_digest(signature, _sign(token))
+    except Exception as e:
+        logger.error(f"Error checking session ID: {str(e)}")
+        return False
+
+class SessionStore:
+    """Server-side conversation histories, keyed by session ID.
+
+    The conversation files written by save_conversation are the source of
+    truth; this keeps the decoded history of recently active sessions in
+    memory and only re-reads a file when its modification time changed (for
+    example after another worker handled a turn). Turns of the same session
+    are serialized with a per-session lock so concurrent tabs do not lose
+    each other's messages.
+    """
+
+    def __init__(self, max_sessions=None):
+        """Initialize the session store"""
+        self.max_sessions = max_sessions or int(os.getenv('SESSION_STORE_MAX_SESSIONS', DEFAULT_MAX_SESSIONS))
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # session_id -> {'history', 'mtime', 'lock', 'async_lock'}
+
+    def _entry(self, session_id):
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                entry = {'history': None, 'mtime': None, 'lock': threading.Lock(), 'async_lock': None}
+                self.sessions[session_id] = entry
+                self._evict_locked()
+            else:
+                self.sessions.move_to_end(session_id)
+            return entry
+
+    def _evict_locked(self):
+        for session_id in list(self.sessions):
+            if len(self.sessions) <= self.max_sessions:
+                break
+            entry = self.sessions[session_id]
+            # Never drop a session while one of its turns is running
+            if not entry['lock'].locked() and not (entry['async_lock'] and entry['async_lock'].locked()):
+                del self.sessions[session_id]
+
+    def session_lock(self, session_id):
+        """Lock serializing the turns of a session (threads)"""
+        return self._entry(session_id)['lock']
+
+    def async_session_lock(self, session_id):
+        """Lock serializing the turns of a session (asyncio)"""
+        entry = self._entry(session_id)
+        with self.lock:
+            if entry['async_lock'] is None:
+                entry['async_lock'] = asyncio.Lock()
+            return entry['async_lock']
+
+    def _file_mtime(self, session_id):
+        try:
+            return os.stat(get_conversation_file(session_id)).st_mtime_ns
+        except OSError:
+            return None
+
+    def history(self, session_id):
+        """Return the stored history of a session ([] for a new session)"""
+        entry = self._entry(session_id)
+        mtime = self._file_mtime(session_id)
+        if entry['history'] is None or entry['mtime'] != mtime:
+            entry['history'] = load_conversation(session_id) if mtime is not None else []
+            entry['mtime'] = mtime
+        return list(entry['history'])
+
+    def remember(self, session_id, history):
+        """Record the history just saved for a session"""
+        entry = self._entry(session_id)
+        entry['history'] = list(history)
+        entry['mtime'] = self._file_mtime(session_id)
@@ -0,0 +1,325 @@
+import os
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: cross-process locks are not available
+    fcntl = None
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+class _Call:
+    """State of one in-flight call shared by its leader and its waiters"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class _StreamCall:
+    """State of one in-flight stream: chunks are buffered for every reader"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.readers = 0         # Changed under the SingleFlight lock
+        self.abandoned = False   # Every reader left: the pump stops upstream
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into a single execution.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is running wait and receive the same result (or error).
+    Nothing is cached once the call completes.
+    """
+
+    def __init__(self, name='single_flight'):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.streams = {}
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) once for all concurrent callers of key"""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            if call.waiters:
+                logger.debug(f"{self.name}: shared result with {call.waiters} waiting caller(s)")
+            call.done.set()
+
+    def do_stream(self, key, fn, *args, **kwargs):
+        """Iterate fn(*args, **kwargs) once for all concurrent readers of key.
+
+        The upstream iterator is drained by a background thread into a shared
+        buffer, so a reader that disconnects early does not affect the others.
+        Every reader receives every chunk from the beginning. Once the last
+        reader has gone, the upstream iterator is closed at its next chunk.
+        """
+        with self.lock:
+            call = self.streams.get(key)
+            if call is not None:
+                self.shared += 1
+            else:
+                call = _StreamCall()
+                self.streams[key] = call
+                self.executions += 1
+                threading.Thread(
+                    target=self._pump_stream,
+                    args=(key, call, fn, args, kwargs),
+                    daemon=True
+                ).start()
+            call.readers += 1
+
+        try:
+            position = 0
+            while True:
+                with call.condition:
+                    while position >= len(call.chunks) and not call.finished:
+                        call.condition.wait()
+                    pending = call.chunks[position:]
+                    finished = call.finished
+                    error = call.error
+
+                for chunk in pending:
+                    yield chunk
+                position += len(pending)
+
+                if finished and position >= len(call.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._leave_stream(key, call)
+
+    def _leave_stream(self, key, call):
+        with self.lock:
+            call.readers -= 1
+            if call.readers or call.finished:
+                return
+            # Last reader gone: later readers start a new stream
+            call.abandoned = True
+            if self.streams.get(key) is call:
+                del self.streams[key]
+        logger.debug(f"{self.name}: every reader left, stopping the stream")
+
+    def _pump_stream(self, key, call, fn, args, kwargs):
+        upstream = fn(*args, **kwargs)
+        try:
+            for chunk in upstream:
+                if call.abandoned:
+                    break
+                with call.condition:
+                    call.chunks.append(chunk)
+                    call.condition.notify_all()
+        except BaseException as e:
+            call.error = e
+        finally:
+            if hasattr(upstream, 'close'):
+                upstream.close()  # Runs the generator's cleanup (e.g. gives back its LLM slot)
+            with self.lock:
+                if self.streams.get(key) is call:
+                    del self.streams[key]
+            with call.condition:
+                call.finished = True
+                call.condition.notify_all()
+
+    def stats(self):
+        """Return the number of upstream executions and of shared results"""
+        with self.lock:
+            return {
+                'in_flight': len(self.calls) + len(self.streams),
+                'executions': self.executions,
+                'shared': self.shared
+            }
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight for the ASGI serving path
+
+    The call runs in its own task, so the caller that started it can go
+    away without affecting the others; it is cancelled only once every
+    caller waiting for it has gone.
+    """
+
+    def __init__(self, name='async_single_flight'):
+        self.name = name
+        self.calls = {}
+        self.streams = {}
+        self.tasks = set()  # Stream pumps, referenced until they finish
+        self.executions = 0
+        self.shared = 0
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        """Await coro_fn(*args, **kwargs) once for all concurrent callers of key"""
+        call = self.calls.get(key)
+        if call is not None:
+            self.shared += 1
+        else:
+            call = {'task': None, 'waiters': 0}
+            call['task'] = asyncio.get_running_loop().create_task(self._run(key, call, coro_fn, args, kwargs))
+            # Avoid "exception was never retrieved" warnings when nobody is waiting
+            call['task'].add_done_callback(lambda task: task.cancelled() or task.exception())
+            self.calls[key] = call
+            self.executions += 1
+
+        call['waiters'] += 1
+        try:
+            return await asyncio.shield(call['task'])
+        finally:
+            call['waiters'] -= 1
+            if not call['waiters'] and not call['task'].done():
+                # Last caller gone: stop the call, and let later callers start a new one
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+                call['task'].cancel()
+
+    async def _run(self, key, call, coro_fn, args, kwargs):
+        try:
+            return await coro_fn(*args, **kwargs)
+        finally:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+            if call['waiters'] > 1:
+                logger.debug(f"{self.name}: shared result with {call['waiters'] - 1} waiting caller(s)")
+
+    async def do_stream(self, key, agen_fn, *args, **kwargs):
+        """Iterate agen_fn(*args, **kwargs) once for all concurrent readers of key
+
+        The pump task is cancelled (closing the upstream generator) once
+        every reader has gone.
+        """
+        call = self.streams.get(key)
+        if call is not None:
+            self.shared += 1
+        else:
+            call = {'chunks': [], 'finished': False, 'error': None, 'changed': asyncio.Event(), 'readers': 0}
+            self.streams[key] = call
+            self.executions += 1
+            call['task'] = asyncio.get_running_loop().create_task(self._pump_stream(key, call, agen_fn, args, kwargs))
+            self.tasks.add(call['task'])
+            call['task'].add_done_callback(self.tasks.discard)
+        call['readers'] += 1
+
+        try:
+            position = 0
+            while True:
+                if position >= len(call['chunks']) and not call['finished']:
+                    call['changed'].clear()
+                    await call['changed'].wait()
+                    continue
+
+                pending = call['chunks'][position:]
+                for chunk in pending:
+                    yield chunk
+                position += len(pending)
+
+                if call['finished'] and position >= len(call['chunks']):
+                    if call['error'] is not None:
+                        raise call['error']
+                    return
+        finally:
+            call['readers'] -= 1
+            if not call['readers'] and not call['finished']:
+                # Last reader gone: stop the stream, and let later readers start a new one
+                if self.streams.get(key) is call:
+                    del self.streams[key]
+                call['task'].cancel()
+
+    async def _pump_stream(self, key, call, agen_fn, args, kwargs):
+        upstream = agen_fn(*args, **kwargs)
+        try:
+            async for chunk in upstream:
+                call['chunks'].append(chunk)
+                call['changed'].set()
+        except BaseException as e:
+            call['error'] = e
+        finally:
+            if hasattr(upstream, 'aclose'):
+                await upstream.aclose()  # Runs the generator's cleanup (e.g. gives back its LLM slot)
+            if self.streams.get(key) is call:
+                del self.streams[key]
+            call['finished'] = True
+            call['changed'].set()
+
+    def stats(self):
+        """Return the number of upstream executions and of shared results"""
+        return {
+            'in_flight': len(self.calls) + len(self.streams),
+            'executions': self.executions,
+            'shared': self.shared
+        }
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive cross-process lock on `path` (no-op without fcntl)"""
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _open_lock_file(path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    return open(path, 'a')
+
+@asynccontextmanager
+async def async_file_lock(path, poll_interval=0.05):
+    """Async variant of file_lock that polls instead of blocking the event loop"""
+    if fcntl is None:
+        yield
+        return
+
+    # Opening and closing may wait on the disk, flock with LOCK_NB never does
+    lock_file = await asyncio.to_thread(_open_lock_file, path)
+    try:
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    finally:
+        await asyncio.to_thread(lock_file.close)
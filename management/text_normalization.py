@@ -0,0 +1,12 @@
+import re
+import unicodedata
+
+def normalize_query(text):
+    """Normalize a user question so trivially different spellings compare equal.
+
+    Lowercases, collapses whitespace and strips surrounding punctuation,
+    e.g. "  What is Hypoglycemia ? " -> "what is hypoglycemia".
+    """
+    text = unicodedata.normalize('NFC', text or '').lower()
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip(" \t\n?!.,;:¿¡؟،")
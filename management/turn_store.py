@@ -0,0 +1,148 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Define paths
+TURN_STORE_PATH = "./turn_store"
+
+# Default settings (overridable through environment variables)
+DEFAULT_MAX_TURNS = 2000
+DEFAULT_TTL_SECONDS = 3600
+
+# Turn IDs are uuid4 hex strings issued by ChatService
+TURN_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+class TurnStore:
+    """Keeps the sources and images of recent chat turns.
+
+    Every /chat response carries these inline together with its turn ID;
+    the store only backs the legacy /get_sources, /get_source_details and
+    /get_images endpoints. Each turn is written to its own file under
+    turn_store/ (plus a pointer to the latest turn of each user), so a
+    request served by another gunicorn worker finds it too; recent turns
+    are also kept in memory, evicted oldest first once max_turns is reached.
+    Turns older than ttl_seconds are unknown (None) and their files are
+    removed by cleanup().
+    """
+
+    def __init__(self, max_turns=None, ttl_seconds=None, path=TURN_STORE_PATH):
+        """Initialize the turn store"""
+        self.max_turns = max_turns or int(os.getenv('TURN_STORE_MAX_TURNS', DEFAULT_MAX_TURNS))
+        self.ttl_seconds = ttl_seconds or float(os.getenv('TURN_STORE_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+        self.path = path
+        self.lock = threading.Lock()
+        self.turns = OrderedDict()   # turn_id -> turn
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+
+    def _turn_path(self, turn_id):
+        return os.path.join(self.path, f"{turn_id}.json")
+
+    def _latest_path(self, user_identifier):
+        # Hashed: user identifiers come from the client
+        digest = hashlib.sha256(user_identifier.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, f"latest_{digest}")
+
+    def _write(self, path, content):
+        """Replace a file atomically, so readers in other workers never see half of it"""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def record(self, turn_id, user_identifier, sources, images):
+        """Remember the sources and images of a turn"""
+        turn = {
+            'turn_id': turn_id,
+            'user_identifier': user_identifier,
+            'sources': sources,
+            'images': images,
+            'created': time.time()
+        }
+        with self.lock:
+            self.turns[turn_id] = turn
+            while len(self.turns) > self.max_turns:
+                self.turns.popitem(last=False)
+
+        try:
+            self._write(self._turn_path(turn_id), json.dumps(turn, ensure_ascii=False))
+            if user_identifier:
+                self._write(self._latest_path(user_identifier), turn_id)
+        except Exception as e:
+            logger.error(f"Error saving turn {turn_id}: {str(e)}")
+
+    def _load(self, turn_id):
+        """Return a turn from memory or from its file, or None"""
+        with self.lock:
+            turn = self.turns.get(turn_id)
+        if turn is not None:
+            return turn
+
+        try:
+            with open(self._turn_path(turn_id), 'r', encoding='utf-8') as f:
+                turn = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error loading turn {turn_id}: {str(e)}")
+            return None
+        with self.lock:
+            self.turns[turn_id] = turn
+            while len(self.turns) > self.max_turns:
+                self.turns.popitem(last=False)
+        return turn
+
+    def get(self, turn_id=None, user_identifier=None):
+        """Return a turn by ID, or the latest turn of a user; None if unknown"""
+        if not turn_id and user_identifier:
+            # Read from disk every time: the latest turn may come from another worker
+            try:
+                with open(self._latest_path(user_identifier), 'r', encoding='utf-8') as f:
+                    turn_id = f.read().strip()
+            except OSError:
+                return None
+        if not isinstance(turn_id, str) or not TURN_ID_PATTERN.match(turn_id):
+            return None
+
+        turn = self._load(turn_id)
+        if turn is None or turn['created'] < time.time() - self.ttl_seconds:
+            return None
+        if user_identifier and turn['user_identifier'] != user_identifier:
+            return None
+        return turn
+
+    def cleanup(self):
+        """Delete the files of expired turns; returns the number removed"""
+        cutoff = time.time() - self.ttl_seconds
+        count = 0
+        try:
+            for filename in os.listdir(self.path):
+                file_path = os.path.join(self.path, filename)
+                try:
+                    if os.path.getmtime(file_path) < cutoff:
+                        os.remove(file_path)
+                        count += 1
+                except OSError:
+                    continue
+        except Exception as e:
+            logger.error(f"Error cleaning up turns: {str(e)}")
+
+        with self.lock:
+            while self.turns:
+                turn = next(iter(self.turns.values()))
+                if turn['created'] >= cutoff:
+                    break
+                self.turns.popitem(last=False)
+
+        if count:
+            logger.info(f"Removed {count} expired turn files")
+        return count
@@ -0,0 +1,270 @@
+import os
+import json
+import logging
+import numpy as np
+from langchain_core.documents import Document
+from management.corpus_version import get_corpus_version
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Define paths
+VECTOR_INDEX_PATH = "./vector_index"
+EMBEDDINGS_FILE = "embeddings.npy"
+INT8_FILE = "embeddings_int8.npy"
+INT8_PARAMS_FILE = "int8_params.npy"
+NORMS_FILE = "squared_norms.npy"
+CHUNKS_FILE = "chunks.json"
+
+# Default settings (overridable through environment variables)
+DEFAULT_PRECISION = 'float32'   # float32 or int8
+DEFAULT_RESCORE_FACTOR = 4      # Compact search keeps k * factor candidates for float32 rescoring
+SCAN_BLOCK_ROWS = 2048          # int8 rows converted to float32 at a time (a few MB)
+
+PRECISIONS = ('float32', 'int8')
+
+def quantize_int8(embeddings):
+    """Scalar-quantize float32 rows to int8 with a per-dimension offset and scale
+
+    Returns:
+        tuple: (int8 matrix, params) where params[0] holds the offsets and
+        params[1] the scales, so that x ~= offset + scale * (q + 128)
+    """
+    if len(embeddings) == 0:
+        return np.zeros(embeddings.shape, dtype=np.int8), np.zeros((2, embeddings.shape[1]), dtype=np.float32)
+    low = embeddings.min(axis=0)
+    high = embeddings.max(axis=0)
+    scales = np.where(high > low, (high - low) / 255.0, 1.0).astype(np.float32)
+    codes = np.rint((embeddings - low) / scales) - 128
+    quantized = np.clip(codes, -128, 127).astype(np.int8)
+    return quantized, np.stack([low, scales]).astype(np.float32)
+
+def _save_array(path, array):
+    """Write a .npy file atomically"""
+    with open(f"{path}.tmp", 'wb') as f:
+        np.save(f, array)
+    os.replace(f"{path}.tmp", path)
+
+def export_vector_index(db, path=VECTOR_INDEX_PATH):
+    """Snapshot every chunk embedding of a Chroma database for NumpyVectorIndex
+
+    Writes embeddings.npy (one float32 row per chunk), its int8 quantized
+    copy, the squared row norms, and chunks.json (IDs, texts,
+    metadata, distance space and the corpus version the snapshot was taken
+    at). Every file is replaced atomically.
+
+    Returns:
+        int: number of chunks exported
+    """
+    data = db.get(include=['embeddings', 'documents', 'metadatas'])
+    embeddings = data.get('embeddings')
+    if embeddings is None or len(embeddings) == 0:
+        embeddings = np.zeros((0, 0), dtype=np.float32)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    collection_metadata = getattr(db, '_collection', None) and db._collection.metadata
+    space = (collection_metadata or {}).get('hnsw:space', 'l2')
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    quantized, int8_params = quantize_int8(embeddings)
+    _save_array(os.path.join(path, EMBEDDINGS_FILE), embeddings)
+    _save_array(os.path.join(path, INT8_FILE), quantized)
+    _save_array(os.path.join(path, INT8_PARAMS_FILE), int8_params)
+    _save_array(os.path.join(path, NORMS_FILE), np.einsum('ij,ij->i', embeddings, embeddings))
+
+    chunks_path = os.path.join(path, CHUNKS_FILE)
+    with open(f"{chunks_path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump({
+            'corpus_version': get_corpus_version(),
+            'space': space,
+            'ids': data['ids'],
+            'documents': data['documents'],
+            'metadatas': data['metadatas']
+        }, f, ensure_ascii=False)
+    os.replace(f"{chunks_path}.tmp", chunks_path)
+
+    logger.info(f"Exported {len(data['ids'])} chunk embeddings to {path}")
+    return len(data['ids'])
+
+class NumpyVectorIndex:
+    """Nearest-neighbour search over an in-memory embedding matrix.
+
+    A drop-in for the Chroma calls made on the query path. The float32
+    snapshot written by export_vector_index is memory-mapped, and a search
+    is a single matrix-vector product followed by argpartition. Distances
+    use the collection's space (squared L2 by default), so scores are on
+    Chroma's scale and the existing relevance threshold still applies.
+
+    With precision 'int8', only the quantized copy is loaded and scanned
+    (4x less memory per worker). The best k * rescore_factor
+    candidates are then rescored exactly from the float32 rows, which are
+    read from the memory map on demand. A rescore_factor of 0 returns the
+    approximate distances as they are.
+    """
+
+    def __init__(self, embedding_function=None, path=VECTOR_INDEX_PATH, precision=None, rescore_factor=None):
+        """Load the snapshot at path"""
+        self.embedding_function = embedding_function
+        self.path = path
+        self.precision = precision or os.getenv('VECTOR_INDEX_PRECISION', DEFAULT_PRECISION)
+        self.rescore_factor = rescore_factor if rescore_factor is not None else int(
+            os.getenv('VECTOR_INDEX_RESCORE_FACTOR', DEFAULT_RESCORE_FACTOR))
+        if self.precision not in PRECISIONS:
+            raise ValueError(f"Unsupported vector index precision: {self.precision}")
+
+        with open(os.path.join(path, CHUNKS_FILE), 'r', encoding='utf-8') as f:
+            chunks = json.load(f)
+        self.corpus_version = chunks.get('corpus_version')
+        self.space = chunks.get('space', 'l2')
+        self.ids = chunks['ids']
+        self.documents = chunks['documents']
+        self.metadatas = chunks['metadatas']
+        self.positions = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode='r')
+        if len(self.embeddings) != len(self.ids):
+            raise ValueError(f"Vector index is inconsistent: {len(self.embeddings)} vectors for {len(self.ids)} chunks")
+
+        # Row norms: squared for L2, plain for cosine (exported, or computed for older snapshots)
+        norms_path = os.path.join(path, NORMS_FILE)
+        if os.path.exists(norms_path):
+            self.squared_norms = np.load(norms_path)
+        elif len(self.embeddings):
+            self.squared_norms = np.einsum('ij,ij->i', self.embeddings, self.embeddings)
+        else:
+            self.squared_norms = np.zeros(0, dtype=np.float32)
+        self.norms = np.sqrt(self.squared_norms)
+
+        # Compact copy scanned instead of the float32 matrix
+        self.compact = None
+        self.int8_params = None
+        if self.precision == 'int8':
+            self.compact = np.load(os.path.join(path, INT8_FILE))
+            self.int8_params = np.load(os.path.join(path, INT8_PARAMS_FILE))
+
+        logger.info(f"Loaded vector index with {len(self.ids)} chunks ({self.space} distance, {self.precision})")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def memory_bytes(self):
+        """Bytes of vector data held in memory by this worker (the float32 map excluded when compact)"""
+        if self.compact is None:
+            return int(self.embeddings.nbytes + self.squared_norms.nbytes)
+        params = self.int8_params.nbytes if self.int8_params is not None else 0
+        return int(self.compact.nbytes + params + self.squared_norms.nbytes)
+
+    def _compact_dots(self, query):
+        """Approximate dot products of every row with the query, scanning the int8 copy"""
+        offsets, scales = self.int8_params
+        scaled_query = (scales * query).astype(np.float32)
+        correction = float(offsets @ query) + 128.0 * float(scaled_query.sum())
+
+        # Convert a block at a time for the float32 BLAS matmul (numpy has no fast int8
+        # kernel), without ever holding a float32 copy of the whole matrix
+        dots = np.empty(len(self.compact), dtype=np.float32)
+        for start in range(0, len(self.compact), SCAN_BLOCK_ROWS):
+            block = self.compact[start:start + SCAN_BLOCK_ROWS]
+            np.matmul(block.astype(np.float32), scaled_query, out=dots[start:start + len(block)])
+        return dots + correction
+
+    def _distances(self, dots, query, rows=None):
+        norms = self.norms if rows is None else self.norms[rows]
+        squared_norms = self.squared_norms if rows is None else self.squared_norms[rows]
+        if self.space == 'cosine':
+            denominator = norms * (np.linalg.norm(query) or 1.0)
+            return 1.0 - dots / np.where(denominator > 0, denominator, 1.0)
+        if self.space == 'ip':
+            return 1.0 - dots
+        return np.maximum(squared_norms - 2.0 * dots + float(query @ query), 0.0)
+
+    def _top(self, distances, k):
+        k = min(k, len(distances))
+        top = np.argpartition(distances, k - 1)[:k]
+        return top[np.argsort(distances[top], kind='stable')]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, **kwargs):
+        """Return the k closest chunks to an embedding as (Document, distance) pairs"""
+        if not self.ids:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+
+        if self.compact is None:
+            distances = self._distances(self.embeddings @ query, query)
+            top = self._top(distances, k)
+            scores = distances[top]
+        else:
+            approximate = self._distances(self._compact_dots(query), query)
+            if self.rescore_factor > 0:
+                candidates = np.sort(self._top(approximate, k * self.rescore_factor))
+                exact = self._distances(self.embeddings[candidates] @ query, query, candidates)
+                order = self._top(exact, k)
+                top, scores = candidates[order], exact[order]
+            else:
+                top = self._top(approximate, k)
+                scores = approximate[top]
+
+        return [
+            (Document(page_content=self.documents[i] or '', metadata=self.metadatas[i] or {}, id=self.ids[i]),
+             float(score))
+            for i, score in zip(top, scores)
+        ]
+
+    def similarity_search_with_vectors(self, embedding, k=4):
+        """Return the k closest chunks and a dict of their float32 rows (chunk ID -> vector)"""
+        hits = self.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+        vectors = {doc.id: np.asarray(self.embeddings[self.positions[doc.id]], dtype=np.float32) for doc, _ in hits}
+        return hits, vectors
+
+    def get(self, ids=None, include=None, **kwargs):
+        """Return chunks by ID in the shape of Chroma's get()"""
+        include = include or ['documents', 'metadatas']
+        if ids is None:
+            rows = list(range(len(self.ids)))
+        else:
+            rows = [self.positions[chunk_id] for chunk_id in ids if chunk_id in self.positions]
+
+        result = {'ids': [self.ids[row] for row in rows]}
+        if 'documents' in include:
+            result['documents'] = [self.documents[row] for row in rows]
+        if 'metadatas' in include:
+            result['metadatas'] = [self.metadatas[row] for row in rows]
+        if 'embeddings' in include:
+            result['embeddings'] = np.asarray(self.embeddings[rows], dtype=np.float32)
+        return result
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        """Embed a query and return the k closest chunks as (Document, distance) pairs"""
+        if self.embedding_function is None:
+            raise ValueError("An embedding function is required to search by text")
+        return self.similarity_search_by_vector_with_relevance_scores(
+            self.embedding_function.embed_query(query), k=k
+        )
+
+def vector_index_is_current(path=VECTOR_INDEX_PATH):
+    """Check whether the snapshot at path is complete and taken at the current corpus version"""
+    for name in (EMBEDDINGS_FILE, INT8_FILE, INT8_PARAMS_FILE, NORMS_FILE):
+        if not os.path.exists(os.path.join(path, name)):
+            return False
+    try:
+        with open(os.path.join(path, CHUNKS_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f).get('corpus_version') == get_corpus_version()
+    except (OSError, ValueError):
+        return False
+
+def load_vector_index(embedding_function=None, path=VECTOR_INDEX_PATH):
+    """Load the NumPy vector index, or None if it is missing or older than the corpus"""
+    try:
+        if not os.path.exists(os.path.join(path, CHUNKS_FILE)):
+            logger.warning(f"No vector index at {path}; run load_data.py to export one")
+            return None
+        index = NumpyVectorIndex(embedding_function, path)
+        if index.corpus_version != get_corpus_version():
+            logger.warning("Vector index is older than the document corpus; run load_data.py to refresh it")
+            return None
+        return index
+    except Exception as e:
+        logger.error(f"Error loading vector index: {str(e)}")
+        return None
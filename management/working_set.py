@@ -0,0 +1,165 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from management.corpus_version import get_corpus_version
+from management.metrics import count_cache
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+# Default settings (overridable through environment variables)
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_MAX_CHUNKS = 20              # Chunks remembered per session (about four turns)
+DEFAULT_MIN_QUERY_SIMILARITY = 0.6   # Cosine to the previous question or the session centroid
+DEFAULT_MIN_CHUNK_SIMILARITY = 0.5   # Cosine of the best working-set chunk, below which the full index is searched
+DEFAULT_TTL_SECONDS = 3600
+CENTROID_DECAY = 0.5                 # Weight of older questions in the session centroid
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm > 0 else vector
+
+def _distances(space, vectors, query):
+    """Distances between a query and rows of vectors, on the vector store's scale"""
+    dots = vectors @ query
+    if space == 'cosine':
+        norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query) or 1.0)
+        return 1.0 - dots / np.clip(norms, 1e-12, None)
+    if space == 'ip':
+        return 1.0 - dots
+    return np.einsum('ij,ij->i', vectors, vectors) - 2.0 * dots + float(query @ query)
+
+class SessionWorkingSets:
+    """Per-session working set of recently retrieved chunks.
+
+    Follow-up questions ("and for children?", "et la nuit ?") usually need
+    the chunks of the previous turns. Each session keeps those chunks with
+    their embeddings, its previous question vector and a decayed centroid
+    of its question vectors. When a new question is close to either, its
+    k nearest chunks are taken from the working set, provided the best one
+    is similar enough; otherwise the caller searches the full index and
+    records the result. Only full searches move the previous question and
+    the centroid, so a chain of follow-ups cannot drift away from the
+    chunks in the set. Working sets are dropped when the corpus version
+    changes, after ttl_seconds of inactivity, and LRU beyond max_sessions.
+    """
+
+    def __init__(self, max_sessions=None, max_chunks=None, min_query_similarity=None,
+                 min_chunk_similarity=None, ttl_seconds=None):
+        """Initialize the working sets"""
+        self.max_sessions = max_sessions or int(os.getenv('WORKING_SET_MAX_SESSIONS', DEFAULT_MAX_SESSIONS))
+        self.max_chunks = max_chunks or int(os.getenv('WORKING_SET_MAX_CHUNKS', DEFAULT_MAX_CHUNKS))
+        self.min_query_similarity = min_query_similarity if min_query_similarity is not None else float(
+            os.getenv('WORKING_SET_MIN_QUERY_SIMILARITY', DEFAULT_MIN_QUERY_SIMILARITY))
+        self.min_chunk_similarity = min_chunk_similarity if min_chunk_similarity is not None else float(
+            os.getenv('WORKING_SET_MIN_CHUNK_SIMILARITY', DEFAULT_MIN_CHUNK_SIMILARITY))
+        self.ttl_seconds = ttl_seconds or float(os.getenv('WORKING_SET_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # session ID -> working set, in LRU order
+        self.hits = 0
+        self.misses = 0
+
+    def _session(self, session_id, version):
+        """Return the live working set of a session, or None (lock held)"""
+        working_set = self.sessions.get(session_id)
+        if working_set is None:
+            return None
+        if working_set['corpus_version'] != version or time.time() - working_set['updated'] > self.ttl_seconds:
+            del self.sessions[session_id]
+            return None
+        self.sessions.move_to_end(session_id)
+        return working_set
+
+    def search(self, session_id, query_vector, space, k):
+        """Return the k nearest working-set chunks as (Document, distance) pairs, or None
+
+        None means the question is not a follow-up of the session or the
+        working set is not confident; the full index must be searched.
+        """
+        query = _unit(query_vector)
+        with self.lock:
+            working_set = self._session(session_id, get_corpus_version())
+            if working_set is not None:
+                chunks = list(working_set['chunks'].values())
+                previous = working_set['previous']
+                centroid = working_set['centroid']
+        if working_set is None or not chunks:
+            return None
+
+        docs = None
+        if max(float(query @ previous), float(query @ centroid)) >= self.min_query_similarity:
+            vectors = np.stack([vector for _, vector in chunks])
+            similarities = (vectors @ query) / np.clip(np.linalg.norm(vectors, axis=1), 1e-12, None)
+            if float(similarities.max()) >= self.min_chunk_similarity:
+                distances = _distances(space, vectors, np.asarray(query_vector, dtype=np.float32))
+                best = np.argsort(distances, kind='stable')[:k]
+                docs = [(chunks[i][0], float(distances[i])) for i in best]
+
+        with self.lock:
+            if docs is not None:
+                self.hits += 1
+                # Keep the session alive, but leave its question vectors where the chunks came from
+                working_set['updated'] = time.time()
+            else:
+                self.misses += 1
+        count_cache('working_set', docs is not None)
+        return docs
+
+    def record(self, session_id, query_vector, chunks):
+        """Add a question and its retrieved chunks ((Document, embedding) pairs) to a session"""
+        query = _unit(query_vector)
+        version = get_corpus_version()
+        with self.lock:
+            working_set = self._session(session_id, version)
+            if working_set is None:
+                working_set = {'chunks': OrderedDict(), 'centroid': query, 'corpus_version': version}
+                self.sessions[session_id] = working_set
+            else:
+                working_set['centroid'] = _unit(CENTROID_DECAY * working_set['centroid'] + query)
+            working_set['previous'] = query
+            working_set['updated'] = time.time()
+
+            for doc, vector in chunks:
+                chunk_id = doc.metadata.get('id') or getattr(doc, 'id', None)
+                working_set['chunks'][chunk_id] = (doc, np.asarray(vector, dtype=np.float32))
+                working_set['chunks'].move_to_end(chunk_id)
+            while len(working_set['chunks']) > self.max_chunks:
+                working_set['chunks'].popitem(last=False)
+
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def known_chunks(self, session_id):
+        """Return the IDs of the chunks already in a session's working set"""
+        with self.lock:
+            working_set = self.sessions.get(session_id)
+            return set(working_set['chunks']) if working_set is not None else set()
+
+    def stats(self):
+        """Return the number of sessions and the working-set hit rate"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'sessions': len(self.sessions),
+                'max_chunks': self.max_chunks,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+# Global session working sets
+_working_sets = None
+_working_sets_lock = threading.Lock()
+
+def get_working_sets():
+    """Return the process-wide SessionWorkingSets"""
+    global _working_sets
+    if _working_sets is None:
+        with _working_sets_lock:
+            if _working_sets is None:
+                _working_sets = SessionWorkingSets()
+    return _working_sets
@@ -11,6 +11,9 @@ logger = logging.getLogger(__name__)
 CHROMA_PATH = "./chroma_db"
 CONVERSATION_PATH = "./conversations"
 PROCESSED_FILES_PATH = "./processed_files.json"
+VECTOR_INDEX_PATH = "./vector_index"
+LEXICAL_INDEX_PATH = "./lexical_index.json"
+IMAGE_INDEX_PATH = "./image_index"
 
 def reset_database(reset_all=False, reset_embeddings=False, reset_conversations=False):
     """Reset the database files"""
@@ -23,6 +26,21 @@ def reset_database(reset_all=False, reset_embeddings=False, reset_conversations=
                 shutil.rmtree(CHROMA_PATH)
                 logger.info(f"Deleted Chroma database at {CHROMA_PATH}")
                 count += 1
+            
+            if os.path.exists(VECTOR_INDEX_PATH):
+                shutil.rmtree(VECTOR_INDEX_PATH)
+                logger.info(f"Deleted vector index at {VECTOR_INDEX_PATH}")
+                count += 1
+            
+            if os.path.exists(LEXICAL_INDEX_PATH):
+                os.remove(LEXICAL_INDEX_PATH)
+                logger.info(f"Deleted lexical index at {LEXICAL_INDEX_PATH}")
+                count += 1
+            
+            if os.path.exists(IMAGE_INDEX_PATH):
+                shutil.rmtree(IMAGE_INDEX_PATH)
+                logger.info(f"Deleted image index at {IMAGE_INDEX_PATH}")
+                count += 1
                 
             if os.path.exists(PROCESSED_FILES_PATH):
                 os.remove(PROCESSED_FILES_PATH)
@@ -8,6 +8,7 @@ const chatInput = document.getElementById('chat-input');
 const sendButton = document.getElementById('send-button');
 let isWaitingForResponse = false;
 const userIdentifier = generateUserIdentifier();
+let sessionId = null; // Issued by the server on the first message
 let selectedLanguage = ''; // Store the selected language
 const languageSelector = document.getElementById('language-selector');
 
@@ -636,6 +637,18 @@ function updatePlaceholderForLanguage(lang) {
 }
 
 // Generate a persistent user identifier
+// Get a session ID from the server (it only accepts IDs it issued)
+async function getSessionId() {
+    if (!sessionId) {
+        const response = await fetch('/session', { method: 'POST' });
+        if (!response.ok) {
+            throw new Error(`HTTP error! Status: ${response.status}`);
+        }
+        sessionId = (await response.json()).session_id;
+    }
+    return sessionId;
+}
+
 function generateUserIdentifier() {
     // Always generate a new identifier
     const identifier = 'user_' + Math.random().toString(36).substring(2, 15) + '_' + Date.now();
@@ -1275,77 +1288,197 @@ function hideTypingIndicator() {
     }
 }
 
-// Send a message to the server
-function sendMessageToServer(message) {
+// Get the error message shown when a request fails
+function getRequestErrorMessage() {
+    switch (selectedLanguage) {
+        case 'fr':
+            return `Désolé, je n'ai pas pu traiter votre demande. Veuillez réessayer ou vérifier votre connexion.`;
+        case 'ar':
+            return `عذرًا، لم أتمكن من معالجة طلبك. يرجى المحاولة مرة أخرى أو التحقق من اتصالك.`;
+        default:
+            return `Sorry, I couldn't process your request. Please try again or check your connection.`;
+    }
+}
+
+// Create an empty bot message that is filled in while the response streams
+function createStreamingBotMessage() {
+    const messageContainer = document.createElement('div');
+    messageContainer.className = 'message-container bot';
+    messageContainer.style.direction = selectedLanguage === 'ar' ? 'rtl' : 'ltr';
+    
+    const messageContent = document.createElement('div');
+    messageContent.className = 'message-content';
+    
+    const avatar = document.createElement('div');
+    avatar.className = 'avatar';
+    avatar.innerHTML = '<i data-feather="cpu"></i>';
+    
+    const messageText = document.createElement('div');
+    messageText.className = 'message-text prose max-w-none simple-response';
+    
+    messageContent.appendChild(avatar);
+    messageContent.appendChild(messageText);
+    messageContainer.appendChild(messageContent);
+    
+    chatHistory.appendChild(messageContainer);
+    feather.replace();
+    
+    return { messageContainer, messageText };
+}
+
+// Apply the final formatting to a streamed bot message
+function finalizeStreamingBotMessage(streamingMessage, content, images) {
+    const { messageContainer, messageText } = streamingMessage;
+    
+    content = removeGreetings(content);
+    content = cleanAndFormatResponse(content);
+    
+    const { mainContent, sourcesSection } = processMessageForSources(content);
+    messageText.innerHTML = formatSimpleResponse(mainContent);
+    
+    if (images && images.length > 0) {
+        displayImages(messageText, images);
+    }
+    
+    displaySources(messageText, sourcesSection);
+    
+    // Voice buttons were attached while the message was still empty
+    messageContainer.querySelectorAll('.voice-output-button, .stop-output-button').forEach(button => {
+        button.setAttribute('data-text', mainContent);
+    });
+    
+    feather.replace();
+    forceScrollToBottom();
+}
+
+// Parse a block of Server-Sent Event lines into { event, data }
+function parseServerSentEvent(block) {
+    let event = 'message';
+    const dataLines = [];
+    
+    block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) {
+            event = line.substring(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.substring(5).trim());
+        }
+    });
+    
+    if (dataLines.length === 0) {
+        return null;
+    }
+    
+    return { event, data: JSON.parse(dataLines.join('\n')) };
+}
+
+// Send a message to the server and render the response as it streams in
+async function sendMessageToServer(message) {
     console.log("Sending message to server:", message);
     console.log("Using language:", selectedLanguage);
     console.log("Conversation history:", conversationHistory);
     
-    fetch('/chat', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-            msg: message,
-            user_identifier: userIdentifier,
-            conversation_history: conversationHistory,
-            language: selectedLanguage
-        })
-    })
-    .then(response => {
+    let streamingMessage = null;
+    let streamedText = '';
+    
+    try {
+        const response = await fetch('/chat_stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            // The server keeps the history; send only what it needs to sync us up
+            body: JSON.stringify({
+                msg: message,
+                session_id: await getSessionId(),
+                since_turn: conversationHistory.length,
+                language: selectedLanguage
+            })
+        });
+        
         console.log("Response status:", response.status);
-        if (!response.ok) {
+        if (response.status === 400) {
+            // Session no longer accepted (e.g. new server key): get a new one next time
+            sessionId = null;
+        }
+        if (!response.ok || !response.body) {
             throw new Error(`HTTP error! Status: ${response.status}`);
         }
-        return response.json();
-    })
-    .then(data => {
-        console.log("Response received:", data);
-        // Hide the typing indicator
-        hideTypingIndicator();
         
-        // Update the conversation history
-        conversationHistory = data.conversation_history;
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let finished = false;
         
-        // Log the response content to help debug sources issues
-        console.log("Response content:", data.response);
-        if (data.response.includes("Sources:")) {
-            console.log("Response contains sources section");
-        } else {
-            console.log("Response does NOT contain sources section");
+        while (!finished) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            
+            buffer += decoder.decode(value, { stream: true });
+            
+            // Events are separated by a blank line
+            let separatorIndex;
+            while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.substring(0, separatorIndex);
+                buffer = buffer.substring(separatorIndex + 2);
+                
+                const parsed = parseServerSentEvent(block);
+                if (!parsed) {
+                    continue;
+                }
+                
+                if (parsed.event === 'token') {
+                    if (!streamingMessage) {
+                        hideTypingIndicator();
+                        streamingMessage = createStreamingBotMessage();
+                    }
+                    streamedText += parsed.data.content;
+                    streamingMessage.messageText.textContent = streamedText;
+                    forceScrollToBottom();
+                } else if (parsed.event === 'done') {
+                    console.log("Response received:", parsed.data);
+                    hideTypingIndicator();
+                    
+                    // Append the entries we did not have yet
+                    if (parsed.data.history_delta) {
+                        const since = parsed.data.history_length - parsed.data.history_delta.length;
+                        conversationHistory = conversationHistory.slice(0, since).concat(parsed.data.history_delta);
+                    } else if (parsed.data.conversation_history) {
+                        conversationHistory = parsed.data.conversation_history;
+                    }
+                    
+                    if (!streamingMessage) {
+                        streamingMessage = createStreamingBotMessage();
+                    }
+                    finalizeStreamingBotMessage(streamingMessage, parsed.data.response, parsed.data.images || null);
+                    
+                    // Extra call to ensure scroll - after all content and images might have loaded
+                    setTimeout(() => forceScrollToBottom(), 1000);
+                    finished = true;
+                    break;
+                } else if (parsed.event === 'error') {
+                    throw new Error(parsed.data.details || parsed.data.error);
+                }
+            }
         }
         
-        // Add the response to the chat with images if provided
-        addMessageToChat('bot', data.response, data.images || null);
-        
-        // Extra call to ensure scroll - after all content and images might have loaded
-        setTimeout(() => forceScrollToBottom(), 1000);
-    })
-    .catch(error => {
+        if (!finished) {
+            throw new Error('Response stream ended unexpectedly');
+        }
+    } catch (error) {
         console.error('Error:', error);
         
         // Hide the typing indicator
         hideTypingIndicator();
         
-        // Add an error message to the chat in the appropriate language
-        let errorMessage = '';
-        switch (selectedLanguage) {
-            case 'en':
-                errorMessage = `Sorry, I couldn't process your request. Please try again or check your connection.`;
-                break;
-            case 'fr':
-                errorMessage = `Désolé, je n'ai pas pu traiter votre demande. Veuillez réessayer ou vérifier votre connexion.`;
-                break;
-            case 'ar':
-                errorMessage = `عذرًا، لم أتمكن من معالجة طلبك. يرجى المحاولة مرة أخرى أو التحقق من اتصالك.`;
-                break;
-            default:
-                errorMessage = `Sorry, I couldn't process your request. Please try again or check your connection.`;
+        // Drop a partially streamed answer before showing the error
+        if (streamingMessage) {
+            streamingMessage.messageContainer.remove();
         }
         
-        addMessageToChat('bot', errorMessage);
-    });
+        addMessageToChat('bot', getRequestErrorMessage());
+    }
 }
 
 // Force scroll to bottom
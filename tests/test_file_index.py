@@ -0,0 +1,102 @@
+import os
+import re
+import random
+import pytest
+from management.file_index import FilenameIndex, normalize_filename, get_content_hash
+
+FILES = [
+    "Guide Diabète Type 2.pdf",
+    "guide_diabete_enfant.pdf",
+    "Thyroïde - Hypothyroïdie HAS 2023.pdf",
+    "Hyperthyroidie et grossesse.pdf",
+    "ADA Standards of Care 2024.pdf",
+    "Obesity management in adults.pdf",
+    "PCOS.pdf",
+    "سكري الحمل.pdf",
+    "notes.txt",
+]
+
+def old_find(available_files, filename):
+    """The /download_pdf lookup before FilenameIndex, kept as the reference"""
+    if filename in available_files:
+        return filename
+
+    matching_file = next((f for f in available_files if f.lower() == filename.lower()), None)
+
+    if not matching_file:
+        normalized_request = normalize_filename(filename).lower()
+        matching_file = next((f for f in available_files if normalize_filename(f).lower() == normalized_request), None)
+
+    if not matching_file:
+        matching_file = next((f for f in available_files if filename.lower() in f.lower()), None)
+
+    if not matching_file:
+        for file in available_files:
+            if file.lower() in filename.lower():
+                matching_file = file
+                break
+
+    if not matching_file:
+        words = re.findall(r'\b\w{4,}\b', filename.lower())
+        best_match = None
+        most_matches = 0
+        for file in available_files:
+            matches = sum(1 for word in words if word in file.lower())
+            if matches > most_matches:
+                most_matches = matches
+                best_match = file
+        if most_matches > 0:
+            matching_file = best_match
+
+    return matching_file
+
+@pytest.fixture
+def index(tmp_path):
+    for name in FILES:
+        (tmp_path / name).write_bytes(b'%PDF-1.4')
+    return FilenameIndex(str(tmp_path))
+
+def requests_for(files, count=1500, seed=7):
+    """Exact names plus random case changes, cuts, extensions and word mixes of them"""
+    rng = random.Random(seed)
+    words = [word for name in files for word in re.findall(r'\w+', name)]
+    requests = list(files) + ["", "pdf", "xx", "unknown document.pdf"]
+    for _ in range(count):
+        name = rng.choice(files)
+        kind = rng.randrange(6)
+        if kind == 0:
+            requests.append(name.upper())
+        elif kind == 1:
+            requests.append(name.replace(' ', '_').replace('é', 'e'))
+        elif kind == 2:
+            start = rng.randrange(len(name))
+            requests.append(name[start:start + rng.randint(1, 12)])
+        elif kind == 3:
+            requests.append(f"documents/{name} (copie)")
+        elif kind == 4:
+            requests.append(' '.join(rng.sample(words, rng.randint(1, 4))))
+        else:
+            requests.append(os.path.splitext(name)[0].lower())
+    return requests
+
+def test_find_matches_the_old_lookup(index):
+    files = index.files()
+    for request in requests_for(files):
+        assert index.find(request) == old_find(files, request), request
+
+def test_find_sees_new_files(index, tmp_path):
+    assert index.find("Calcium metabolism.pdf") is None
+    (tmp_path / "Calcium metabolism.pdf").write_bytes(b'%PDF-1.4')
+    # Directory mtimes can be coarse: force a visible change
+    stat = os.stat(tmp_path)
+    os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert index.find("Calcium metabolism.pdf") == "Calcium metabolism.pdf"
+
+def test_content_hash_follows_the_file(tmp_path):
+    path = tmp_path / "guide.pdf"
+    path.write_bytes(b'first')
+    first = get_content_hash(str(path))
+    assert get_content_hash(str(path)) == first
+
+    path.write_bytes(b'second version')
+    assert get_content_hash(str(path)) != first
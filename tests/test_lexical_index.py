@@ -0,0 +1,101 @@
+import numpy as np
+from langchain_core.documents import Document
+from management.lexical_index import (LexicalIndex, build_lexical_index, hybrid_search, tokenize,
+                                      RRF_K)
+
+DOCUMENTS = [
+    "Le diabète de type 2 se traite d'abord par la metformine.",
+    "L'HbA1c cible est inférieure à 7 % chez la plupart des adultes.",
+    "Hypothyroidism is treated with levothyroxine; check TSH after six weeks.",
+    "La TSH et la T4 libre confirment l'hypothyroïdie.",
+    "السكري من النوع الثاني يعالج بالميتفورمين",
+    "Metformin is the first line treatment of type 2 diabetes, metformin again.",
+]
+IDS = [f"chunk-{i}" for i in range(len(DOCUMENTS))]
+
+def make_index():
+    return LexicalIndex(build_lexical_index(IDS, DOCUMENTS))
+
+def test_tokenize_folds_accents_and_drops_stopwords():
+    assert tokenize("Le diabète de l'enfant") == ['diabete', 'enfant']
+    assert tokenize("HbA1c et T4") == ['hba1c', 't4']
+    # Arabic: article stripped, letter variants folded
+    assert tokenize("السكري") == tokenize("سكري")
+    assert tokenize("أنسولين") == tokenize("انسولين")
+
+def test_search_ranks_by_bm25():
+    index = make_index()
+    assert len(index) == len(DOCUMENTS)
+
+    hits = index.search("metformine", k=5)
+    assert [chunk_id for chunk_id, _ in hits] == ['chunk-0']
+
+    # No stemming: "metformin" does not match the French "metformine"
+    hits = index.search("metformin diabetes", k=5)
+    assert hits[0][0] == 'chunk-5'
+
+    hits = index.search("TSH", k=5)
+    assert {chunk_id for chunk_id, _ in hits} == {'chunk-2', 'chunk-3'}
+    assert all(score > 0 for _, score in hits)
+    assert [score for _, score in hits] == sorted((score for _, score in hits), reverse=True)
+
+def test_search_without_known_terms():
+    index = make_index()
+    assert index.search("") == []
+    assert index.search("le la de") == []
+    assert index.search("insulinothérapie") == []
+
+def test_rare_terms_weigh_more():
+    index = make_index()
+    # "hba1c" occurs once in the corpus, "type" twice
+    (_, rare), = index.search("hba1c", k=1)
+    (_, common), = index.search("type", k=1)
+    assert rare > common
+
+class FakeStore:
+    """Vector store with a fixed vector ranking and Chroma-like get()"""
+
+    space = 'l2'
+
+    def __init__(self, ranking, vectors):
+        self.ranking = ranking
+        self.vectors = vectors
+        self.fetched = []
+
+    def similarity_search_by_vector_with_relevance_scores(self, query_vector, k=4):
+        return [(Document(page_content=DOCUMENTS[IDS.index(chunk_id)], metadata={'id': chunk_id}), distance)
+                for chunk_id, distance in self.ranking[:k]]
+
+    def get(self, ids=None, include=None):
+        self.fetched.extend(ids)
+        return {
+            'ids': list(ids),
+            'documents': [DOCUMENTS[IDS.index(chunk_id)] for chunk_id in ids],
+            'metadatas': [{'id': chunk_id} for chunk_id in ids],
+            'embeddings': [self.vectors[chunk_id] for chunk_id in ids]
+        }
+
+def test_hybrid_search_fuses_ranks():
+    vectors = {chunk_id: np.full(4, i, dtype=np.float32) for i, chunk_id in enumerate(IDS)}
+    store = FakeStore([('chunk-2', 0.1), ('chunk-1', 0.2), ('chunk-4', 0.3)], vectors)
+    index = make_index()
+    query_vector = np.zeros(4, dtype=np.float32)
+
+    results = hybrid_search(store, index, "TSH hypothyroïdie", query_vector, k=3, candidate_factor=1)
+    ids = [doc.metadata['id'] for doc, _ in results]
+
+    # chunk-2 is found by both retrievers and wins; chunk-3 is found by BM25 only
+    lexical = [chunk_id for chunk_id, _ in index.search("TSH hypothyroïdie", k=3)]
+    fused = {}
+    for rank, (chunk_id, _) in enumerate(store.ranking):
+        fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    for rank, chunk_id in enumerate(lexical):
+        fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    assert ids == sorted(fused, key=lambda chunk_id: fused[chunk_id], reverse=True)[:3]
+    assert ids[0] == 'chunk-2'
+
+    # Vector distances are kept, and computed for chunks found by BM25 only
+    distances = dict((doc.metadata['id'], distance) for doc, distance in results)
+    assert distances['chunk-2'] == 0.1
+    assert store.fetched == ['chunk-3']
+    assert distances['chunk-3'] == float(vectors['chunk-3'] @ vectors['chunk-3'])
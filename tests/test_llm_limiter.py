@@ -0,0 +1,162 @@
+import time
+import asyncio
+import threading
+import pytest
+from management.llm_limiter import LLMLimiter, LLMOverloadedError, is_rate_limit_error
+
+class RateLimitError(Exception):
+    status_code = 429
+
+def hold_slots(limiter, count):
+    """Occupy count slots from background threads until the returned event is set"""
+    release = threading.Event()
+    entered = threading.Semaphore(0)
+
+    def hold():
+        with limiter.slot():
+            entered.release()
+            release.wait(5)
+
+    threads = [threading.Thread(target=hold) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for _ in range(count):
+        entered.acquire(timeout=2)
+    return release, threads
+
+def test_queued_request_gets_the_next_free_slot():
+    limiter = LLMLimiter(max_in_flight=1, max_queue=2, queue_timeout=2)
+    release, threads = hold_slots(limiter, 1)
+
+    admitted = threading.Event()
+
+    def queued():
+        with limiter.slot():
+            admitted.set()
+
+    waiter = threading.Thread(target=queued)
+    waiter.start()
+    time.sleep(0.05)
+    assert limiter.stats()['queue_depth'] == 1
+    assert not admitted.is_set()
+
+    release.set()
+    assert admitted.wait(2)
+    waiter.join(2)
+    for thread in threads:
+        thread.join(2)
+    stats = limiter.stats()
+    assert stats['in_flight'] == 0
+    assert stats['admitted'] == 2
+
+def test_full_queue_is_rejected_right_away():
+    limiter = LLMLimiter(max_in_flight=1, max_queue=0, queue_timeout=2)
+    release, threads = hold_slots(limiter, 1)
+    assert limiter.is_saturated()
+
+    started = time.monotonic()
+    with pytest.raises(LLMOverloadedError) as error:
+        with limiter.slot():
+            pass
+    assert time.monotonic() - started < 0.5
+    assert error.value.retry_after >= 1
+    assert limiter.stats()['rejected'] == 1
+
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+def test_queue_timeout():
+    limiter = LLMLimiter(max_in_flight=1, max_queue=1, queue_timeout=0.05)
+    release, threads = hold_slots(limiter, 1)
+
+    with pytest.raises(LLMOverloadedError):
+        with limiter.slot():
+            pass
+    stats = limiter.stats()
+    assert stats['timed_out'] == 1
+    assert stats['queue_depth'] == 0
+
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    assert limiter.stats()['in_flight'] == 0
+
+def test_rate_limit_halves_the_limit_and_successes_grow_it_back():
+    limiter = LLMLimiter(max_in_flight=8, max_queue=4, queue_timeout=1)
+
+    with pytest.raises(RateLimitError):
+        with limiter.slot():
+            raise RateLimitError()
+    assert limiter.stats()['limit'] == 4
+    assert limiter.stats()['rate_limited'] == 1
+
+    # A second 429 within the cooldown is counted but does not lower the limit again
+    limiter.report_rate_limit()
+    assert limiter.stats()['limit'] == 4
+    assert limiter.stats()['rate_limited'] == 2
+
+    # Additive increase: +1/limit per successful call, about one slot per round
+    for _ in range(5):
+        with limiter.slot():
+            pass
+    assert limiter.stats()['limit'] == 5
+    for _ in range(100):
+        with limiter.slot():
+            pass
+    assert limiter.stats()['limit'] == 8
+
+def test_other_errors_leave_the_limit_alone():
+    limiter = LLMLimiter(max_in_flight=4, max_queue=4, queue_timeout=1)
+    with pytest.raises(ValueError):
+        with limiter.slot():
+            raise ValueError('bad prompt')
+    assert limiter.stats()['limit'] == 4
+    assert limiter.stats()['in_flight'] == 0
+
+def test_try_acquire_never_jumps_the_queue():
+    limiter = LLMLimiter(max_in_flight=2, max_queue=4, queue_timeout=1)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release(0.01)
+    limiter.release(0.01)
+    assert limiter.stats()['in_flight'] == 0
+
+def test_is_rate_limit_error():
+    class Response:
+        status_code = 429
+
+    class WrappedError(Exception):
+        response = Response()
+
+    assert is_rate_limit_error(RateLimitError())
+    assert is_rate_limit_error(WrappedError())
+    assert not is_rate_limit_error(ValueError())
+
+def test_async_slots_queue_and_give_back_cancelled_waits():
+    async def main():
+        limiter = LLMLimiter(max_in_flight=1, max_queue=2, queue_timeout=2)
+        release = asyncio.Event()
+        order = []
+
+        async def call(name):
+            async with limiter.aslot():
+                order.append(name)
+                await release.wait()
+
+        first = asyncio.ensure_future(call('first'))
+        await asyncio.sleep(0.01)
+        cancelled = asyncio.ensure_future(call('cancelled'))
+        second = asyncio.ensure_future(call('second'))
+        await asyncio.sleep(0.01)
+        assert limiter.stats()['queue_depth'] == 2
+
+        cancelled.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(first, second)
+        assert order == ['first', 'second']
+        assert limiter.stats()['in_flight'] == 0
+
+    asyncio.run(main())
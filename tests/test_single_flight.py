@@ -0,0 +1,173 @@
+import time
+import asyncio
+import threading
+from management.single_flight import SingleFlight, AsyncSingleFlight
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+def test_do_shares_one_execution():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return 'answer'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+    leader.start()
+    started.wait(2)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    assert wait_until(lambda: flight.stats()['shared'] == 3)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(2)
+
+    assert results == ['answer'] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {'in_flight': 0, 'executions': 1, 'shared': 3}
+
+def test_do_shares_errors_and_forgets_the_call():
+    flight = SingleFlight()
+
+    def failing():
+        raise ValueError('boom')
+
+    for _ in range(2):
+        try:
+            flight.do('key', failing)
+        except ValueError as e:
+            assert str(e) == 'boom'
+        else:
+            raise AssertionError('error not raised')
+    assert flight.stats()['executions'] == 2
+
+def test_do_stream_gives_every_reader_every_chunk():
+    flight = SingleFlight()
+
+    def chunks():
+        for i in range(5):
+            time.sleep(0.005)
+            yield i
+
+    first = flight.do_stream('key', chunks)
+    assert next(first) == 0
+    second = flight.do_stream('key', chunks)
+    assert list(second) == [0, 1, 2, 3, 4]
+    assert list(first) == [1, 2, 3, 4]
+    assert flight.stats() == {'in_flight': 0, 'executions': 1, 'shared': 1}
+
+def test_do_stream_closes_upstream_when_every_reader_leaves():
+    flight = SingleFlight()
+    produced = []
+    closed = threading.Event()
+
+    def chunks():
+        try:
+            for i in range(1000):
+                time.sleep(0.005)
+                produced.append(i)
+                yield i
+        finally:
+            closed.set()
+
+    first = flight.do_stream('key', chunks)
+    second = flight.do_stream('key', chunks)
+    next(first)
+    next(second)
+    first.close()
+    time.sleep(0.05)
+    assert not closed.is_set()
+
+    second.close()
+    assert closed.wait(1)
+    assert len(produced) < 1000
+    assert flight.stats()['in_flight'] == 0
+
+def test_async_do_survives_the_leader_leaving():
+    async def main():
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def slow():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'answer'
+
+        leader = asyncio.ensure_future(flight.do('key', slow))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(flight.do('key', slow))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == 'answer'
+        assert len(calls) == 1
+
+    asyncio.run(main())
+
+def test_async_do_cancels_when_every_caller_leaves():
+    async def main():
+        flight = AsyncSingleFlight()
+        cancelled = asyncio.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.ensure_future(flight.do('key', slow)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert flight.stats()['in_flight'] == 0
+
+    asyncio.run(main())
+
+def test_async_do_stream_shares_and_stops_upstream():
+    async def main():
+        flight = AsyncSingleFlight()
+        closed = asyncio.Event()
+
+        async def chunks(count):
+            try:
+                for i in range(count):
+                    await asyncio.sleep(0.005)
+                    yield i
+            finally:
+                closed.set()
+
+        async def collect(stream):
+            return [chunk async for chunk in stream]
+
+        results = await asyncio.gather(collect(flight.do_stream('short', chunks, 3)),
+                                       collect(flight.do_stream('short', chunks, 3)))
+        assert results == [[0, 1, 2], [0, 1, 2]]
+        assert flight.stats()['executions'] == 1
+
+        closed.clear()
+        first = flight.do_stream('long', chunks, 1000)
+        second = flight.do_stream('long', chunks, 1000)
+        assert await first.__anext__() == 0
+        assert await second.__anext__() == 0
+        await first.aclose()
+        await asyncio.sleep(0.02)
+        assert not closed.is_set()
+        await second.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+        assert flight.stats()['in_flight'] == 0
+
+    asyncio.run(main())
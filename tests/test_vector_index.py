@@ -0,0 +1,131 @@
+import json
+import numpy as np
+import pytest
+from management.vector_index import (NumpyVectorIndex, export_vector_index, load_vector_index,
+                                     vector_index_is_current)
+
+DIMENSIONS = 64
+
+class FakeCollection:
+    def __init__(self, space):
+        self.metadata = {'hnsw:space': space}
+
+class FakeChroma:
+    """Just enough of the Chroma API for export_vector_index"""
+
+    def __init__(self, embeddings, space='l2'):
+        self.embeddings = embeddings
+        self._collection = FakeCollection(space)
+
+    def get(self, include=None):
+        count = len(self.embeddings)
+        return {
+            'ids': [f"chunk-{i}" for i in range(count)],
+            'documents': [f"text {i}" for i in range(count)],
+            'metadatas': [{'id': f"chunk-{i}", 'source': f"doc-{i % 7}.pdf"} for i in range(count)],
+            'embeddings': self.embeddings
+        }
+
+def topic_vectors(rng, count, topics=12):
+    """Unit vectors grouped around a few centroids, like embeddings of a handful of guidelines"""
+    centroids = rng.normal(size=(topics, DIMENSIONS))
+    vectors = centroids[rng.integers(0, topics, count)] + 0.35 * rng.normal(size=(count, DIMENSIONS))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+def exact_search(embeddings, query, k, space):
+    if space == 'cosine':
+        distances = 1.0 - embeddings @ query / (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query))
+    elif space == 'ip':
+        distances = 1.0 - embeddings @ query
+    else:
+        distances = ((embeddings - query) ** 2).sum(axis=1)
+    order = np.argsort(distances, kind='stable')[:k]
+    return [f"chunk-{i}" for i in order], distances[order]
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    """Run in a scratch directory, so the corpus version is the one of a fresh install"""
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(3)
+    return topic_vectors(rng, 1500), topic_vectors(rng, 60)
+
+@pytest.mark.parametrize('space', ['l2', 'cosine', 'ip'])
+def test_search_is_exact(corpus, tmp_path, space):
+    embeddings, queries = corpus
+    export_vector_index(FakeChroma(embeddings, space), str(tmp_path / 'index'))
+    index = NumpyVectorIndex(path=str(tmp_path / 'index'))
+    assert len(index) == len(embeddings)
+
+    for query in queries:
+        expected_ids, expected_distances = exact_search(embeddings, query, 5, space)
+        hits = index.similarity_search_by_vector_with_relevance_scores(query.tolist(), k=5)
+        assert [doc.metadata['id'] for doc, _ in hits] == expected_ids
+        assert np.allclose([score for _, score in hits], expected_distances, atol=1e-4)
+
+def test_get_and_search_with_vectors(corpus, tmp_path):
+    embeddings, queries = corpus
+    export_vector_index(FakeChroma(embeddings), str(tmp_path / 'index'))
+    index = NumpyVectorIndex(path=str(tmp_path / 'index'))
+
+    data = index.get(ids=['chunk-3', 'missing', 'chunk-1'], include=['documents', 'metadatas', 'embeddings'])
+    assert data['ids'] == ['chunk-3', 'chunk-1']
+    assert data['documents'] == ['text 3', 'text 1']
+    assert np.array_equal(data['embeddings'], embeddings[[3, 1]])
+
+    hits, vectors = index.similarity_search_with_vectors(queries[0], k=4)
+    assert set(vectors) == {doc.id for doc, _ in hits}
+    for doc, _ in hits:
+        assert np.array_equal(vectors[doc.id], embeddings[int(doc.id.split('-')[1])])
+
+def test_snapshot_follows_the_corpus_version(corpus, tmp_path):
+    embeddings, _ = corpus
+    path = str(tmp_path / 'index')
+    export_vector_index(FakeChroma(embeddings), path)
+    assert vector_index_is_current(path)
+    assert load_vector_index(path=path) is not None
+
+    # load_data.py records a new corpus version after each ingestion
+    with open('processed_files.json', 'w') as f:
+        json.dump({'_corpus_version': 'next'}, f)
+    assert not vector_index_is_current(path)
+    assert load_vector_index(path=path) is None
+
+def recall(index, reference, queries, k):
+    found = 0
+    for query in queries:
+        expected = {doc.id for doc, _ in reference.similarity_search_by_vector_with_relevance_scores(query, k=k)}
+        hits = index.similarity_search_by_vector_with_relevance_scores(query, k=k)
+        found += len(expected & {doc.id for doc, _ in hits})
+    return found / (k * len(queries))
+
+def test_int8_recall_against_float32(corpus, tmp_path):
+    embeddings, queries = corpus
+    path = str(tmp_path / 'index')
+    export_vector_index(FakeChroma(embeddings), path)
+    exact = NumpyVectorIndex(path=path, precision='float32')
+
+    approximate = NumpyVectorIndex(path=path, precision='int8', rescore_factor=0)
+    rescored = NumpyVectorIndex(path=path, precision='int8', rescore_factor=4)
+    assert recall(approximate, exact, queries, 5) >= 0.9
+    assert recall(rescored, exact, queries, 5) == 1.0
+
+    # Rescored distances are the exact float32 ones
+    query = queries[0]
+    assert np.allclose([score for _, score in rescored.similarity_search_by_vector_with_relevance_scores(query, k=5)],
+                       [score for _, score in exact.similarity_search_by_vector_with_relevance_scores(query, k=5)],
+                       atol=1e-5)
+
+def test_int8_keeps_a_quarter_of_the_memory(corpus, tmp_path):
+    embeddings, _ = corpus
+    path = str(tmp_path / 'index')
+    export_vector_index(FakeChroma(embeddings), path)
+    exact = NumpyVectorIndex(path=path, precision='float32')
+    compact = NumpyVectorIndex(path=path, precision='int8')
+    assert compact.memory_bytes() < exact.memory_bytes() / 3
+
+def test_unknown_precision_is_rejected(corpus, tmp_path):
+    embeddings, _ = corpus
+    path = str(tmp_path / 'index')
+    export_vector_index(FakeChroma(embeddings), path)
+    with pytest.raises(ValueError):
+        NumpyVectorIndex(path=path, precision='float16')
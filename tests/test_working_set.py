@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from management.working_set import SessionWorkingSets
+
+DIMENSIONS = 16
+
+def direction(*weights):
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    vector[:len(weights)] = weights
+    return vector / np.linalg.norm(vector)
+
+def chunk(chunk_id):
+    return Document(page_content=f"text of {chunk_id}", metadata={'id': chunk_id})
+
+@pytest.fixture
+def working_sets(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Fixed corpus version: no processed_files.json
+    sets = SessionWorkingSets(max_sessions=2, max_chunks=3, min_query_similarity=0.6,
+                              min_chunk_similarity=0.5, ttl_seconds=60)
+    sets.record('session', direction(1, 0), [
+        (chunk('a'), direction(1, 0.1)),
+        (chunk('b'), direction(1, 0.4)),
+        (chunk('c'), direction(0, 1)),
+    ])
+    return sets
+
+def test_follow_up_is_served_from_the_working_set(working_sets):
+    hits = working_sets.search('session', direction(1, 0.2), 'l2', k=2)
+    assert [doc.metadata['id'] for doc, _ in hits] == ['a', 'b']
+    assert hits[0][1] < hits[1][1]
+    assert working_sets.stats()['hits'] == 1
+
+def test_unrelated_question_searches_the_full_index(working_sets):
+    # Cosine 0 with both the previous question and the centroid
+    assert working_sets.search('session', direction(0, 0, 1), 'l2', k=2) is None
+    assert working_sets.stats()['misses'] == 1
+
+def test_weak_chunks_search_the_full_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sets = SessionWorkingSets(min_query_similarity=0.6, min_chunk_similarity=0.9)
+    sets.record('session', direction(1, 0), [(chunk('a'), direction(1, 1))])
+    # Close to the previous question, but the best chunk has cosine 0.71 < 0.9
+    assert sets.search('session', direction(1, 0), 'l2', k=1) is None
+
+def test_query_similarity_threshold(working_sets):
+    # Cosine 0.8 and 0.5 to the previous question (and to the centroid)
+    assert working_sets.search('session', direction(0.8, 0.6), 'l2', k=1) is not None
+    assert working_sets.search('session', direction(0.5, 0.866), 'l2', k=1) is None
+
+def test_hits_do_not_move_the_question_vectors(working_sets):
+    before = working_sets.sessions['session']
+    previous, centroid = before['previous'].copy(), before['centroid'].copy()
+    for _ in range(5):
+        assert working_sets.search('session', direction(0.8, 0.6), 'l2', k=1) is not None
+    assert np.array_equal(before['previous'], previous)
+    assert np.array_equal(before['centroid'], centroid)
+
+def test_chunks_and_sessions_are_bounded(working_sets):
+    working_sets.record('session', direction(1, 0), [(chunk('d'), direction(1, 0))])
+    assert working_sets.known_chunks('session') == {'b', 'c', 'd'}
+
+    working_sets.record('second', direction(1, 0), [(chunk('e'), direction(1, 0))])
+    working_sets.record('third', direction(1, 0), [(chunk('f'), direction(1, 0))])
+    assert working_sets.known_chunks('session') == set()
+    assert working_sets.stats()['sessions'] == 2
+
+def test_corpus_change_drops_working_sets(working_sets):
+    with open('processed_files.json', 'w') as f:
+        f.write('{"_corpus_version": "next"}')
+    assert working_sets.search('session', direction(1, 0.2), 'l2', k=2) is None
+    assert working_sets.known_chunks('session') == set()